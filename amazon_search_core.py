@@ -1,223 +1,369 @@
 import boto3, os
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
 import traceback
 from flask import Flask, request, jsonify
 import io
 import fitz  # PyMuPDF - כבר נמצא ב-requirements שלך
 from docx import Document  # כבר נמצא ב-requirements שלך
-import pytesseract
-from amazon_search_utilities import match_line, highlight_matches_html, search_in_json_content
+from amazon_search_utilities import highlight_matches_html
 from PIL import Image
 import json
 import config_reader
-from document_parsers import extract_text_for_indexing
+from document_parsers import extract_text_for_indexing, FITZ_LOCK
+from ocr_engine import ocr_image
+from search_index import SearchIndex, group_refs_by_page
+from revalidation import DocumentVersionCache, PeriodicRefresher
+from search_stream import requested_stream_format, stream_search_response
+from search_encoding import (install_response_compression, hit_encoding_from_config, encode_match_entries,
+                             search_response)
+from search_paging import window_from_config
+from search_result_cache import SearchResultCache, result_cache_key, cached_search
+from search_kernel import (compile_search, iter_line_hits, iter_context_hits, hit_entry, context_html,
+                           render_from_config)
+from text_normalize import attach_normalized_lines
 
 cloud_provider="Amazon"
 PROVIDER_CONFIG=config_reader.set_provider_config(cloud_provider)
 
 BUCKET_NAME = PROVIDER_CONFIG["BUCKET_NAME"]
 
+# Line index (words + trigrams) reused across requests; documents whose
+# content did not change since the last request are not re-tokenized.
+SEARCH_INDEX = SearchIndex()
 
+# Parsed documents by S3 key + (object ETag, sidecar ETag). A listing is
+# metadata only, so unchanged objects are never downloaded or parsed twice.
+DOCUMENT_VERSIONS = DocumentVersionCache()
 
+# Finished keyword searches (RESULT_CACHE_MAX_MB); the index generation is
+# the corpus version: it moves when a document is added, changed or removed.
+SEARCH_RESULTS = SearchResultCache()
 
+# Bounded fetch pipeline shared by all requests: JSON indexes/originals are
+# downloaded MAX_CONCURRENT_DOWNLOADS at a time over the client's pooled connections.
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv("MAX_CONCURRENT_DOWNLOADS", "16"))
+FETCH_POOL = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_DOWNLOADS, thread_name_prefix="s3-fetch")
+PARSE_LOCK = FITZ_LOCK  # the same lock document_parsers takes for its own fitz passes
 
 
-app = Flask(__name__)
-s3 = boto3.client('s3')
-# --- AWS Configuration ---
-
-def get_documents_for_path(directory_path):
-    documents = []
-    try:
-        paginator = s3.get_paginator('list_objects_v2')
-        base_prefix = directory_path.strip('/') + '/' if directory_path else ""
-
-        for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=base_prefix):
-            if 'Contents' not in page: continue
 
-            for obj in page['Contents']:
-                key = obj['Key']
-                filename = key.split('/')[-1]
 
-                # Skip folders and existing index folder
-                if key.endswith('/') or filename.startswith('~$') or key.startswith('.index/'):
-                    continue
-
-                base_path = key.rsplit('.', 1)[0] if '.' in key else key
-                index_key = f".index/{base_path}.json".replace("//", "/")
-
-                pages = []
-                try:
-                    # 1. Attempt to load JSON Index
-                    idx_resp = s3.get_object(Bucket=BUCKET_NAME, Key=index_key)
-                    index_data = json.loads(idx_resp['Body'].read().decode('utf-8'))
-                    raw_pages = index_data.get("pages", [])
-
-                    # 2. FIX: Ensure pages is a list of DICTS, not strings (Fixes AttributeError)
-                    for idx, p in enumerate(raw_pages):
-                        if isinstance(p, str):
-                            pages.append({"page_number": idx + 1, "lines": [p]})
-                        else:
-                            pages.append(p)
 
 
+app = Flask(__name__)
+# Compact JSON, gzip/brotli by Accept-Encoding (search_encoding)
+install_response_compression(app)
+# boto3 clients are thread-safe; size the connection pool to the fetch workers (default is 10)
+s3 = boto3.client('s3', config=Config(max_pool_connections=MAX_CONCURRENT_DOWNLOADS))
+# --- AWS Configuration ---
 
-                except s3.exceptions.NoSuchKey:
+def load_s3_document(obj, base_prefix, sidecar_etags):
+    """
+    Builds one document: the .index/ JSON first, the original object (with
+    OCR for scans) as a fallback. Runs on FETCH_POOL, many objects at a time.
+    Returns None if the object cannot be parsed.
+    """
+    key = obj['Key']
+    filename = key.split('/')[-1]
+
+    base_path = key.rsplit('.', 1)[0] if '.' in key else key
+    index_key = f".index/{base_path}.json".replace("//", "/")
+
+    version = (obj['ETag'], sidecar_etags.get(index_key))
+    cached_doc = DOCUMENT_VERSIONS.get(key, version)
+    if cached_doc is not None:
+        return cached_doc
+
+    pages = []
+    complete = True  # False: OCR missed pages, the document is not cached or stored
+    try:
+        # 1. Attempt to load JSON Index
+        idx_resp = s3.get_object(Bucket=BUCKET_NAME, Key=index_key)
+        index_data = json.loads(idx_resp['Body'].read().decode('utf-8'))
+        raw_pages = index_data.get("pages", [])
 
-                    file_obj = s3.get_object(Bucket=BUCKET_NAME, Key=key)
+        # 2. FIX: Ensure pages is a list of DICTS, not strings (Fixes AttributeError)
+        for idx, p in enumerate(raw_pages):
+            if isinstance(p, str):
+                pages.append({"page_number": idx + 1, "lines": [p]})
+            else:
+                pages.append(p)
 
-                    file_content = file_obj['Body'].read()
+    except s3.exceptions.NoSuchKey:
 
-                    file_ext = filename.lower()
+        file_obj = s3.get_object(Bucket=BUCKET_NAME, Key=key)
 
-                    pages = []  # אתחול תמיד
+        file_content = file_obj['Body'].read()
 
-                    print(f"🔍 Index missing for {filename}. Extracting real content...")
+        file_ext = filename.lower()
 
-                    if file_ext.endswith('.docx'):
+        pages = []  # אתחול תמיד
 
-                        doc_reader = Document(io.BytesIO(file_content))
+        print(f"🔍 Index missing for {filename}. Extracting real content...")
 
-                        extracted_text = "\n".join([para.text for para in doc_reader.paragraphs])
+        if file_ext.endswith('.docx'):
 
-                        pages = [{"page_number": 1, "lines": extracted_text.splitlines()}]
+            doc_reader = Document(io.BytesIO(file_content))
 
+            extracted_text = "\n".join([para.text for para in doc_reader.paragraphs])
 
-                    elif file_ext.endswith('.pdf'):
+            pages = [{"page_number": 1, "lines": extracted_text.splitlines()}]
 
-                        with fitz.open(stream=file_content, filetype="pdf") as pdf:
 
-                            num_pages = len(pdf)
+        elif file_ext.endswith('.pdf'):
 
-                            # חילוץ טקסט דיגיטלי ראשוני
+            # PyMuPDF is not thread-safe: only this text pass is serialized. The OCR
+            # below runs outside the lock (it opens its own document, on the OCR pool)
+            with PARSE_LOCK:
+                with fitz.open(stream=file_content, filetype="pdf") as pdf:
 
-                            full_digital_text = "\n".join([p.get_text() for p in pdf])
+                    # חילוץ טקסט דיגיטלי ראשוני
 
-                        # בדיקת סף OCR
+                    page_texts = [p.get_text() for p in pdf]
 
-                        avg_chars = len(full_digital_text) / max(num_pages, 1)
+            num_pages = len(page_texts)
+            full_digital_text = "\n".join(page_texts)
 
-                        if avg_chars < 200:
+            # בדיקת סף OCR
 
-                            print(f"🚀 OCR triggered (Avg chars: {avg_chars:.1f})")
+            avg_chars = len(full_digital_text) / max(num_pages, 1)
 
-                            raw_pages, was_ocr = extract_text_for_indexing(file_content, '.pdf', isLTR=None)
-                            pages = [{"page_number": p["page"], "lines": p["lines"]} for p in raw_pages]
+            if avg_chars < 200:
 
-                            index_data = {
-                                "filename": filename,
-                                "pages": raw_pages,
-                                "timestamp": time.time()
-                            }
-                            base_name = os.path.splitext(filename)[0]
-                            clean_prefix = base_prefix.strip("/")
-                            local_index_path = os.path.join(".index", clean_prefix, f"{base_name}.json")
+                print(f"🚀 OCR triggered (Avg chars: {avg_chars:.1f})")
 
-                            try:
-                                target_dir = os.path.dirname(local_index_path)
-                                if not os.path.exists(target_dir):
-                                    print(f"📂 DEBUG: Creating missing directory: {target_dir}")
-                                    os.makedirs(target_dir, exist_ok=True)
+                raw_pages, was_ocr, ocr_complete = extract_text_for_indexing(file_content, '.pdf', isLTR=None)
+                pages = [{"page_number": p["page"], "lines": p["lines"]} for p in raw_pages]
 
-                                json_payload = json.dumps(index_data, ensure_ascii=False, indent=4).encode('utf-8')
+            else:
 
-                                s3.put_object(
-                                    Bucket=BUCKET_NAME,
-                                    Key=index_key,  # הנתיב שמתחיל ב-.index/
-                                    Body=json_payload,
-                                    ContentType='application/json'
-                                )
+                # כאן הטקסט כבר חולץ במעבר הראשון, אז splitlines עובד
+                pages = [{"page_number": i + 1, "lines": text.splitlines()} for i, text in enumerate(page_texts)]
 
+            if avg_chars < 200 and not ocr_complete:
 
+                # Searchable now, but neither stored nor kept: the next load OCRs the missing pages
+                print(f"⚠️ OCR of {filename} is incomplete, its index is not saved.")
+                complete = False
 
-                            except Exception as save_error:
-                                print(f"🔥 DEBUG: Failed to write local index: {save_error}")
+            elif avg_chars < 200:
 
+                index_data = {
+                    "filename": filename,
+                    "pages": raw_pages,
+                    "timestamp": time.time()
+                }
+                base_name = os.path.splitext(filename)[0]
+                clean_prefix = base_prefix.strip("/")
+                local_index_path = os.path.join(".index", clean_prefix, f"{base_name}.json")
 
-                        else:
+                try:
+                    target_dir = os.path.dirname(local_index_path)
+                    if not os.path.exists(target_dir):
+                        print(f"📂 DEBUG: Creating missing directory: {target_dir}")
+                        os.makedirs(target_dir, exist_ok=True)
 
-                            with fitz.open(stream=file_content, filetype="pdf") as pdf:
+                    json_payload = json.dumps(index_data, ensure_ascii=False, indent=4).encode('utf-8')
 
-                                for i, page in enumerate(pdf):
-                                    # כאן page.get_text() הוא string, אז splitlines עובד
+                    put_result = s3.put_object(
+                        Bucket=BUCKET_NAME,
+                        Key=index_key,  # הנתיב שמתחיל ב-.index/
+                        Body=json_payload,
+                        ContentType='application/json'
+                    )
+                    version = (obj['ETag'], put_result.get('ETag'))
 
-                                    pages.append({
 
-                                        "page_number": i + 1,
 
-                                        "lines": page.get_text().splitlines()
+                except Exception as save_error:
+                    print(f"🔥 DEBUG: Failed to write local index: {save_error}")
 
-                                    })
 
+        else:
 
-                    else:
+            try:
 
-                        try:
+                extracted_text = file_content.decode('utf-8')
 
-                            extracted_text = file_content.decode('utf-8')
+            except:
 
-                        except:
+                extracted_text = file_content.decode('cp1255', errors='ignore')
 
-                            extracted_text = file_content.decode('cp1255', errors='ignore')
+            pages = [{"page_number": 1, "lines": extracted_text.splitlines()}]
 
-                        pages = [{"page_number": 1, "lines": extracted_text.splitlines()}]
+    except Exception as e:
+        print(f"⚠️ Error parsing index for {filename}: {e}")
+        return None
+
+    # 4. Success: Document is now searchable even without a perfect index
+    document = {
+        "name": filename,
+        "full_path": key,
+        "pages": pages
+    }
+    # Shadow lines for searching are computed once per document version
+    attach_normalized_lines(document)
+    if complete:
+        DOCUMENT_VERSIONS.put(key, version, document)
+    return document
 
-                except Exception as e:
-                    print(f"⚠️ Error parsing index for {filename}: {e}")
-                    continue
 
-                # 4. Success: Document is now searchable even without a perfect index
-                documents.append({
-                    "name": filename,
-                    "full_path": key,
-                    "pages": pages
-                })
-        return documents
+def get_documents_for_path(directory_path):
+    try:
+        return list(iter_documents_for_path(directory_path))
     except Exception as e:
         print(f"🔥 S3 Error: {str(e)}")
         return []
 
 
-
-def simple_keyword_search(query, directory_path="", mode="any", match_type="partial", show_mode="paragraph"):
+def iter_documents_for_path(directory_path):
+    """
+    Yields the parsed documents under directory_path in listing order, each
+    one as soon as it (and everything listed before it) has been fetched.
+    """
+    paginator = s3.get_paginator('list_objects_v2')
+    base_prefix = directory_path.strip('/') + '/' if directory_path else ""
+
+    # Sidecar versions in one metadata listing (a re-OCR'd sidecar must invalidate too)
+    sidecar_etags = {}
+    for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=f".index/{base_prefix}"):
+        for obj in page.get('Contents', []):
+            sidecar_etags[obj['Key']] = obj['ETag']
+    listed_keys = []
+    pending = deque()
+
+    # Every listed object is handed to the pool right away, so downloads
+    # overlap with fetching the next listing page.
+    for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=base_prefix):
+        if 'Contents' not in page: continue
+
+        for obj in page['Contents']:
+            key = obj['Key']
+            filename = key.split('/')[-1]
+
+            # Skip folders and existing index folder
+            if key.endswith('/') or filename.startswith('~$') or key.startswith('.index/'):
+                continue
+
+            listed_keys.append(key)
+            pending.append(FETCH_POOL.submit(load_s3_document, obj, base_prefix, sidecar_etags))
+            while pending and pending[0].done():
+                doc = pending.popleft().result()
+                if doc is not None:
+                    yield doc
+
+    # Keep the listing order; objects that failed to parse are skipped as before
+    while pending:
+        doc = pending.popleft().result()
+        if doc is not None:
+            yield doc
+
+    # Objects that vanished from the listing: drop them from the cache and the index
+    for stale_key in DOCUMENT_VERSIONS.sweep(base_prefix, listed_keys):
+        SEARCH_INDEX.remove_document(stale_key)
+
+def simple_keyword_search(query, directory_path="", mode="any", match_type="partial", show_mode="paragraph",
+                          window=None, render="html"):
     documents = get_documents_for_path(directory_path)
     if not documents:
         return {"status": "ok", "details": "No documents found", "matches": []}
 
     words = [w.strip() for w in query.split() if w.strip()]
-    results = []
+
+    SEARCH_INDEX.add_documents(documents)
+    results = list(iter_cached_keyword_matches(documents, words, directory_path, mode, match_type, show_mode,
+                                               window=window, render=render))
+
+    response = {"status": "ok", "query": query, "matches": results}
+    if window is not None:
+        response["page"] = window.summary()
+    return response
+
+
+def stream_keyword_matches(query, directory_path="", mode="any", match_type="partial", show_mode="paragraph",
+                           window=None, render="html"):
+    """Streaming search: every document is scanned as soon as it has been fetched."""
+    words = [w.strip() for w in query.split() if w.strip()]
+    if not words:
+        return
+    base_prefix = directory_path.strip('/') + '/' if directory_path else ""
+    if DOCUMENT_VERSIONS.has_listed(base_prefix):
+        # Listed before: unchanged objects are not downloaded again, so the path is
+        # loaded up front and a repeated search can come from the result cache
+        documents = list(iter_documents_for_path(directory_path))
+        SEARCH_INDEX.add_documents(documents)
+        yield from iter_cached_keyword_matches(documents, words, directory_path, mode, match_type, show_mode,
+                                               window=window, render=render)
+        return
+    yield from iter_keyword_matches(iter_documents_for_path(directory_path), words, mode, match_type, show_mode,
+                                    window=window, render=render)
+
+
+def iter_cached_keyword_matches(documents, words, directory_path, mode="any", match_type="partial",
+                                show_mode="paragraph", window=None, render="html"):
+    """iter_keyword_matches() behind the result cache (documents must already be indexed)."""
+    key = result_cache_key(words, mode, match_type, show_mode, directory_path, render=render, window=window)
+    return cached_search(SEARCH_RESULTS, key, lambda: SEARCH_INDEX.generation,
+                         lambda: iter_keyword_matches(documents, words, mode, match_type, show_mode,
+                                                      window=window, render=render),
+                         window=window)
+
+
+def iter_keyword_matches(documents, words, mode="any", match_type="partial", show_mode="paragraph",
+                         window=None, render="html"):
+    """Scans documents one by one (indexing any new ones), yielding a match entry per file with hits."""
+    # Paragraph centers only need to match one word; 'all' is enforced per document
+    line_plan = SEARCH_INDEX.plan(words, mode="any" if show_mode == "paragraph" else mode,
+                                  match_type=match_type)
+    doc_plan = SEARCH_INDEX.plan(words, mode=mode, match_type=match_type, per_line=False)
+    # Compiled once for the whole request; lines are compared through their shadow copy
+    query = compile_search(words, mode, match_type)
 
     for doc in documents:
+        if window is not None and window.exhausted:
+            return
+
+        doc_pages = doc.get("pages", [])
+        SEARCH_INDEX.add_document(doc)
+        doc_refs = doc_plan.line_refs(doc)
+        if doc_refs is not None and not doc_refs:
+            continue  # The index proves nothing in this document can match
+        line_refs = line_plan.line_refs(doc)
+        candidate_lines = group_refs_by_page(line_refs) if line_refs is not None else None
+
         # אם אנחנו ב-Paragraph Mode, נשתמש בלוגיקה של ה-GUI
         if show_mode == "paragraph":
-            matches_html = search_in_json_content(
-                doc["full_path"], doc.get("pages", []), words, mode, match_type
-            )
-            if matches_html:
-                results.append({
-                    "file": doc["name"],
-                    "full_path": doc["full_path"],
-                    "matches_html": matches_html,
-                    "match_positions": []
-                })
+            hits = iter_context_hits(doc_pages, query, candidate_lines)
         else:  # Line Mode
-            matched_items_html = []
-            for page_entry in doc.get("pages", []):
-                p_num = page_entry.get("page", 1)
-                for line in page_entry.get("lines", []):
-                    if match_line(line, words, mode, match_type):
-                        # הוספת מספר העמוד לכל שורה שנמצאה
-                        highlighted = highlight_matches_html(line, words, match_type)
-                        matched_items_html.append(f"עמוד {p_num}: {highlighted}")
-
-            if matched_items_html:
-                results.append({
-                    "file": doc["name"],
-                    "full_path": doc["full_path"],
-                    "matches_html": matched_items_html
-                })
-
-    return {"status": "ok", "query": query, "matches": results}
+            hits = iter_line_hits(doc_pages, query, candidate_lines)
+
+        rendered = []
+        for hit in hits:
+            if window is not None and not window.admit(doc["full_path"]):
+                if window.exhausted:
+                    break
+                continue
+            if render == "hits":
+                rendered.append(hit_entry(hit, query))
+            elif show_mode == "paragraph":
+                rendered.append(context_html(doc["full_path"], hit))
+            else:
+                # הוספת מספר העמוד לכל שורה שנמצאה
+                highlighted = highlight_matches_html(hit["text"], words, match_type, query=query)
+                rendered.append(f"עמוד {hit['page']}: {highlighted}")
+
+        if rendered:
+            entry = {"file": doc["name"], "full_path": doc["full_path"]}
+            if render == "hits":
+                entry["hits"] = rendered
+            else:
+                entry["matches_html"] = rendered
+                if show_mode == "paragraph":
+                    entry["match_positions"] = []
+            yield entry
 
 
 @app.route('/')
@@ -233,16 +379,33 @@ def simple_search_endpoint():
     query = data.get('query', '').strip()
     directory_path = data.get('directory_path', '').strip()
     config = data.get("search_config", {})
+    search_args = {"mode": config.get("word_logic", "any"),
+                   "match_type": config.get("match_type", "partial"),
+                   "show_mode": config.get("show_mode", "paragraph")}
+
+    # Paging: only the requested slice of hits is rendered and serialized.
+    # Hits are structured by default; render="html" returns the old markup.
+    try:
+        window = window_from_config(config, query, directory_path, *search_args.values())
+        render = render_from_config(config)
+        hit_encoding = hit_encoding_from_config(config)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Streaming variant: objects are fetched, scanned and flushed one at a time
+    stream_format = requested_stream_format(request, data)
+    if stream_format:
+        matches = stream_keyword_matches(query, directory_path, window=window, render=render, **search_args)
+        matches = encode_match_entries(matches, hit_encoding)
+        header = {"query": query, "directory_path": directory_path, "render": render, "encoding": hit_encoding,
+                  **search_args}
+        return stream_search_response(matches, header, stream_format, window=window)
 
     try:
-        result = simple_keyword_search(
-            query, directory_path,
-            mode=config.get("word_logic", "any"),
-            match_type=config.get("match_type", "partial"),
-            show_mode=config.get("show_mode", "paragraph")
-        )
+        result = simple_keyword_search(query, directory_path, window=window, render=render, **search_args)
         result["debug"] = f"{round(time.time() - timer_start, 2)} sec"
-        return jsonify(result), 200
+        result["matches"] = list(encode_match_entries(result["matches"], hit_encoding))
+        return search_response(result, request)
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
@@ -256,6 +419,32 @@ def get_version():
         "mode": "paragraph"
     }
 
+
+def refresh_s3_path(directory_path):
+    """One revalidation pass: unchanged objects are reused, changed/new ones re-parsed, deleted ones evicted."""
+    documents = get_documents_for_path(directory_path)
+    SEARCH_INDEX.add_documents(documents)
+    return {"documents": len(documents)}
+
+
+REFRESHER = PeriodicRefresher(refresh_s3_path,
+                              lambda: [prefix.rstrip('/') for prefix in DOCUMENT_VERSIONS.loaded_prefixes()])
+REFRESHER.start()
+
+
+@app.route('/refresh', methods=['POST', 'GET'])
+def refresh_endpoint():
+    data = request.get_json(silent=True) or {}
+    directory_path = (data.get('directory_path') or request.args.get('directory_path') or "").strip()
+
+    try:
+        results = REFRESHER.refresh([directory_path.strip('/')] if directory_path else None)
+        return jsonify({"status": "ok", "refreshed": results, "documents": DOCUMENT_VERSIONS.stats(),
+                        "index": SEARCH_INDEX.stats(), "results": SEARCH_RESULTS.stats()}), 200
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
 if __name__ == "__main__":
     if False:
         app.run(host='0.0.0.0', port=8080)
@@ -270,7 +459,7 @@ if __name__ == "__main__":
             pdf_bytes = f.read()
 
         file_ext = os.path.splitext(filename)[1].lower()
-        pages_data, was_ocr_needed = extract_text_for_indexing(pdf_bytes, file_ext)
+        pages_data, was_ocr_needed, ocr_complete = extract_text_for_indexing(pdf_bytes, file_ext)
 
 
         doc_obj = Document(io.BytesIO(file_bytes))
@@ -294,7 +483,7 @@ if __name__ == "__main__":
             if "image" in target_ref_safe or "/media/" in target_ref_safe:
                 try:
                     img = Image.open(io.BytesIO(rel.target_part.blob)).convert("L")
-                    ocr_text = pytesseract.image_to_string(img, lang='heb')
+                    ocr_text = ocr_image(img, lang='heb')
 
                     if ocr_text.strip():
                         lines = [l.strip() for l in ocr_text.split('\n') if l.strip()]
@@ -1,24 +1,57 @@
 import os, time, traceback, json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, request, jsonify
 from azure.storage.blob import BlobServiceClient
-from azure_search_utilities import azure_provider, search_in_json_content, highlight_matches_html, match_line
+from azure.core.pipeline.transport import RequestsTransport
+from azure_search_utilities import azure_provider, highlight_matches_html
 import base64
 import urllib.parse  # חובה להוסיף בראש הקובץ
 #from openai import AzureOpenAI
 import requests
 import fitz
 import config_reader
-from document_parsers import extract_text_for_indexing
+from document_parsers import extract_text_for_indexing, FITZ_LOCK
+from search_index import SearchIndex, group_refs_by_page
+from revalidation import DocumentVersionCache, PeriodicRefresher
+from search_stream import requested_stream_format, stream_search_response
+from search_encoding import (install_response_compression, hit_encoding_from_config, encode_match_entries,
+                             search_response)
+from search_paging import window_from_config
+from search_result_cache import SearchResultCache, result_cache_key, cached_search
+from search_kernel import (compile_search, iter_line_hits, iter_context_hits, hit_entry, context_html,
+                           render_from_config)
+from text_normalize import attach_normalized_lines
 
 cloud_provider="Microsoft"
 PROVIDER_CONFIG=config_reader.set_provider_config(cloud_provider)
 
 CONTAINER_NAME = PROVIDER_CONFIG["BUCKET_NAME"]
 
+# Line index (words + trigrams) reused across requests; documents whose
+# content did not change since the last request are not re-tokenized.
+SEARCH_INDEX = SearchIndex()
+
+# Parsed documents by blob name + (blob etag, sidecar etag). A listing is
+# metadata only, so unchanged blobs are never downloaded or parsed twice.
+DOCUMENT_VERSIONS = DocumentVersionCache()
+
+# Finished keyword searches (RESULT_CACHE_MAX_MB); the index generation is
+# the corpus version: it moves when a document is added, changed or removed.
+SEARCH_RESULTS = SearchResultCache()
+
+# Bounded fetch pipeline shared by all requests: sidecars/originals are
+# downloaded MAX_CONCURRENT_DOWNLOADS at a time over one pooled HTTP session.
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv("MAX_CONCURRENT_DOWNLOADS", "16"))
+FETCH_POOL = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_DOWNLOADS, thread_name_prefix="azure-fetch")
+PARSE_LOCK = FITZ_LOCK  # the same lock document_parsers takes for its own fitz passes
+
 
 # בתוך ה-Endpoint, וודא שאתה משתמש בזה:
 # full_path = decode_azure_path(encoded_path)
 app = Flask(__name__)
+# Compact JSON, gzip/brotli by Accept-Encoding (search_encoding)
+install_response_compression(app)
 
 key_name = "Azuresmartsearch3key1conn" # האות A גדולה כמו בלוג
 connection_string = os.getenv(key_name) or os.getenv(key_name.lower()) or os.getenv(key_name.upper())
@@ -31,7 +64,14 @@ if connection_string:
     print(f"🔍 Found variable '{key_name}'! Length: {length}, Starts with: {prefix}...")
 
     try:
-        blob_service_client = BlobServiceClient.from_connection_string(connection_string)
+        # One keep-alive connection per fetch worker instead of the default pool of 10
+        http_session = requests.Session()
+        http_adapter = requests.adapters.HTTPAdapter(pool_connections=MAX_CONCURRENT_DOWNLOADS,
+                                                     pool_maxsize=MAX_CONCURRENT_DOWNLOADS)
+        http_session.mount("https://", http_adapter)
+        http_session.mount("http://", http_adapter)
+        blob_service_client = BlobServiceClient.from_connection_string(
+            connection_string, transport=RequestsTransport(session=http_session, session_owner=False))
         print("✅ Successfully connected to Blob Storage")
     except Exception as e:
         print(f"❌ Failed to initialize Blob Client: {e}")
@@ -62,96 +102,149 @@ def decode_azure_path(encoded_path):
         return urllib.parse.unquote(encoded_path)
 
 
+def load_azure_document(container_client, blob, sidecar_etags):
+    """
+    Builds one document: the .index/ sidecar first, the original file (with
+    OCR for scans) as a fallback. Runs on FETCH_POOL, many blobs at a time.
+    """
+    key = blob.name
+    filename = key.split('/')[-1]
+
+    base_path = key.rsplit('.', 1)[0] if '.' in key else key
+    index_key = f".index/{base_path}.json"
+
+    version = (blob.etag, sidecar_etags.get(index_key))
+    cached_doc = DOCUMENT_VERSIONS.get(key, version)
+    if cached_doc is not None:
+        return cached_doc
+
+    pages = []
+    complete = True  # False: OCR missed pages, the document is not cached or stored
+    blob_client_index = container_client.get_blob_client(index_key)
+
+    try:
+        # 1. ניסיון טעינה מה-JSON הקיים (ה-Sidecar)
+        index_content = blob_client_index.download_blob().readall()
+        index_data = json.loads(index_content.decode('utf-8'))
+        raw_pages = index_data.get("pages", [])
+
+        # נירמול המבנה כדי ש-search_in_json_content לא יקרוס
+        for idx, p in enumerate(raw_pages):
+            if isinstance(p, str):
+                pages.append({"page_number": idx + 1, "lines": [p]})
+            else:
+                # וידוא שקיים מפתח page_number
+                p_num = p.get("page_number") or p.get("page") or (idx + 1)
+                pages.append({"page_number": p_num, "lines": p.get("lines", [])})
+
+    except Exception:
+        # 2. אם האינדקס חסר - חילוץ/OCR
+        print(f"🔍 Index missing for {filename}. Downloading original...")
+        blob_client_file = container_client.get_blob_client(key)
+        file_content = blob_client_file.download_blob().readall()
+        file_ext = filename.lower()
+
+        if file_ext.endswith('.pdf'):
+            # PyMuPDF is not thread-safe: only this text pass is serialized. The OCR
+            # below runs outside the lock (it opens its own document, on the OCR pool)
+            with PARSE_LOCK:
+                with fitz.open(stream=file_content, filetype="pdf") as pdf:
+                    page_texts = [p.get_text() for p in pdf]
+            num_pages = len(page_texts)
+            full_digital_text = "\n".join(page_texts)
+
+            avg_chars = len(full_digital_text) / max(num_pages, 1)
+
+            if avg_chars < 200:
+                print(f"🚀 Triggering OCR for {filename} (Scanned Doc detected)")
+                # קריאה לפונקציית ה-OCR שלך
+                raw_pages, _, ocr_complete = extract_text_for_indexing(file_content, '.pdf')
+                pages = [{"page_number": p.get("page", i + 1), "lines": p.get("lines", [])} for i, p in
+                         enumerate(raw_pages)]
+            else:
+                # חילוץ דיגיטלי מהיר (הטקסט כבר חולץ במעבר הראשון)
+                pages = [{"page_number": i + 1, "lines": text.splitlines()} for i, text in enumerate(page_texts)]
+
+            if avg_chars < 200 and not ocr_complete:
+                # Searchable now, but neither stored nor kept: the next load OCRs the missing pages
+                print(f"⚠️ OCR of {filename} is incomplete, its index is not saved.")
+                complete = False
+            elif avg_chars < 200:
+                # שמירת האינדקס ל-Azure כדי שלא נריץ OCR שוב לעולם
+                index_save_data = {"filename": filename, "pages": pages, "timestamp": time.time()}
+                upload_result = blob_client_index.upload_blob(
+                    json.dumps(index_save_data, ensure_ascii=False, indent=4).encode('utf-8'),
+                    overwrite=True
+                )
+                version = (blob.etag, (upload_result or {}).get("etag"))
+
+        # כאן אפשר להוסיף טיפול ב-DOCX במידת הצורך
+
+    document = {
+        "name": filename,
+        "full_path": key,
+        "pages": pages
+    }
+    # Shadow lines for searching are computed once per document version
+    attach_normalized_lines(document)
+    if complete:
+        DOCUMENT_VERSIONS.put(key, version, document)
+    return document
+
+
 def get_documents_for_path_azure(directory_path):
-    documents = []
+    try:
+        return list(iter_documents_for_path_azure(directory_path))
+    except Exception as e:
+        print(f"🔥 Azure Blob Error: {str(e)}")
+        traceback.print_exc()
+        return []
+
+
+def iter_documents_for_path_azure(directory_path):
+    """
+    Yields the documents under directory_path in listing order, each one as
+    soon as it (and everything listed before it) has been fetched.
+    """
     # השתמשנו במשתנה הגלובלי שהגדרת למעלה
     container_name = CONTAINER_NAME
     container_name = CONTAINER_NAME.strip()  # ניקוי רווחים מיותרים
     print(f"DEBUG: Using Container Name: '{container_name}'")
 
-    try:
-        container_client = blob_service_client.get_container_client(container_name)
-        print(f"DEBUG2")
-        base_prefix = directory_path.strip('/') + '/' if directory_path else ""
-        blobs = container_client.list_blobs(name_starts_with=base_prefix)
+    container_client = blob_service_client.get_container_client(container_name)
+    print(f"DEBUG2")
+    base_prefix = directory_path.strip('/') + '/' if directory_path else ""
+    blobs = container_client.list_blobs(name_starts_with=base_prefix)
 
-        for blob in blobs:
-            print(f"DEBUG3")
-            key = blob.name
-            filename = key.split('/')[-1]
+    # Sidecar versions in one metadata listing (a re-OCR'd sidecar must invalidate too)
+    sidecar_etags = {b.name: b.etag for b in container_client.list_blobs(name_starts_with=f".index/{base_prefix}")}
+    listed_keys = []
+    pending = deque()
 
-            if key.endswith('/') or filename.startswith('~$') or key.startswith('.index/'):
-                continue
+    # The listing is paged lazily: every blob is handed to the pool as soon as
+    # it is listed, so downloads overlap with fetching the next listing page.
+    for blob in blobs:
+        key = blob.name
+        filename = key.split('/')[-1]
 
-            base_path = key.rsplit('.', 1)[0] if '.' in key else key
-            index_key = f".index/{base_path}.json"
-
-            pages = []
-            blob_client_index = container_client.get_blob_client(index_key)
-
-            try:
-                # 1. ניסיון טעינה מה-JSON הקיים (ה-Sidecar)
-                index_content = blob_client_index.download_blob().readall()
-                index_data = json.loads(index_content.decode('utf-8'))
-                raw_pages = index_data.get("pages", [])
-
-                # נירמול המבנה כדי ש-search_in_json_content לא יקרוס
-                for idx, p in enumerate(raw_pages):
-                    if isinstance(p, str):
-                        pages.append({"page_number": idx + 1, "lines": [p]})
-                    else:
-                        # וידוא שקיים מפתח page_number
-                        p_num = p.get("page_number") or p.get("page") or (idx + 1)
-                        pages.append({"page_number": p_num, "lines": p.get("lines", [])})
-
-            except Exception:
-                # 2. אם האינדקס חסר - חילוץ/OCR
-                print(f"🔍 Index missing for {filename}. Downloading original...")
-                blob_client_file = container_client.get_blob_client(key)
-                file_content = blob_client_file.download_blob().readall()
-                file_ext = filename.lower()
-
-                if file_ext.endswith('.pdf'):
-                    with fitz.open(stream=file_content, filetype="pdf") as pdf:
-                        num_pages = len(pdf)
-                        full_digital_text = "\n".join([p.get_text() for p in pdf])
-
-                    avg_chars = len(full_digital_text) / max(num_pages, 1)
-
-                    if avg_chars < 200:
-                        print(f"🚀 Triggering OCR for {filename} (Scanned Doc detected)")
-                        # קריאה לפונקציית ה-OCR שלך
-                        raw_pages, _ = extract_text_for_indexing(file_content, '.pdf')
-                        pages = [{"page_number": p.get("page", i + 1), "lines": p.get("lines", [])} for i, p in
-                                 enumerate(raw_pages)]
-
-                        # שמירת האינדקס ל-Azure כדי שלא נריץ OCR שוב לעולם
-                        index_save_data = {"filename": filename, "pages": pages, "timestamp": time.time()}
-                        blob_client_index.upload_blob(
-                            json.dumps(index_save_data, ensure_ascii=False, indent=4).encode('utf-8'),
-                            overwrite=True
-                        )
-                    else:
-                        # חילוץ דיגיטלי מהיר
-                        with fitz.open(stream=file_content, filetype="pdf") as pdf:
-                            for i, page in enumerate(pdf):
-                                pages.append({"page_number": i + 1, "lines": page.get_text().splitlines()})
-
-                # כאן אפשר להוסיף טיפול ב-DOCX במידת הצורך
-
-            documents.append({
-                "name": filename,
-                "full_path": key,
-                "pages": pages
-            })
-
-        return documents
-    except Exception as e:
-        print(f"🔥 Azure Blob Error: {str(e)}")
-        traceback.print_exc()
-        return []
+        if key.endswith('/') or filename.startswith('~$') or key.startswith('.index/'):
+            continue
+
+        listed_keys.append(key)
+        pending.append(FETCH_POOL.submit(load_azure_document, container_client, blob, sidecar_etags))
+        while pending and pending[0].done():
+            yield pending.popleft().result()
+
+    # Keep the listing order; a failed download fails the request as before
+    while pending:
+        yield pending.popleft().result()
 
-def azure_simple_keyword_search(query, directory_path="", mode="any", match_type="partial", show_mode="paragraph"):
+    # Blobs that vanished from the listing: drop them from the cache and the index
+    for stale_key in DOCUMENT_VERSIONS.sweep(base_prefix, listed_keys):
+        SEARCH_INDEX.remove_document(stale_key)
+
+def azure_simple_keyword_search(query, directory_path="", mode="any", match_type="partial", show_mode="paragraph",
+                                window=None, render="html"):
     # 1. שליפת המסמכים מ-Azure Blob Storage (כולל ה-OCR והאינדוקס)
     # זו הפונקציה שבנינו שבודקת את תיקיית .index בתוך ה-Blob
     documents = get_documents_for_path_azure(directory_path)
@@ -161,52 +254,108 @@ def azure_simple_keyword_search(query, directory_path="", mode="any", match_type
         return {"status": "ok", "details": "No documents found", "matches": []}
 
     words = [w.strip() for w in query.split() if w.strip()]
-    results = []
 
     print(f"🔍 Searching for '{query}' across {len(documents)} documents...")
 
+    SEARCH_INDEX.add_documents(documents)
+    results = list(iter_cached_azure_keyword_matches(documents, words, directory_path, mode, match_type, show_mode,
+                                                     window=window, render=render))
+
+    response = {
+        "status": "ok",
+        "query": query,
+        "matches": results,
+        "count": len(results)
+    }
+    if window is not None:
+        response["page"] = window.summary()
+    return response
+
+
+def stream_azure_keyword_matches(query, directory_path="", mode="any", match_type="partial", show_mode="paragraph",
+                                 window=None, render="html"):
+    """Streaming search: every document is scanned as soon as it has been fetched."""
+    words = [w.strip() for w in query.split() if w.strip()]
+    if not words:
+        return
+    base_prefix = directory_path.strip('/') + '/' if directory_path else ""
+    if DOCUMENT_VERSIONS.has_listed(base_prefix):
+        # Listed before: unchanged blobs are not downloaded again, so the path is
+        # loaded up front and a repeated search can come from the result cache
+        documents = list(iter_documents_for_path_azure(directory_path))
+        SEARCH_INDEX.add_documents(documents)
+        yield from iter_cached_azure_keyword_matches(documents, words, directory_path, mode, match_type, show_mode,
+                                                     window=window, render=render)
+        return
+    yield from iter_azure_keyword_matches(iter_documents_for_path_azure(directory_path), words,
+                                          mode, match_type, show_mode, window=window, render=render)
+
+
+def iter_cached_azure_keyword_matches(documents, words, directory_path, mode="any", match_type="partial",
+                                      show_mode="paragraph", window=None, render="html"):
+    """iter_azure_keyword_matches() behind the result cache (documents must already be indexed)."""
+    key = result_cache_key(words, mode, match_type, show_mode, directory_path, render=render, window=window)
+    return cached_search(SEARCH_RESULTS, key, lambda: SEARCH_INDEX.generation,
+                         lambda: iter_azure_keyword_matches(documents, words, mode, match_type, show_mode,
+                                                            window=window, render=render),
+                         window=window)
+
+
+def iter_azure_keyword_matches(documents, words, mode="any", match_type="partial", show_mode="paragraph",
+                               window=None, render="html"):
+    """Scans documents one by one (indexing any new ones), yielding a match entry per file with hits."""
+    # Paragraph centers only need to match one word; 'all' is enforced per document
+    line_plan = SEARCH_INDEX.plan(words, mode="any" if show_mode == "paragraph" else mode,
+                                  match_type=match_type)
+    doc_plan = SEARCH_INDEX.plan(words, mode=mode, match_type=match_type, per_line=False)
+    # Compiled once for the whole request; lines are compared through their shadow copy
+    query = compile_search(words, mode, match_type)
+
     for doc in documents:
+        if window is not None and window.exhausted:
+            return
+
         # בדיקה שהמסמך מכיל דפים/טקסט
         doc_pages = doc.get("pages", [])
         if not doc_pages:
             continue
 
+        SEARCH_INDEX.add_document(doc)
+        doc_refs = doc_plan.line_refs(doc)
+        if doc_refs is not None and not doc_refs:
+            continue  # The index proves nothing in this document can match
+        line_refs = line_plan.line_refs(doc)
+        candidate_lines = group_refs_by_page(line_refs) if line_refs is not None else None
+
         if show_mode == "paragraph":
             # שימוש בפונקציית העזר הקיימת שלך לחיפוש בפסקאות
-            matches_html = search_in_json_content(
-                doc["full_path"], doc_pages, words, mode, match_type
-            )
-            if matches_html:
-                results.append({
-                    "file": doc["name"],
-                    "full_path": doc["full_path"],
-                    "matches_html": matches_html,
-                    "match_positions": []
-                })
+            hits = iter_context_hits(doc_pages, query, candidate_lines)
         else:  # Line Mode (מצב שורות עם מספרי עמודים)
-            matched_items_html = []
-            for page_entry in doc_pages:
-                # שים לב: ב-OCR המפתח הוא לעיתים "page_number" ובדיגיטלי "page"
-                p_num = page_entry.get("page") or page_entry.get("page_number") or 1
-
-                for line in page_entry.get("lines", []):
-                    if match_line(line, words, mode, match_type):
-                        highlighted = highlight_matches_html(line, words, match_type)
-                        matched_items_html.append(f"עמוד {p_num}: {highlighted}")
-
-            if matched_items_html:
-                results.append({
-                    "file": doc["name"],
-                    "full_path": doc["full_path"],
-                    "matches_html": matched_items_html
-                })
-
-    return {
-        "status": "ok",
-        "query": query,
-        "matches": results,
-        "count": len(results)
-    }
+            hits = iter_line_hits(doc_pages, query, candidate_lines)
+
+        rendered = []
+        for hit in hits:
+            if window is not None and not window.admit(doc["full_path"]):
+                if window.exhausted:
+                    break
+                continue
+            if render == "hits":
+                rendered.append(hit_entry(hit, query))
+            elif show_mode == "paragraph":
+                rendered.append(context_html(doc["full_path"], hit))
+            else:
+                highlighted = highlight_matches_html(hit["text"], words, match_type, query=query)
+                rendered.append(f"עמוד {hit['page']}: {highlighted}")
+
+        if rendered:
+            entry = {"file": doc["name"], "full_path": doc["full_path"]}
+            if render == "hits":
+                entry["hits"] = rendered
+            else:
+                entry["matches_html"] = rendered
+                if show_mode == "paragraph":
+                    entry["match_positions"] = []
+            yield entry
 
 
 @app.route('/simple_search', methods=['POST'])
@@ -237,6 +386,26 @@ def azure_simple_search_endpoint():
     if not query:
         return jsonify({"status": "ok", "matches": [], "count": 0, "details": "Empty query"}), 200
 
+    # Paging: only the requested slice of hits is rendered and serialized.
+    # Hits are structured by default; render="html" returns the old markup.
+    try:
+        window = window_from_config(config, query, directory_path, word_logic, match_type, show_mode)
+        render = render_from_config(config)
+        hit_encoding = hit_encoding_from_config(config)
+    except ValueError as e:
+        return jsonify({"status": "error", "error": str(e)}), 400
+
+    # Streaming variant: documents are fetched, scanned and flushed one at a time
+    stream_format = requested_stream_format(request, data)
+    if stream_format:
+        matches = stream_azure_keyword_matches(query, directory_path, mode=word_logic,
+                                               match_type=match_type, show_mode=show_mode, window=window,
+                                               render=render)
+        matches = encode_match_entries(matches, hit_encoding)
+        header = {"query": query, "directory_path": directory_path, "mode": word_logic,
+                  "match_type": match_type, "show_mode": show_mode, "render": render, "encoding": hit_encoding}
+        return stream_search_response(matches, header, stream_format, window=window)
+
     try:
         # 3. קריאה למנוע החיפוש (הפונקציה שמשלבת OCR ו-Blob)
         # וודא שהפונקציה הזו מוגדרת לפני ה-Endpoint בקוד
@@ -245,7 +414,9 @@ def azure_simple_search_endpoint():
             directory_path,
             mode=word_logic,
             match_type=match_type,
-            show_mode=show_mode
+            show_mode=show_mode,
+            window=window,
+            render=render
         )
 
         # 4. חישוב זמן ביצוע והוספת נתוני אבחון
@@ -257,7 +428,8 @@ def azure_simple_search_endpoint():
         }
 
         print(f"✅ Search completed: {len(result.get('matches', []))} matches in {execution_time}s")
-        return jsonify(result), 200
+        result["matches"] = list(encode_match_entries(result["matches"], hit_encoding))
+        return search_response(result, request)
 
     except Exception as e:
         # 5. פירוט שגיאה מלא לטרמינל (Log Stream) ב-Azure
@@ -349,6 +521,32 @@ def get_version():
     })
 
 
+def refresh_azure_path(directory_path):
+    """One revalidation pass: unchanged blobs are reused, changed/new ones re-parsed, deleted ones evicted."""
+    documents = get_documents_for_path_azure(directory_path)
+    SEARCH_INDEX.add_documents(documents)
+    return {"documents": len(documents)}
+
+
+REFRESHER = PeriodicRefresher(refresh_azure_path,
+                              lambda: [prefix.rstrip('/') for prefix in DOCUMENT_VERSIONS.loaded_prefixes()])
+REFRESHER.start()
+
+
+@app.route('/refresh', methods=['POST', 'GET'])
+def refresh_endpoint():
+    data = request.get_json(silent=True) or {}
+    directory_path = (data.get('directory_path') or request.args.get('directory_path') or "").strip()
+
+    try:
+        results = REFRESHER.refresh([directory_path.strip('/')] if directory_path else None)
+        return jsonify({"status": "ok", "refreshed": results, "documents": DOCUMENT_VERSIONS.stats(),
+                        "index": SEARCH_INDEX.stats(), "results": SEARCH_RESULTS.stats()}), 200
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+
 if __name__ == '__main__':
     port = int(os.getenv("PORT", 8080))
     app.run(host='0.0.0.0', port=port)
\ No newline at end of file
@@ -0,0 +1,286 @@
+import sys
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any, Callable, Tuple
+
+from text_normalize import NORMALIZED_LINES_KEY, PARAGRAPHS_KEY
+
+# Mapped (snapshot) documents keep their text in the mmap, outside the Python
+# heap; only their small header entry is charged to the budget.
+MAPPED_DOCUMENT_BYTES = 512
+
+CACHE_POLICIES = ("lru", "lfu")
+
+
+def estimate_document_bytes(doc: Dict[str, Any]) -> int:
+    """Approximate heap size of one cached document (content, pages/lines, their shadow copy and paragraphs)."""
+    if not isinstance(doc, dict):
+        return MAPPED_DOCUMENT_BYTES
+
+    size = sys.getsizeof(doc)
+    for key in ("name", "full_path", "source", "content"):
+        value = doc.get(key)
+        if value is not None:
+            size += sys.getsizeof(value)
+
+    pages = doc.get("pages")
+    if isinstance(pages, list):
+        size += sys.getsizeof(pages)
+        for page_entry in pages:
+            size += sys.getsizeof(page_entry)
+            lines = page_entry.get("lines") if isinstance(page_entry, dict) else page_entry
+            if isinstance(lines, list):
+                size += sys.getsizeof(lines) + sum(sys.getsizeof(line) for line in lines)
+            elif isinstance(lines, str):
+                size += sys.getsizeof(lines)
+            shadow = page_entry.get(NORMALIZED_LINES_KEY) if isinstance(page_entry, dict) else None
+            if isinstance(shadow, list):
+                size += sys.getsizeof(shadow) + sum(sys.getsizeof(line) for line in shadow)
+
+    paragraphs = doc.get(PARAGRAPHS_KEY)
+    if isinstance(paragraphs, list):
+        size += sys.getsizeof(paragraphs)
+        for paragraph, normalized, _, _ in paragraphs:
+            size += sys.getsizeof(paragraph)
+            if normalized is not paragraph:
+                size += sys.getsizeof(normalized)
+    return size
+
+
+def _sort_key(doc: Dict[str, Any]) -> Tuple[str, str]:
+    """Documents are ordered by lowercased full_path (lookups are case-insensitive)."""
+    full_path = doc.get("full_path", "")
+    return full_path.lower(), full_path
+
+
+class _DirectoryEntry:
+    __slots__ = ("size", "frequency")
+
+    def __init__(self, size: int):
+        self.size = size
+        self.frequency = 0
+
+
+class DocumentCache:
+    """
+    Byte-bounded hierarchical document cache.
+
+    Every document is stored exactly once in a list sorted by full_path.
+    A directory key ("a/b") only records that its whole subtree was loaded;
+    looking up a directory (or anything below a loaded one) is a range scan
+    over the sorted keys: O(log n + k), no filtering, no duplicates.
+
+    Eviction works on loaded directories:
+    - policy="lru": evicts the least recently used directory.
+    - policy="lfu": evicts the least frequently used one (ties -> least recent).
+    Documents still covered by another loaded directory are kept. The newest
+    directory is never evicted to make room for itself. on_evict(key, documents)
+    receives the documents that actually left the cache and runs outside the lock.
+    `generation` moves on every change (put, pop, eviction, clear), so callers
+    can tell whether anything they derived from the cached documents is stale.
+    """
+
+    def __init__(self, max_bytes: int, policy: str = "lru",
+                 on_evict: Optional[Callable[[str, List[Dict[str, Any]]], None]] = None):
+        if policy not in CACHE_POLICIES:
+            print(f"⚠️ Warning: Unknown cache policy '{policy}', using 'lru'.")
+            policy = "lru"
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.on_evict = on_evict
+
+        self._lock = threading.Lock()
+        self._keys: List[Tuple[str, str]] = []         # sorted
+        self._documents: List[Dict[str, Any]] = []     # aligned with _keys
+        self._sizes: Dict[Tuple[str, str], int] = {}
+        self._dirs: "OrderedDict[str, _DirectoryEntry]" = OrderedDict()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0
+
+    # ------------------------------------------------------------------
+    # Helpers (caller holds the lock)
+    # ------------------------------------------------------------------
+    def _range_locked(self, path: str) -> Tuple[int, int]:
+        """Slice of the sorted store holding everything under `path`."""
+        if not path:
+            return 0, len(self._keys)
+        # '0' is the character right after '/', so this brackets "path/..."
+        return bisect_left(self._keys, (path + "/",)), bisect_left(self._keys, (path + "0",))
+
+    def _covering_dir_locked(self, path: str) -> Optional[str]:
+        """The closest loaded directory that is `path` itself or one of its parents."""
+        if path in self._dirs:
+            return path
+        segments = path.split("/")
+        for i in range(len(segments) - 1, 0, -1):
+            parent = "/".join(segments[:i])
+            if parent in self._dirs:
+                return parent
+        return "" if "" in self._dirs else None
+
+    def _rebuild_locked(self, items: Dict[Tuple[str, str], Dict[str, Any]]):
+        self._keys = sorted(items)
+        self._documents = [items[k] for k in self._keys]
+
+    def _evict_dir_locked(self, dir_key: str) -> List[Dict[str, Any]]:
+        """Forgets a loaded directory and drops the documents nobody else covers."""
+        del self._dirs[dir_key]
+        lo, hi = self._range_locked(dir_key)
+        removed = {}
+        for key, doc in zip(self._keys[lo:hi], self._documents[lo:hi]):
+            parent = key[0].rsplit("/", 1)[0] if "/" in key[0] else ""
+            if self._covering_dir_locked(parent) is None:
+                removed[key] = doc
+        if removed:
+            self._total_bytes -= sum(self._sizes.pop(key) for key in removed)
+            self._rebuild_locked({k: d for k, d in zip(self._keys, self._documents) if k not in removed})
+        return list(removed.values())
+
+    # ------------------------------------------------------------------
+    # Lookups
+    # ------------------------------------------------------------------
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._dirs
+
+    def lookup(self, path: str) -> Tuple[Optional[str], Optional[List[Dict[str, Any]]]]:
+        """
+        Returns (loaded directory that served the request, documents under path),
+        or (None, None) on a miss. Counts hits/misses and marks the directory as used.
+        """
+        with self._lock:
+            dir_key = self._covering_dir_locked(path)
+            if dir_key is not None:
+                lo, hi = self._range_locked(path)
+                if lo < hi:
+                    entry = self._dirs[dir_key]
+                    entry.frequency += 1
+                    self._dirs.move_to_end(dir_key)
+                    self.hits += 1
+                    return dir_key, self._documents[lo:hi]
+            self.misses += 1
+            return None, None
+
+    def peek(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        """Documents of a loaded directory, without touching counters or recency."""
+        with self._lock:
+            if key not in self._dirs:
+                return None
+            lo, hi = self._range_locked(key)
+            return self._documents[lo:hi]
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            return list(self._dirs)
+
+    # ------------------------------------------------------------------
+    # Updates
+    # ------------------------------------------------------------------
+    def put(self, key: str, documents: List[Dict[str, Any]]):
+        """Stores the complete document list of directory `key`, replacing its subtree."""
+        incoming = {_sort_key(doc): doc for doc in documents}
+        incoming_sizes = {k: estimate_document_bytes(doc) for k, doc in incoming.items()}
+        evicted = []
+
+        with self._lock:
+            # The new listing is authoritative for the whole subtree: nested
+            # directory keys become redundant and missing documents are gone.
+            prefix = key + "/"
+            for dir_key in list(self._dirs):
+                if dir_key == key or not key or dir_key.startswith(prefix):
+                    del self._dirs[dir_key]
+
+            lo, hi = self._range_locked(key)
+            items = dict(zip(self._keys[:lo], self._documents[:lo]))
+            items.update(zip(self._keys[hi:], self._documents[hi:]))
+            replaced = [doc for k, doc in zip(self._keys[lo:hi], self._documents[lo:hi])
+                        if incoming.get(k) is not doc]
+            for k in self._keys[lo:hi]:
+                self._total_bytes -= self._sizes.pop(k)
+            for k in incoming:
+                if k in items:  # Outside the subtree (defensive): replace in place
+                    self._total_bytes -= self._sizes.pop(k)
+            items.update(incoming)
+            self._sizes.update(incoming_sizes)
+            self._total_bytes += sum(incoming_sizes.values())
+            self._rebuild_locked(items)
+
+            self._dirs[key] = _DirectoryEntry(sum(incoming_sizes.values()))
+            self.generation += 1
+            if replaced:
+                evicted.append((key, replaced))
+
+            while self._total_bytes > self.max_bytes and len(self._dirs) > 1:
+                victim_key = self._pick_victim_locked(exclude=key)
+                victim_size = self._dirs[victim_key].size
+                evicted.append((victim_key, self._evict_dir_locked(victim_key)))
+                self.evictions += 1
+                print(f"CACHE-EVICT: Dropped '{victim_key}' ({victim_size / 1e6:.1f} MB, policy={self.policy}).")
+
+            if self._total_bytes > self.max_bytes:
+                print(f"⚠️ Warning: '{key}' ({self._total_bytes / 1e6:.1f} MB) exceeds the cache budget "
+                      f"({self.max_bytes / 1e6:.1f} MB).")
+
+        self._notify(evicted)
+
+    def pop(self, key: str) -> List[Dict[str, Any]]:
+        """Forgets a loaded directory; returns the documents that left the cache."""
+        with self._lock:
+            if key not in self._dirs:
+                return []
+            removed = self._evict_dir_locked(key)
+            self.generation += 1
+        self._notify([(key, removed)])
+        return removed
+
+    def clear(self):
+        with self._lock:
+            removed = list(self._documents)
+            self._keys, self._documents = [], []
+            self._sizes.clear()
+            self._dirs.clear()
+            self._total_bytes = 0
+            self.generation += 1
+        self._notify([("", removed)])
+
+    def _pick_victim_locked(self, exclude: str) -> str:
+        candidates = (k for k in self._dirs if k != exclude)
+        if self.policy == "lfu":
+            # OrderedDict order is recency, so min() keeps the least recent on ties
+            return min(candidates, key=lambda k: self._dirs[k].frequency)
+        return next(candidates)
+
+    def _notify(self, evicted: List[Tuple[str, List[Dict[str, Any]]]]):
+        if self.on_evict is None:
+            return
+        for key, documents in evicted:
+            if not documents:
+                continue
+            try:
+                self.on_evict(key, documents)
+            except Exception as e:
+                print(f"⚠️ Warning: cache eviction hook failed for '{key}': {e}")
+
+    # ------------------------------------------------------------------
+    # Status
+    # ------------------------------------------------------------------
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "policy": self.policy,
+                "entries": len(self._dirs),
+                "documents": len(self._documents),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "generation": self.generation,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "keys": {k: e.size for k, e in self._dirs.items()},
+            }
@@ -1,6 +1,5 @@
 
 import io
-import re
 import os, time
 import traceback
 from pypdf import PdfReader
@@ -10,10 +9,22 @@ from docx import Document
 import pypdf
 import json
 from PIL import Image
+from bisect import bisect_right
 
 import gc, concurrent.futures  # חלופה מודרנית ונוחה ל-Pool
+import threading
+import tempfile
+from concurrent.futures.process import BrokenProcessPool
 import pytesseract, shutil
 
+from query_matcher import compile_query
+from search_kernel import compile_search, text_matches
+from text_normalize import normalize_text, page_normalized_lines, PARAGRAPHS_KEY
+from ocr_pool import get_ocr_pool, reset_ocr_pool, OCR_WORKERS, OCR_TASK_TIMEOUT, OCR_STUCK_AFTER
+from ocr_engine import ocr_image, ocr_backend, PSM_SINGLE_BLOCK
+from ocr_cache import OCRPageCache, page_fingerprint, ocr_cache_key
+from ocr_resolution import render_page_gray, render_page_for_ocr, ocr_resolution_settings
+
 # 1. הגדרת Tesseract לעבודה בליבה אחת בלבד - חייב להתבצע לפני הטעינה
 os.environ['OMP_THREAD_LIMIT'] = '1'
 
@@ -26,6 +37,27 @@ else:
     else: # Linux/Cloud
         pytesseract.pytesseract.tesseract_cmd = r'/usr/bin/tesseract'
 
+def normalize_pages(doc):
+    """
+    Return the document's pages as a list of {"page": n, "lines": [...]} dicts.
+
+    Well-formed page lists are returned as-is (same list object), so line
+    positions computed on the result stay valid for the cached document.
+    """
+    raw_pages = doc.get("pages")
+
+    if isinstance(raw_pages, list) and raw_pages:
+        if isinstance(raw_pages[0], dict) and "lines" in raw_pages[0]:
+            return raw_pages
+        if isinstance(raw_pages[0], str):
+            return [{"page": 1, "lines": raw_pages}]
+    elif isinstance(raw_pages, str):
+        return [{"page": 1, "lines": raw_pages.split("\n")}]
+
+    content = doc.get("content", "")
+    return [{"page": 1, "lines": content.split("\n")}]
+
+
 def find_paragraph_position_in_pages(paragraph_text: str, pages):
     """
     Try to find the (page, line) where this paragraph starts,
@@ -45,49 +77,122 @@ def find_paragraph_position_in_pages(paragraph_text: str, pages):
     if not first_line:
         return 1, 1
 
-    first_line_lower = first_line.lower()
+    first_line_normalized = normalize_text(first_line)
 
+    # Compared against the pre-normalized shadow lines (no per-line lower())
     for page_entry in pages:
         page_num = page_entry.get("page", 1)
-        lines = page_entry.get("lines", []) or []
-        for line_idx, doc_line in enumerate(lines, start=1):
-            if doc_line and first_line_lower in doc_line.lower():
+        for line_idx, doc_line in enumerate(page_normalized_lines(page_entry), start=1):
+            if doc_line and first_line_normalized in doc_line:
                 return page_num, line_idx
 
     # Fallback if not found
     return 1, 1
 
 
-def split_into_paragraphs(text: str):
+def split_into_paragraphs_with_lines(text: str):
+    """
+    Same segmentation as split_into_paragraphs, recorded while it is
+    produced: [(paragraph, index of its first line in text.split("\n")), ...].
+    """
     paragraphs = []
     current = []
+    first_line = 0
 
-    for line in text.split("\n"):
+    for line_idx, line in enumerate(text.split("\n")):
         stripped = line.strip()
 
         if not stripped:
             # real blank line → paragraph break
             if current:
-                paragraphs.append("\n".join(current))
+                paragraphs.append(("\n".join(current), first_line))
                 current = []
             continue
 
+        if not current:
+            first_line = line_idx
         current.append(stripped)
 
         # Detect paragraph boundary:
         # Ends with punctuation OR next line likely new paragraph.
         if stripped.endswith((".", "!", "?", ":")):
             # Commit current paragraph
-            paragraphs.append("\n".join(current))
+            paragraphs.append(("\n".join(current), first_line))
             current = []
 
     # Final paragraph
     if current:
-        paragraphs.append("\n".join(current))
+        paragraphs.append(("\n".join(current), first_line))
 
     return paragraphs
 
 
+def split_into_paragraphs(text: str):
+    return [paragraph for paragraph, _ in split_into_paragraphs_with_lines(text)]
+
+
+def paragraph_anchors(doc, pages=None):
+    """
+    [(paragraph, page, line), ...] for doc["content"]: each paragraph with the
+    (page number, 1-based line) it starts at, so a match's position is known
+    without searching the pages again.
+
+    Content lines map straight onto page lines when the content is the pages'
+    lines joined with newlines (possibly truncated); otherwise page/line are
+    None and the caller falls back to find_paragraph_position_in_pages.
+    """
+    if pages is None:
+        pages = normalize_pages(doc)
+    content = doc.get("content", "") or ""
+    segmented = split_into_paragraphs_with_lines(content)
+
+    page_starts = []
+    all_lines = []
+    for page_entry in pages:
+        page_starts.append(len(all_lines))
+        all_lines.extend(page_entry.get("lines", []) or [])
+    if not pages or "\n".join(map(str, all_lines))[:len(content)] != content:
+        return [(paragraph, None, None) for paragraph, _ in segmented]
+
+    anchors = []
+    for paragraph, ordinal in segmented:
+        page_idx = bisect_right(page_starts, ordinal) - 1
+        anchors.append((paragraph, pages[page_idx].get("page", 1), ordinal - page_starts[page_idx] + 1))
+    return anchors
+
+
+def build_paragraphs(doc, pages=None):
+    """
+    [(paragraph, normalized paragraph, page, line), ...]: paragraph_anchors
+    plus the text_normalize form the query is matched against (shared with
+    the paragraph itself when normalizing changes nothing).
+    """
+    paragraphs = []
+    for paragraph, page_num, line_idx in paragraph_anchors(doc, pages):
+        normalized = normalize_text(paragraph)
+        paragraphs.append((paragraph, paragraph if normalized == paragraph else normalized, page_num, line_idx))
+    return paragraphs
+
+
+def attach_paragraphs(doc):
+    """
+    Segments a cached document once, when it enters the cache. A changed blob
+    is re-parsed into a new document dict, so the segmentation lives exactly
+    as long as the version it was built from. Snapshot documents carry their own.
+    """
+    if isinstance(doc, dict) and doc.get(PARAGRAPHS_KEY) is None:
+        doc[PARAGRAPHS_KEY] = build_paragraphs(doc)
+    return doc
+
+
+def document_paragraphs(doc, pages=None):
+    """The document's cached segmentation; built on the spot for documents that were never attached."""
+    paragraphs = doc.get(PARAGRAPHS_KEY)
+    if paragraphs is None:
+        paragraphs = build_paragraphs(doc, pages)
+    return paragraphs
+
+
 def match_line(line: str, words: list[str], mode="any", match_type="partial"):
     """
     line        = the text line from the document
@@ -96,48 +201,24 @@ def match_line(line: str, words: list[str], mode="any", match_type="partial"):
     match_type  = "partial" or "full"
 
     Returns True if the line matches the search rule.
+    Hot loops should build compile_query(words, mode, match_type) once and
+    call .matches(line) directly; this wrapper uses the cached compilation.
     """
+    return compile_query(words, mode, match_type).matches(line)
 
-    line_lower = line.lower()
 
-    # full match = whole word
-    if match_type == "full":
-        def check_word(word):
-            return re.search(rf"\b{re.escape(word.lower())}\b", line_lower)
+HIGHLIGHT_TEMPLATE = "<span style='background-color: blue; font-weight:bold;'>{}</span>"
 
-    # partial match = substring
-    else:
-        def check_word(word):
-            return word.lower() in line_lower
 
-    if mode == "all":
-        return all(check_word(w) for w in words)
-
-    return any(check_word(w) for w in words)
-
-
-def highlight_matches_html(text: str, words: list[str], match_type: str = "partial"):
+def highlight_matches_html(text: str, words: list[str], match_type: str = "partial", query=None):
     """
     Wrap matching words in <span> so they render highlighted in HTML.
     match_type: 'partial' or 'full'
+    query: optional CompiledQuery already built for this request
     """
-    if not words:
-        return text
-
-    # Build regex based on match type
-    if match_type == "full":
-        # whole word match
-        pattern = r"\b(" + "|".join(re.escape(w) for w in words) + r")\b"
-    else:
-        # partial / substring match
-        pattern = r"(" + "|".join(re.escape(w) for w in words) + r")"
-
-    regex = re.compile(pattern, re.IGNORECASE)
-
-    def repl(m):
-        return f"<span style='background-color: blue; font-weight:bold;'>{m.group(0)}</span>"
-
-    return regex.sub(repl, text)
+    if query is None:
+        query = compile_query(words, match_type=match_type)
+    return query.highlight(text, HIGHLIGHT_TEMPLATE)
 
 
 def extract_pdf_local(blob_bytes: bytes) -> str:
@@ -165,6 +246,54 @@ def extract_pdf_local(blob_bytes: bytes) -> str:
 
 
 
+def extract_docx_text(blob_bytes: bytes) -> str:
+    """
+    DOCX bytes -> text: editable paragraphs plus Tesseract OCR of embedded
+    images. CPU heavy and self-contained, so it can run in a worker process.
+    """
+    text = ""
+    try:
+        document = Document(io.BytesIO(blob_bytes))
+        combined_text = []
+
+        # 1. Extract Regular Editable Text
+        for paragraph in document.paragraphs:
+            combined_text.append(paragraph.text)
+
+        # 2. Extract and OCR Embedded Images
+
+        for rel in document.part.rels.items():
+            target_ref_safe = getattr(rel, 'target_ref', '')
+            if target_ref_safe:
+                try:
+                    if "image" in target_ref_safe or "/media/" in target_ref_safe:
+                        image_part = rel.target_part
+                        image_bytes = image_part.blob
+                        image = Image.open(io.BytesIO(image_bytes))
+
+                        # Run OCR
+                        ocr_text = ocr_image(image, 'heb')
+                        # a = b[4]
+                        # Append OCR results with a separator/label
+                        combined_text.append(ocr_text)
+                except pytesseract.TesseractNotFoundError:
+                    # IMPORTANT: This error means Tesseract executable is missing in the cloud!
+                    combined_text.append("\n[OCR ERROR: Tesseract not found on system path. Image skipped.]")
+                except Exception as e:
+                    # Handle other potential errors (like missing image dependencies)
+                    combined_text.append(f"\n[OCR ERROR: Failed to process image: {e}]")
+
+        # 3. Combine and Optionally Search
+        text = "\n".join(combined_text)
+
+        #for paragraph in document.paragraphs:
+        #    text += paragraph.text + "\n"
+        return text.strip()
+
+    except Exception as e:
+        return f"ERROR: Could not read DOCX content: {e}"
+
+
 def extract_docx_with_lines(file_content_bytes: bytes):
     """
     Given DOCX bytes, return:
@@ -399,67 +528,9 @@ def convert_pdf_page_to_image(pdf_path: str, page_number: int, poppler_path: str
 
 
 def paragraph_matches(text, words, mode='any', search_mode='partial'):
-    # text_lower = text.lower()
-    text_lower = text
-    if search_mode == 'full':
-        # Match only whole words
-        found = 0
-        for w in words:
-            pattern = r'\b{}\b'.format(re.escape(w.lower()))
-            if re.search(pattern, text_lower):
-                found += 1
-
-        return (mode == 'all' and found == len(words)) or (mode != 'all' and found > 0)
-    else:
-        # substring match
-        if mode == 'all':
-            return all(w.lower() in text_lower for w in words)
-        else:
-            return any(w.lower() in text_lower for w in words)
-
-
-def search_in_json_content(path, pages_list, words, mode, search_mode):
-    results = []
-
-    # כאן pages_list הוא כבר ה-List שהתקבל מה-json_data.get("pages")
-    for p_idx, page_data in enumerate(pages_list):
-        # מחלצים את מספר העמוד ואת השורות מתוך האיבר הנוכחי ברשימה
-        pnum = page_data.get("page_number", p_idx + 1)
-        lines = page_data.get("lines", [])
-        l = len(lines)
-
-        i = 0
-        while i < l:
-            ln = lines[i]
-
-            # 1. בדיקה מהירה של השורה הנוכחית
-            if paragraph_matches(ln, words, mode, search_mode):
-
-                # 2. בניית קונטקסט (שורה לפני ושורה אחרי)
-                start_index = max(0, i - 1)
-                end_index = min(i + 2, l)
-
-                context_lines = lines[start_index:end_index]
-                context_text = " ".join(context_lines)
+    # Same matching as the search services (search_kernel)
+    return text_matches(compile_search(words, mode, search_mode), text)
 
-                # 3. בדיקה מלאה על הקונטקסט
-                if paragraph_matches(context_text, words, mode, search_mode):
-                    pre = f"<span style='color:blue;'>— עמוד {pnum} — שורות {start_index + 1}-{end_index}</span>"
-                    path_for_url = path.replace('\\', '/')
-                    file_url_with_page = f"filepage:///{path_for_url}?page={pnum}"
-                    open_link = f"<a href='{file_url_with_page}' style='color:green; text-decoration: none;'>[פתח קובץ]</a>"
-
-                    full_paragraph = (
-                            " ".join([path]) + "  " +
-                            pre + " " + open_link + "<br><br>" +
-                            "<br>".join(context_lines).replace(".₪", "₪.").replace(",₪", "₪,") + "<br>"
-                    )
-
-                    results.append(full_paragraph)
-                    i += 2  # דילוג כדי למנוע כפילויות של אותה פסקה
-            i += 1
-
-    return results
 
 def get_json_index_path(pdf_path, base_folder=""):
     # 1. ניקוי לוכסנים לנתיב אחיד של Windows
@@ -498,11 +569,11 @@ def detect_language_robust(doc, pages_data, isLTR_flag):
     try:
         page = doc[0]  # דף ראשון
         # רנדור קטן ומהיר (Matrix 1.0 מספיק לזיהוי שפה)
-        pix = page.get_pixmap(matrix=fitz.Matrix(1, 1))
-        img = Image.open(io.BytesIO(pix.tobytes("ppm")))
+        with FITZ_LOCK:
+            img = render_page_gray(page, zoom=1)
 
         # מריצים על heb+eng רק לצורך הזיהוי הראשוני
-        sample_text = pytesseract.image_to_string(img, lang='heb+eng', config='--psm 3 --oem 3')
+        sample_text = ocr_image(img, lang='heb+eng')
 
         heb_count = len([c for c in sample_text if '\u0590' <= c <= '\u05ff'])
         eng_count = len([c for c in sample_text if 'a' <= c.lower() <= 'z'])
@@ -512,80 +583,195 @@ def detect_language_robust(doc, pages_data, isLTR_flag):
         return 'heb'  # ברירת מחדל בטוחה לישראל
 
 
-def ocr_worker(img_data, p_num, lang):
-    """פונקציה עצמאית שתרוץ על כל ליבה בנפרד"""
+# Scanned pages are rendered inside the OCR workers: the parent only sends
+# (pdf path, page number) and every worker renders straight to 8-bit
+# grayscale, so no PNG is encoded, pickled and decoded again per page.
+# The resolution (fixed or adaptive, with margin cropping) is ocr_resolution's.
+OCR_TEXT_THRESHOLD = 100  # pages with fewer extracted characters are OCR'd
+
+# PyMuPDF is not thread-safe. Every fitz pass of a caller that parses PDFs
+# from several threads (the Azure/S3 fetch pools) holds this lock; OCR
+# itself (the pool, tesseract) runs outside it.
+FITZ_LOCK = threading.RLock()
+
+
+def ocr_worker(pdf_path, p_num, lang):
+    """פונקציה עצמאית שתרוץ על כל ליבה בנפרד - פותחת את ה-PDF ומרנדרת את הדף בעצמה"""
     try:
-        # שימוש ב-bytes() מבטיח ניתוק מהזיכרון של fitz למניעת BufferError ב-PC
-        with Image.open(io.BytesIO(bytes(img_data))) as img:
-            img_gray = img.convert('L')
-            config = '--oem 3 --psm 6'
-            text = pytesseract.image_to_string(img_gray, lang=lang, config=config)
-
-            if text.strip():
-                lines = [l.strip() for l in text.split('\n') if l.strip()]
-                return {"page": p_num, "lines": lines}
+        # Contended only by the in-process fallback: a spawned pool worker has its own lock
+        with FITZ_LOCK, fitz.open(pdf_path) as doc:
+            img_gray = render_page_for_ocr(doc[p_num - 1])
+        if img_gray is None:  # the adaptive probe found no ink
+            return {"page": p_num, "lines": []}
+        # The worker keeps its language model loaded between pages (ocr_engine)
+        text = ocr_image(img_gray, lang=lang, psm=PSM_SINGLE_BLOCK, timeout=OCR_TASK_TIMEOUT)
+
+        # A blank page is a result too ([]): it is cached and never OCR'd again
+        lines = [l.strip() for l in text.split('\n') if l.strip()]
+        return {"page": p_num, "lines": lines}
     except Exception as e:
         print(f"Error in worker on page {p_num}: {e}")
     return None
 
 
-def extract_text_for_indexing(file_bytes, file_ext, isLTR=None):
+# A page lost to a pool reset (its own document's or another one's) is
+# resubmitted to the fresh pool this many times, then OCR'd in-process
+OCR_PAGE_ATTEMPTS = 3
+
+
+def ocr_pdf_pages(pdf_path, page_numbers, lang):
+    """
+    OCR of the given pages on the shared pool (ocr_pool).
+    Returns (results, failed): one {"page", "lines"} per page that was OCR'd
+    (lines may be empty) and the page numbers that could not be OCR'd
+    (error, timeout, or a worker stuck for OCR_STUCK_AFTER, which is killed
+    together with its pool). Pages cancelled by a pool reset are resubmitted.
+    """
+    results, failed = [], []
+    attempts = dict.fromkeys(page_numbers, 0)
+    pending = {}  # future -> (page, pool it was submitted to)
+    busy_since = {}  # future -> first time it was seen running
+
+    def finish(p_num, result):
+        if result:
+            results.append(result)
+        else:
+            failed.append(p_num)
+
+    def submit(p_num):
+        while attempts[p_num] < OCR_PAGE_ATTEMPTS:
+            attempts[p_num] += 1
+            pool = get_ocr_pool()
+            try:
+                pending[pool.submit(ocr_worker, pdf_path, p_num, lang)] = (p_num, pool)
+                return
+            except (BrokenProcessPool, RuntimeError):  # broken, or shut down by another caller
+                reset_ocr_pool(pool)
+        print(f"⚠️ Warning: OCR pool keeps failing, page {p_num} runs in-process.")
+        finish(p_num, ocr_worker(pdf_path, p_num, lang))
+
+    for p_num in page_numbers:
+        submit(p_num)
+
+    poll_seconds = min(1.0, OCR_TASK_TIMEOUT / 4)
+    while pending:
+        concurrent.futures.wait(list(pending), timeout=poll_seconds,
+                                return_when=concurrent.futures.FIRST_COMPLETED)
+        # Not wait()'s done set: futures cancelled by the shutdown of a killed
+        # pool are never reported by wait(), but done() is True for them
+        for future in [f for f in pending if f.done()]:
+            p_num, pool = pending.pop(future)
+            busy_since.pop(future, None)
+            try:
+                result = future.result()  # ocr_worker reports its own errors
+            except (BrokenProcessPool, concurrent.futures.CancelledError):
+                reset_ocr_pool(pool)  # no-op if another caller already replaced it
+                submit(p_num)
+                continue
+            finish(p_num, result)
+
+        now = time.time()
+        for future, (p_num, pool) in list(pending.items()):
+            if future.running():
+                started = busy_since.setdefault(future, now)
+                if now - started > OCR_STUCK_AFTER:
+                    print(f"⚠️ OCR page {p_num} stuck for {now - started:.0f}s, killing its worker.")
+                    del pending[future]
+                    failed.append(p_num)
+                    # The pool's other pages (any document's) fail and are resubmitted
+                    reset_ocr_pool(pool, kill=True)
+
+    if failed:
+        print(f"⚠️ OCR failed on {len(failed)} pages ({sorted(failed)}).")
+    return results, sorted(failed)
+
+
+def extract_text_for_indexing(file_bytes, file_ext, isLTR=None, ocr_cache_dirs=()):
+    """
+    (pages, used_ocr, complete) of a PDF: digital text where there is enough
+    of it, OCR for the other pages. OCR results are cached per page content
+    (ocr_cache); ocr_cache_dirs are extra directories to mirror them into.
+    complete is False when a page could not be OCR'd or extraction failed:
+    the pages can still be searched, but must not be stored as the
+    document's index (the next load tries again).
+    """
     used_ocr = False
+    complete = True
     pages_data = []
     time0 = time.time()
     print(f"🚀🚀🚀🚀🚀extract_text_for_indexing")
-    # הגבלה קשיחה - 2 תהליכים בו-זמנית
-    MAX_WORKERS = 2
 
     try:
         if file_ext.lower() == '.pdf':
-            doc = fitz.open(stream=file_bytes, filetype="pdf")
-            ocr_tasks = []
-
-            for p_num_zero, page in enumerate(doc):
-                p_num = p_num_zero + 1
-                current_text = page.get_text().strip()
-
-                if len(current_text) < 100:
-                    used_ocr = True
-                    pix = page.get_pixmap(matrix=fitz.Matrix(3, 3))
-                    img_data = bytes(pix.tobytes("png"))
-
-                    #img_data = bytes(pix.tobytes("ppm"))
-                    ocr_tasks.append((img_data, p_num))
-                    pix = None
-                else:
-                    lines = [l.strip() for l in current_text.split('\n') if l.strip()]
-                    pages_data.append({"page": p_num, "lines": lines})
+            ocr_tasks = []  # page numbers only; the workers render them
+            fingerprints = {}
+
+            with FITZ_LOCK:
+                doc = fitz.open(stream=file_bytes, filetype="pdf")
+                for p_num_zero, page in enumerate(doc):
+                    p_num = p_num_zero + 1
+                    current_text = page.get_text().strip()
+
+                    if len(current_text) < OCR_TEXT_THRESHOLD:
+                        used_ocr = True
+                        ocr_tasks.append(p_num)
+                        fingerprints[p_num] = page_fingerprint(doc, page)
+                    else:
+                        lines = [l.strip() for l in current_text.split('\n') if l.strip()]
+                        pages_data.append({"page": p_num, "lines": lines})
 
             if isLTR is None:
+                # Takes FITZ_LOCK only to render its sample page
                 detected_lang = detect_language_robust(doc, pages_data, None)
                 print(f"🌍 Cloud Mode: Auto-detected language: {detected_lang}")
             else:
                 detected_lang = 'eng' if isLTR else 'heb'
 
-            doc.close()
-            if ocr_tasks:
-                print(f"🚀 Safe Parallel OCR: {len(ocr_tasks)} pages with {MAX_WORKERS} workers")
-                with concurrent.futures.ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
-                    # מעבירים גם את isLTR לכל worker
-                    futures = [executor.submit(ocr_worker, task[0], task[1], detected_lang) for task in ocr_tasks]
+            with FITZ_LOCK:
+                doc.close()
+
+            # Pages OCR'd before (same page content and OCR settings) are not OCR'd again
+            ocr_cache = OCRPageCache(ocr_cache_dirs)
+            cache_keys = {p_num: ocr_cache_key(fingerprint, detected_lang, PSM_SINGLE_BLOCK, ocr_resolution_settings(), ocr_backend())
+                          for p_num, fingerprint in fingerprints.items()}
+            for p_num in list(ocr_tasks):
+                lines = ocr_cache.get(cache_keys[p_num])
+                if lines is not None:
+                    ocr_tasks.remove(p_num)
+                    if lines:
+                        pages_data.append({"page": p_num, "lines": lines})
+            if ocr_cache.hits:
+                print(f"♻️ OCR cache: {ocr_cache.hits} pages reused, {len(ocr_tasks)} to OCR")
 
-                    for future in concurrent.futures.as_completed(futures):
-                        result = future.result()
-                        if result:
-                            pages_data.append(result)
+            if ocr_tasks:
+                print(f"🚀 Safe Parallel OCR: {len(ocr_tasks)} pages with {OCR_WORKERS} workers")
+                # The workers open the PDF from disk instead of receiving page images
+                with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as pdf_file:
+                    pdf_file.write(file_bytes)
+                    pdf_path = pdf_file.name
+                # מעבירים גם את השפה לכל worker
+                results, failed_pages = ocr_pdf_pages(pdf_path, ocr_tasks, detected_lang)
+                complete = not failed_pages
+                for result in results:
+                    ocr_cache.put(cache_keys[result["page"]], result["lines"])
+                    if result["lines"]:
+                        pages_data.append(result)
 
 
             pages_data.sort(key=lambda x: x["page"])
 
     except Exception as e:
         print(f"ERROR in extraction: {e}")
-        return [], False
+        return [], False, False
     finally:
         # ניקוי בטוח שמתאים גם לענן וגם ל-PC
         if 'ocr_tasks' in locals():
             del ocr_tasks
+        if 'pdf_path' in locals():
+            try:
+                os.remove(pdf_path)
+            except OSError:
+                pass
 
         try:
             # ה-GC יצליח ב-99% מהמקרים אם ה-ocr_tasks נמחק וה-doc נסגר
@@ -601,7 +787,7 @@ def extract_text_for_indexing(file_bytes, file_ext, isLTR=None):
         # עכשיו זה בטוח - אין אובייקטים שנועלים את הזיכרון
         gc.collect()
     print(f"OCR time = {time.time() - time0:.2f}s")
-    return pages_data, used_ocr
+    return pages_data, used_ocr, complete
 
 # --- שימוש בתוך הפונקציה שלך ---
 def get_json_index_if_exists(self,pdf_path):
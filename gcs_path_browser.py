@@ -3,7 +3,7 @@ from google.cloud import storage
 from typing import List, Dict, Any, Optional, Union
 # We assume PyQt5 is used based on QFileDialog in browse_directory
 from PyQt5 import QtWidgets, QtCore, QtGui
-from search_utilities import get_storage_client
+from search_utilities import get_storage_client, SNAPSHOT_BLOB_PREFIX
 from azure_search_utilities import browse_azure_path_logic
 import time
 import hashlib
@@ -18,6 +18,7 @@ from azure.storage.blob import BlobServiceClient, ContentSettings
 import base64
 from config_reader import PROVIDER_CONFIG
 from document_parsers import extract_text_for_indexing # Set your flag here based on your environment
+from ocr_cache import OCR_CACHE_INDEX_FOLDER, OCR_CACHE_MIRROR
 
 
 
@@ -38,6 +39,8 @@ def  get_gcs_files_recursive(bucket_name, prefix = ""):
     for blob in bucket.list_blobs(prefix=prefix):
         if blob.name.startswith(f"{skip_folder_name}/") or blob.name == skip_folder_name:
             continue
+        if blob.name.startswith(SNAPSHOT_BLOB_PREFIX):  # Server-side search snapshots, not synced
+            continue
 
         name = blob.name[len(prefix):].lstrip("/")
         if name:
@@ -192,7 +195,14 @@ def save_json_file(self, local_folder, filename, base_folder):
         pdf_bytes = f.read()
 
     file_ext = os.path.splitext(filename)[1].lower()
-    pages_data, was_ocr_needed = extract_text_for_indexing(pdf_bytes, file_ext)
+    # OCR'd pages are also kept under .index/_ocr_cache, which check_sync mirrors to the bucket
+    mirror_dirs = [os.path.join(base_folder, ".index", OCR_CACHE_INDEX_FOLDER)] if OCR_CACHE_MIRROR else []
+    pages_data, was_ocr_needed, complete = extract_text_for_indexing(pdf_bytes, file_ext, ocr_cache_dirs=mirror_dirs)
+    if not complete:
+        # A partial index would be uploaded and served as the document forever;
+        # without one the next sync tries again (OCR'd pages come from the cache)
+        print(f"⚠️ OCR of {filename} is incomplete, its index is not saved.")
+        return False
 
     index_data = {
         "filename": filename,
@@ -207,6 +217,7 @@ def save_json_file(self, local_folder, filename, base_folder):
     # שמירה כבינארי (wb)
     with open(local_index_path, "wb") as f:
         f.write(json_payload)
+    return True
 
 
 
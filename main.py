@@ -17,12 +17,18 @@ from urllib.parse import urlparse, unquote
 import mimetypes
 import time
 import threading
+from collections import deque
 from google import genai
 from google.genai.errors import APIError
 from google.genai import types
 import tempfile
 from search_core import simple_keyword_search
-from document_parsers import extract_text_and_images_from_pdf, get_json_index_if_exists, search_in_json_content, paragraph_matches
+from document_parsers import extract_text_and_images_from_pdf, get_json_index_if_exists, paragraph_matches, HIGHLIGHT_TEMPLATE
+from search_kernel import (compile_search, text_matches, iter_context_hits, context_html, render_hit_html,
+                           search_in_json_content)
+from search_encoding import decode_match_entry, msgpack, MSGPACK_MIMETYPE
+from ocr_engine import ocr_image
+from ocr_resolution import prepare_ocr_image
 from gcs_path_browser import GCSBrowserDialog, check_sync, update_gcs_radio
 from email_option_gui import launch_search_dialog
 from email_searcher import EmailSearchWorker, EMAIL_PROVIDERS
@@ -99,36 +105,118 @@ def format_simple_search_results(results_data):
     output_lines = []
 
     for doc in matches:
-        file_name = doc.get("file", "ללא שם")
-        full_path = doc.get("full_path", "")
-        match_positions = doc.get("match_positions","")
-        if match_positions:
-            first = match_positions[0]
-            line = first["line"]
-            page = first["page"]
-        else:
-            line = None
-            page = None
+        output_lines.append(format_simple_search_match(decode_match_entry(doc), results_data.get("debug")))
+
+    page_note = format_page_note(results_data.get("page"))
+    if page_note:
+        output_lines.append(page_note)
+
+    return "\n".join(output_lines)
 
-        dir_only = os.path.dirname(full_path)
 
+def format_page_note(page):
+    """Notice shown when the server returned only the first page of hits."""
+    if not page or not page.get("has_more"):
+        return ""
+    return f"⚠️ מוצגות {page.get('returned')} התוצאות הראשונות בלבד - צמצם את החיפוש לתוצאות נוספות.<br>"
+
+
+def format_simple_search_match(doc, debug=None, render_rows=True):
+    """
+    HTML block for one file's matches (shared by the full and the streamed results).
+    Structured hits (render=hits) are rendered here, on the client; with
+    render_rows=False only the file header is returned.
+    """
+    output_lines = []
+    file_name = doc.get("file", "ללא שם")
+    full_path = doc.get("full_path", "")
+    match_positions = doc.get("match_positions") or doc.get("hits", "")
+    if match_positions:
+        first = match_positions[0]
+        line = first["line"]
+        page = first["page"]
+    else:
+        line = None
+        page = None
+
+    dir_only = os.path.dirname(full_path)
+
+    if "hits" in doc:
+        lines = [render_hit_html(full_path, hit, HIGHLIGHT_TEMPLATE) for hit in doc["hits"]] if render_rows else []
+    else:
         lines = doc.get("matches_html", [])
 
-        output_lines.append(f" שורה:  {line}  עמוד: {page}  📄 קובץ: {file_name}  📄 ספריה: {dir_only}   <br>")
+    output_lines.append(f" שורה:  {line}  עמוד: {page}  📄 קובץ: {file_name}  📄 ספריה: {dir_only}   <br>")
 
-        output_lines.append(f" debug:  {results_data.get("debug")}<br>***********************************************<br>")
-        #output_lines.append(f"נתיב מלא: {full_path} <br>")
+    output_lines.append(f" debug:  {debug}<br>***********************************************<br>")
+    #output_lines.append(f"נתיב מלא: {full_path} <br>")
 
 
-        for line in lines:
-            output_lines.append(f"   • {line}<br>")
+    for line in lines:
+        output_lines.append(f"   • {line}<br>")
 
+    if render_rows:
         output_lines.append(f"<br>")
 
 
     return "\n".join(output_lines)
 
 
+class LazyResultsView:
+    """
+    Appends search output to results_area in arrival order, but turns
+    structured hits into HTML only when they are about to scroll into view:
+    rows further than one screen below the visible area wait in a queue
+    until the user scrolls down.
+    """
+
+    def __init__(self, results_area):
+        self.results_area = results_area
+        self.pending = deque()  # HTML strings and (full_path, hit) rows
+        results_area.verticalScrollBar().valueChanged.connect(self.fill)
+
+    def reset(self):
+        self.pending.clear()
+
+    def append_html(self, html):
+        self.pending.append(html)
+        self.fill()
+
+    def add_match(self, doc, debug=None):
+        """One file's match entry: header now, its rows as they become visible."""
+        if "hits" not in doc:
+            self.append_html(format_simple_search_match(doc, debug))
+            return
+        self.pending.append(format_simple_search_match(doc, debug, render_rows=False))
+        full_path = doc.get("full_path", "")
+        self.pending.extend((full_path, hit) for hit in doc["hits"])
+        self.pending.append("<br>")
+        self.fill()
+
+    def _near_visible(self):
+        bar = self.results_area.verticalScrollBar()
+        return bar.maximum() - bar.value() <= self.results_area.viewport().height()
+
+    def flush(self):
+        """Renders everything still queued (e.g. before the results are saved)."""
+        self.fill(everything=True)
+
+    def fill(self, *_, everything=False):
+        while self.pending and (everything or self._near_visible()):
+            item = self.pending.popleft()
+            if not isinstance(item, str):
+                full_path, hit = item
+                item = f"   • {render_hit_html(full_path, hit, HIGHLIGHT_TEMPLATE)}<br>"
+            self.results_area.append(item)
+
+
+def get_results_view(self):
+    """The LazyResultsView of the main window's results_area (created on first use)."""
+    if getattr(self, "results_view", None) is None:
+        self.results_view = LazyResultsView(self.results_area)
+    return self.results_view
+
+
 def check_cache_status_get(self):
     print(f"\n--- 2. Checking Cache Status (GET {self.provider_info["API_cache_status_url"]}) ---")
 
@@ -257,7 +345,9 @@ def on_search_button_clicked(self, query, directory_path ,force_chat = False):
                     "mode": "keyword",
                     "match_type": str1_mode,
                     "word_logic": str2_mode,
-                    "show_mode": str3_mode
+                    "show_mode": str3_mode,
+                    "render": "hits",  # structured hits; HTML is built here, only for visible rows
+                    "encoding": "columnar"  # hits as one list per field (smaller on the wire)
                 }
             }
 
@@ -268,10 +358,18 @@ def on_search_button_clicked(self, query, directory_path ,force_chat = False):
             return formatted_output
         else:
 
+            # Keyword search asks for the streamed variant: files are shown as they are scanned
+            stream_search = not self.gemini_radio.isChecked()
+            headers = {'Content-Type': 'application/json'}
+            if stream_search:
+                headers['Accept'] = 'application/x-ndjson'
+            elif msgpack is not None:
+                headers['Accept'] = f'{MSGPACK_MIMETYPE}, application/json;q=0.9'
             response = requests.post(
                 url = url,
                 json=payload,
-                headers={'Content-Type': 'application/json'}
+                headers=headers,
+                stream=stream_search
             )
         # --- 2. מדידת זמן: התחלה ---
 
@@ -282,7 +380,12 @@ def on_search_button_clicked(self, query, directory_path ,force_chat = False):
 
 
         # 2. עיבוד התוצאה
-        results_data = response.json()
+        if response.headers.get('Content-Type', '').startswith('application/x-ndjson'):
+            return read_simple_search_stream(self, response, directory_path, start_time)
+        if response.headers.get('Content-Type', '').startswith(MSGPACK_MIMETYPE):
+            results_data = msgpack.unpackb(response.content, raw=False)
+        else:
+            results_data = response.json()
 
         # 3. בודק אם הסטטוס הוא RAG (מ-Gemini) או Fallback (חיפוש פשוט)
         status = results_data.get('status', 'Unknown')
@@ -340,6 +443,38 @@ def on_search_button_clicked(self, query, directory_path ,force_chat = False):
         QtWidgets.QMessageBox.critical(self, "שגיאה", error_message)
 
 
+def read_simple_search_stream(self, response, path, start_time):
+    """
+    Incremental reader for the streamed /simple_search (NDJSON): every file
+    block is appended to results_area as soon as its line arrives.
+    Returns a short summary that the caller displays like any other answer.
+    """
+    count = 0
+    view = get_results_view(self)
+    for raw_line in response.iter_lines(chunk_size=None):
+        if not raw_line:
+            continue
+        event = json.loads(raw_line)
+        event_type = event.pop("type", "")
+
+        if event_type == "match":
+            if count == 0:
+                print(f"first streamed result: {time.time() - start_time:.2f} seconds")
+                view.append_html(f"<p dir='rtl'><b>  {path}   </b></p>")
+            count += 1
+            view.add_match(decode_match_entry(event), f"{time.time() - start_time:.2f} sec")
+            QtWidgets.QApplication.processEvents()
+        elif event_type == "error":
+            return f"🛑 שגיאה: {event.get('error')}"
+        elif event_type == "done":
+            if not count:
+                return "לא נמצאו תוצאות."
+            return f"✅ {count} קבצים | debug: {event.get('debug')}<br>{format_page_note(event.get('page'))}"
+
+    # The server closed the stream without a 'done' event
+    return f"⚠️ החיבור נסגר לפני סיום החיפוש ({count} קבצים התקבלו)."
+
+
 def should_skip_file(filename: str) -> bool:
     """Checks if a filename indicates a temporary Word lock file."""
 
@@ -378,8 +513,11 @@ def display_aws_cldrun_result(self, results_area: QtWidgets.QTextEdit, answer: s
         html_content = f"<span dir='rtl'><b>*</b></span>"
 
         # Move cursor to the end and insert content without a newline
-        results_area.moveCursor(results_area.textCursor().End)
-        results_area.insertHtml(html_content)
+        if getattr(self, "results_view", None) is not None and self.results_view.pending:
+            self.results_view.append_html(html_content)  # after the rows still waiting to be shown
+        else:
+            results_area.moveCursor(results_area.textCursor().End)
+            results_area.insertHtml(html_content)
 
     else:
         # --- Handle Successful Answer (Insert Full Block) ---
@@ -391,8 +529,12 @@ def display_aws_cldrun_result(self, results_area: QtWidgets.QTextEdit, answer: s
             f"<p dir='rtl'>{answer}</p>"
             f"<p dir='rtl'><b>    +++++++++++++++++++++ :  </b></p>"
         )
-        # The append() method creates a new block for the formatted HTML content.
-        results_area.append(formatted_html)
+        # The append() method creates a new block for the formatted HTML content
+        # (queued behind any search rows that have not been rendered yet)
+        if getattr(self, "results_view", None) is not None:
+            self.results_view.append_html(formatted_html)
+        else:
+            results_area.append(formatted_html)
 
 
 
@@ -768,6 +910,8 @@ def docx2pdf_search(path, words, mode='any', search_mode='partial'):
 
 def pdf_search(self, path, words, mode='any', search_mode='partial', read_from_temp=""):
     results = []
+    # Compiled once per file instead of once per line
+    context_query = compile_search(words, mode, search_mode)
 
     try:
         if read_from_temp.strip():
@@ -814,11 +958,9 @@ def pdf_search(self, path, words, mode='any', search_mode='partial', read_from_t
                     # Render the page as a PIL image
                     # Note: You may need to install 'poppler' utilities for pdfplumber to work with image rendering
                     rgb_image_object = page.to_image(resolution=220).original
-                    im = rgb_image_object.convert('L')
-                    if self.isLTR:
-                        ocr_text = pytesseract.image_to_string(im, lang='eng')
-                    else:
-                        ocr_text = pytesseract.image_to_string(im, lang='heb')
+                    # OCR_RESOLUTION=adaptive: cropped to the ink and scaled to the text size
+                    im = prepare_ocr_image(rgb_image_object.convert('L'), dpi=220)
+                    ocr_text = ocr_image(im, lang='eng' if self.isLTR else 'heb') if im is not None else ""
 
                     lines = [line.strip() for line in ocr_text.split('\n') if line.strip()]
 
@@ -834,9 +976,6 @@ def pdf_search(self, path, words, mode='any', search_mode='partial', read_from_t
             previous_page_trailer = []
             lines = previous_page_trailer + lines  # Re-initialize lines here after OCR check
 
-            l = len(lines)
-
-            i = 0
             if search_mode == 'chatgpt':
                 # Existing ChatGPT logic...
                 content_summary = "\n".join(lines)
@@ -860,44 +999,10 @@ def pdf_search(self, path, words, mode='any', search_mode='partial', read_from_t
                 results.append(full_paragraph)
 
             else:
-                while i < l:
-                    lnum = i + 1
-                    ln = lines[i]
-
-                    # 1. First Check: Does the current line match ANY of the search words?
-                    if paragraph_matches(ln, words, 'any', search_mode):
-                        # 2. Safely gather the 3-line context
-                        start_index = max(0, lnum - 2)
-                        end_index = min(lnum + 2, l)
-                        if (lnum + 2) > l:
-                            previous_page_trailer = lines[lnum - 1:]
-                        else:
-                            previous_page_trailer = []
-
-                        context_lines = lines[start_index:end_index]
-                        context_lines = [line.replace(".₪", "₪.") for line in context_lines]
-                        context_lines = [line.replace(",₪", "₪,") for line in context_lines]
-
-                        # 3. Concatenate lines into a single searchable string
-                        context_text = " ".join(context_lines)
-
-                        # 4. Second Check: Does the 3-line context match the FULL user criteria?
-                        if paragraph_matches(context_text, words, mode, search_mode):
-                            pre = f"<span style='color:blue;'>— עמוד {pnum} — שורות {start_index + 1}-{end_index}</span>"
-                            path_for_url = path.replace('\\', '/')
-                            file_url_with_page = f"filepage:///{path_for_url}?page={pnum}"
-                            open_link = f"<a href='{file_url_with_page}' style='color:green; text-decoration: none;'>[פתח קובץ]</a>"
-
-                            full_paragraph = (
-                                    " ".join([path]) + "  " +
-                                    pre + " " + open_link + "<br><br>" +
-                                    "<br>".join(context_lines) + "<br>"
-                            )
-
-                            results.append(full_paragraph)
-                            i += 2
-
-                    i = i + 1
+                # Same context search as the JSON index and the cloud services
+                page_entry = {"page": pnum, "lines": lines}
+                for hit in iter_context_hits([page_entry], context_query):
+                    results.append(context_html(path, hit))
 
     except Exception as general_error:
         print(f"An unexpected error occurred during PDF processing: {general_error}")
@@ -916,11 +1021,12 @@ def pdf_search(self, path, words, mode='any', search_mode='partial', read_from_t
 
 def docx_search(self, path, words, mode='any', search_mode='partial'):
     results = []
+    query = compile_search(words, mode, search_mode)
     try:
         doc = Document(path)
         for para in doc.paragraphs:
             full_text = para.text or ""
-            if paragraph_matches(full_text, words, mode, search_mode):
+            if text_matches(query, full_text):
 
                 full_paragraph = (
                     f"{path}  <br><br> {full_text} <br>"
@@ -936,7 +1042,7 @@ def docx_search(self, path, words, mode='any', search_mode='partial'):
                             "<br>".join(full_text) + "<br>"
                     )
 
-                    if paragraph_matches(full_text, words, mode, search_mode):
+                    if text_matches(query, full_text):
                         results.append(full_paragraph)
 
         for rel in doc.part.rels.values():
@@ -953,12 +1059,9 @@ def docx_search(self, path, words, mode='any', search_mode='partial'):
                     # Use Tesseract to convert image to string
                     image = image.convert('L')
 
-                    if self.isLTR:
-                        ocr_text = pytesseract.image_to_string(image, lang='eng')
-                    else:
-                        ocr_text = pytesseract.image_to_string(image, lang='heb')
+                    ocr_text = ocr_image(image, lang='eng' if self.isLTR else 'heb')
 
-                    if paragraph_matches(ocr_text, words, mode, search_mode):
+                    if text_matches(query, ocr_text):
                         full_paragraph = (
                         f"{path}  <br><br> {ocr_text} <br>"
                         )
@@ -1116,12 +1219,14 @@ class SearchApp(QtWidgets.QWidget):
         """Clears the search input and, most importantly, the results display area."""
         self.search_input.clear()
         self.results_area.clear()
+        get_results_view(self).reset()
         self.progressBar.setValue(0)
 
     def save_all2file(self):
         """Clears the search input and, most importantly, the results display area."""
         doc = Document()
         path = os.path.join(self.provider_info["CLIENT_PREFIX_TO_STRIP"], "results" + self.last_queryNmode + ".docx")
+        get_results_view(self).flush()
         text = self.results_area.toPlainText()
         # Add the text as a paragraph
         doc.add_paragraph(text)
@@ -1154,6 +1259,7 @@ class SearchApp(QtWidgets.QWidget):
         folders = self.dir_edit.text().strip()
         folder_list = [f.strip() for f in folders.split(',') if f.strip()]
         self.results_area.clear()
+        get_results_view(self).reset()
         total_found = 0
 
         for folder in folder_list:
@@ -0,0 +1,126 @@
+import os
+import sys
+import time
+import argparse
+import difflib
+from typing import Dict, List, Optional
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+from ocr_engine import ocr_image, ocr_backend, PSM_SINGLE_BLOCK
+from ocr_resolution import render_page_for_ocr, ocr_resolution_settings
+from text_normalize import normalize_text
+
+# Fixed vs adaptive OCR resolution (ocr_resolution) on real PDFs:
+#   python ocr_benchmark.py scans/ contracts.pdf --lang heb --max-pages 20
+# Every page is rendered and OCR'd in this process in both modes, even pages
+# that have a text layer. Accuracy is the similarity (difflib ratio over
+# normalized text) to:
+#   - the page's own text layer, for digital pages (ground truth)
+#   - the fixed-mode OCR, for scanned pages ("agreement", no ground truth)
+# The adaptive knobs are read from the environment as usual
+# (OCR_TARGET_LINE_HEIGHT, OCR_MIN_ZOOM, OCR_MAX_ZOOM, OCR_PROBE_ZOOM).
+# The language model is loaded by a warm-up call before anything is timed,
+# and the modes take turns going first so neither gets the warm caches.
+MODES = ("fixed", "adaptive")
+TEXT_LAYER_MIN = 100  # characters for a page's text layer to serve as ground truth
+
+
+def comparable(text: str) -> str:
+    return " ".join(normalize_text(text).split())
+
+
+def similarity(reference: str, text: str) -> float:
+    reference, text = comparable(reference), comparable(text)
+    if not reference and not text:
+        return 1.0
+    return difflib.SequenceMatcher(None, reference, text, autojunk=False).ratio()
+
+
+def pdf_paths(inputs: List[str]) -> List[str]:
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                paths.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith(".pdf"))
+        else:
+            paths.append(item)
+    return paths
+
+
+def ocr_page(page, mode: str, lang: str) -> Dict:
+    start = time.perf_counter()
+    image = render_page_for_ocr(page, mode=mode)
+    pixels = image.width * image.height if image is not None else 0
+    text = ocr_image(image, lang=lang, psm=PSM_SINGLE_BLOCK) if image is not None else ""
+    return {"text": text, "seconds": time.perf_counter() - start, "pixels": pixels}
+
+
+def warm_up(lang: str):
+    """Loads the OCR engine and language model (ocr_engine keeps them) outside the timings."""
+    ocr_image(Image.new("L", (200, 60), 255), lang=lang, psm=PSM_SINGLE_BLOCK)
+
+
+def run(paths: List[str], lang: str, max_pages: Optional[int]) -> Dict[str, Dict]:
+    totals = {mode: {"pages": 0, "seconds": 0.0, "pixels": 0, "accuracy": [], "agreement": []} for mode in MODES}
+    warm_up(lang)
+    for path in paths:
+        try:
+            doc = fitz.open(path)
+        except Exception as e:
+            print(f"⚠️ Warning: skipping '{path}': {e}")
+            continue
+        with doc:
+            for p_num, page in enumerate(doc, start=1):
+                if max_pages and totals["fixed"]["pages"] >= max_pages:
+                    return totals
+                text_layer = page.get_text().strip()
+                # Alternate which mode goes first (the second one finds the page already parsed)
+                order = MODES if totals["fixed"]["pages"] % 2 == 0 else MODES[::-1]
+                results = {mode: ocr_page(page, mode, lang) for mode in order}
+                results = {mode: results[mode] for mode in MODES}
+                for mode, result in results.items():
+                    stats = totals[mode]
+                    stats["pages"] += 1
+                    stats["seconds"] += result["seconds"]
+                    stats["pixels"] += result["pixels"]
+                    if len(text_layer) >= TEXT_LAYER_MIN:
+                        stats["accuracy"].append(similarity(text_layer, result["text"]))
+                    else:
+                        stats["agreement"].append(similarity(results["fixed"]["text"], result["text"]))
+                print(f"📄 {os.path.basename(path)} p.{p_num}: " + ", ".join(
+                    f"{mode} {r['seconds']:.2f}s" for mode, r in results.items()))
+    return totals
+
+
+def report(totals: Dict[str, Dict]):
+    def mean(values):
+        return f"{sum(values) / len(values):.3f} ({len(values)})" if values else "-"
+
+    print(f"\n🔤 OCR backend: {ocr_backend()}")
+    print(f"{'mode':<40} {'pages':>6} {'pages/s':>8} {'Mpx/page':>9} {'accuracy':>14} {'agreement':>14}")
+    for mode, stats in totals.items():
+        pages = stats["pages"] or 1
+        rate = stats["pages"] / stats["seconds"] if stats["seconds"] else 0.0
+        print(f"{ocr_resolution_settings(mode):<40} {stats['pages']:>6} {rate:>8.2f} "
+              f"{stats['pixels'] / pages / 1e6:>9.2f} {mean(stats['accuracy']):>14} {mean(stats['agreement']):>14}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark fixed vs adaptive OCR resolution.")
+    parser.add_argument("inputs", nargs="+", help="PDF files or folders of PDFs")
+    parser.add_argument("--lang", default="heb", help="Tesseract language (default: heb)")
+    parser.add_argument("--max-pages", type=int, default=None, help="stop after this many pages")
+    args = parser.parse_args(argv)
+
+    paths = pdf_paths(args.inputs)
+    if not paths:
+        print("❌ No PDF files found.")
+        return 1
+    report(run(paths, args.lang, args.max_pages))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
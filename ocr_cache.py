@@ -0,0 +1,83 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from typing import List, Optional, Sequence
+
+# Content-addressed cache of OCR'd pages, so re-indexing a re-uploaded PDF
+# (e.g. one appended page) only OCRs the pages that actually changed.
+# A page is identified by its own bytes - the content stream, the raw
+# streams of the images it draws, its box and rotation - hashed in the
+# parent without rendering it; the key adds the OCR settings (language,
+# page segmentation, resolution, engine). One small JSON file per page:
+#   <dir>/<key[:2]>/<key>.json  ->  {"lines": [...]}
+# OCR_CACHE_DIR is the local store (OCR_CACHE=0 disables the cache).
+# Callers may pass extra directories to mirror into, e.g. the local
+# .index/_ocr_cache folder that check_sync uploads next to the sidecars.
+OCR_CACHE_ENABLED = os.environ.get("OCR_CACHE", "1") != "0"
+OCR_CACHE_DIR = os.environ.get("OCR_CACHE_DIR", os.path.join(tempfile.gettempdir(), "smart_doc_ocr_cache"))
+OCR_CACHE_INDEX_FOLDER = "_ocr_cache"  # under .index/, next to _snapshots
+OCR_CACHE_MIRROR = os.environ.get("OCR_CACHE_MIRROR", "1") != "0"
+
+
+def page_fingerprint(doc, page) -> str:
+    """Hash of what a page draws: content stream(s), raw image streams, box and rotation."""
+    digest = hashlib.sha256()
+    digest.update(f"{tuple(page.rect)}|{page.rotation}|".encode("ascii"))
+    digest.update(page.read_contents())
+    for image in page.get_images(full=True):
+        digest.update(doc.xref_stream_raw(image[0]) or b"")
+    return digest.hexdigest()
+
+
+def ocr_cache_key(fingerprint: str, *settings) -> str:
+    """The cache key of a page fingerprint under the given OCR settings (lang, psm, resolution, engine...)."""
+    return hashlib.sha256("|".join([fingerprint, *map(str, settings)]).encode("utf-8")).hexdigest()
+
+
+class OCRPageCache:
+    """
+    OCR lines by page key, read from the first directory that has them and
+    written to all of them. Blank pages are stored too ([]), so they are
+    not OCR'd again either.
+    """
+
+    def __init__(self, directories: Sequence[str] = ()):
+        self.directories = [d for d in ([OCR_CACHE_DIR] + list(directories)) if d] if OCR_CACHE_ENABLED else []
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _path(directory: str, key: str) -> str:
+        return os.path.join(directory, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[List[str]]:
+        for directory in self.directories:
+            try:
+                with open(self._path(directory, key), "r", encoding="utf-8") as f:
+                    lines = json.load(f)["lines"]
+            except (OSError, ValueError, KeyError, TypeError):
+                continue
+            self.hits += 1
+            if directory != self.directories[0]:
+                self.put(key, lines)  # e.g. synced down from the bucket: keep a local copy
+            return lines
+        self.misses += 1
+        return None
+
+    def put(self, key: str, lines: List[str]):
+        payload = json.dumps({"lines": lines}, ensure_ascii=False)
+        for directory in self.directories:
+            path = self._path(directory, key)
+            if os.path.exists(path):
+                continue
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Write-then-rename: a concurrent reader never sees half a file
+                tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(payload)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"⚠️ Warning: could not store OCR cache entry in '{directory}': {e}")
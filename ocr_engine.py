@@ -0,0 +1,66 @@
+import os
+import threading
+from typing import Dict, Tuple
+
+import pytesseract
+
+try:
+    import tesserocr
+except ImportError:  # pytesseract (one tesseract process per image) is the fallback
+    tesserocr = None
+
+# Every OCR call in the project goes through ocr_image(). Two backends:
+#   "tesserocr"   - the Tesseract C API in-process; a language model is loaded
+#                   once per (thread, lang, psm) and reused for every page
+#   "pytesseract" - runs the tesseract executable per image (temp file, model
+#                   reload each time); used when tesserocr is not installed
+# OCR_BACKEND=auto (default) picks tesserocr when it can be imported.
+# OCR_TESSDATA_PATH optionally points tesserocr at a tessdata directory.
+OCR_BACKEND = os.environ.get("OCR_BACKEND", "auto").strip().lower()
+OCR_TESSDATA_PATH = os.environ.get("OCR_TESSDATA_PATH", "")
+
+# Tesseract page segmentation modes used here (same numbers as --psm)
+PSM_AUTO = 3
+PSM_SINGLE_BLOCK = 6
+
+_local = threading.local()  # a TessBaseAPI must not be shared between threads
+_unavailable = set()        # (lang, psm) the C API could not load -> pytesseract
+
+
+def ocr_backend() -> str:
+    return "tesserocr" if tesserocr is not None and OCR_BACKEND != "pytesseract" else "pytesseract"
+
+
+def _engine(lang: str, psm: int):
+    engines: Dict[Tuple[str, int], "tesserocr.PyTessBaseAPI"] = getattr(_local, "engines", None)
+    if engines is None:
+        engines = _local.engines = {}
+    api = engines.get((lang, psm))
+    if api is None:
+        kwargs = {"lang": lang, "psm": psm}
+        if OCR_TESSDATA_PATH:
+            kwargs["path"] = OCR_TESSDATA_PATH
+        api = engines[(lang, psm)] = tesserocr.PyTessBaseAPI(**kwargs)
+        print(f"🔤 OCR engine loaded in-process (lang={lang}, psm={psm}).")
+    return api
+
+
+def ocr_image(image, lang: str = "heb", psm: int = PSM_AUTO, timeout: float = 0) -> str:
+    """
+    Text of a PIL image. timeout (seconds, 0 = none) applies to both
+    backends: tesserocr stops recognition after it, pytesseract kills the
+    tesseract process. Either way a RuntimeError is raised.
+    """
+    if ocr_backend() == "tesserocr" and (lang, psm) not in _unavailable:
+        try:
+            api = _engine(lang, psm)
+        except RuntimeError as e:  # e.g. traineddata not found by the C API
+            print(f"⚠️ Warning: tesserocr cannot load '{lang}' ({e}), using pytesseract.")
+            _unavailable.add((lang, psm))
+        else:
+            api.SetImage(image)
+            if timeout and not api.Recognize(timeout=int(timeout * 1000)):
+                raise RuntimeError(f"Tesseract recognition timeout ({timeout}s)")
+            return api.GetUTF8Text()
+    return pytesseract.image_to_string(image, lang=lang, config=f"--oem 3 --psm {psm}", timeout=timeout)
+
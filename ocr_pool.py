@@ -0,0 +1,74 @@
+import os
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+# One long-lived process pool for page OCR, shared by every caller of
+# document_parsers.extract_text_for_indexing (the GUI's save_json_file, the
+# Azure and S3 loaders). Workers are started on first use and keep fitz,
+# PIL and tesseract imported between documents. Workers are spawned, not
+# forked (as on Windows): a fork would copy locks such as
+# document_parsers.FITZ_LOCK held by another thread of the parent (the
+# Azure/S3 fetch pools), and a worker taking such a lock would hang forever.
+#   OCR_WORKERS      - worker processes (default: available cores)
+#   OCR_TASK_TIMEOUT - seconds one page may take; tesseract stops itself
+#                      after that, and a worker still busy with a page after
+#                      OCR_STUCK_AFTER is killed together with its pool
+AVAILABLE_CORES = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+OCR_WORKERS = max(1, int(os.environ.get("OCR_WORKERS", AVAILABLE_CORES)))
+OCR_TASK_TIMEOUT = float(os.environ.get("OCR_TASK_TIMEOUT", "120"))
+# The executor marks one queued page per pool as running before a worker
+# takes it, so a page can look busy for up to two task lengths
+OCR_STUCK_AFTER = 2 * OCR_TASK_TIMEOUT
+
+ocr_pool: Optional[ProcessPoolExecutor] = None
+ocr_pool_lock = threading.Lock()
+
+
+def get_ocr_pool() -> ProcessPoolExecutor:
+    """Returns the shared OCR pool, created on first use."""
+    global ocr_pool
+    with ocr_pool_lock:
+        if ocr_pool is None:
+            ocr_pool = ProcessPoolExecutor(max_workers=OCR_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            print(f"⚙️ OCR pool started with {OCR_WORKERS} worker processes.")
+        return ocr_pool
+
+
+def reset_ocr_pool(pool: Optional[ProcessPoolExecutor] = None, kill: bool = False):
+    """
+    Drops a broken or stuck pool; the next call to get_ocr_pool() starts a fresh one.
+    pool is the pool the caller saw fail: when another caller has already
+    replaced it, the current pool is left alone. kill=True terminates its
+    worker processes (a hung page would otherwise keep its worker forever).
+    Pages other callers had queued on it fail with CancelledError or
+    BrokenProcessPool, which ocr_pdf_pages resubmits to the fresh pool.
+    """
+    global ocr_pool
+    with ocr_pool_lock:
+        if pool is None:
+            pool = ocr_pool
+        if pool is None:
+            return
+        if ocr_pool is pool:
+            ocr_pool = None
+    if kill:
+        for process in list((getattr(pool, "_processes", None) or {}).values()):
+            process.terminate()
+        print("⚠️ OCR pool killed (a worker was stuck).")
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_ocr_pool(wait: bool = True):
+    """Graceful stop: queued pages are cancelled, running ones finish, workers exit."""
+    global ocr_pool
+    with ocr_pool_lock:
+        pool, ocr_pool = ocr_pool, None
+    if pool is not None:
+        pool.shutdown(wait=wait, cancel_futures=True)
+        print("⚙️ OCR pool stopped.")
+
+
+atexit.register(shutdown_ocr_pool)
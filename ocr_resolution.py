@@ -0,0 +1,134 @@
+import os
+import statistics
+from typing import Optional, Tuple
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+# How a scanned page is turned into the image Tesseract reads.
+#   OCR_RESOLUTION=fixed    - the whole page at OCR_ZOOM (3 = 216 DPI)
+#   OCR_RESOLUTION=adaptive - a cheap probe render (OCR_PROBE_ZOOM) measures
+#                             the height of the text lines and the inked area;
+#                             the page is then rendered at the zoom that brings
+#                             its lines to OCR_TARGET_LINE_HEIGHT pixels (clamped
+#                             to OCR_MIN_ZOOM..OCR_MAX_ZOOM), cropped to the ink
+#                             plus a small margin. Large-font scans get far
+#                             fewer pixels, tiny print gets more, and blank pages
+#                             are not OCR'd at all.
+# Tesseract time grows with pixel count; its accuracy is best around a 20-30px
+# x-height, i.e. roughly 40px from ascender to descender of a line.
+# ocr_benchmark.py compares both modes (pages/sec and accuracy) on real PDFs.
+OCR_RESOLUTION = os.environ.get("OCR_RESOLUTION", "fixed").strip().lower()
+OCR_ZOOM = 3
+OCR_PROBE_ZOOM = float(os.environ.get("OCR_PROBE_ZOOM", "1"))
+OCR_TARGET_LINE_HEIGHT = float(os.environ.get("OCR_TARGET_LINE_HEIGHT", "40"))
+OCR_MIN_ZOOM = float(os.environ.get("OCR_MIN_ZOOM", "1.5"))
+OCR_MAX_ZOOM = float(os.environ.get("OCR_MAX_ZOOM", "4"))
+
+INK_THRESHOLD = 128       # gray level below which a pixel counts as ink
+INK_ROW_MIN = 3           # mean ink (0-255) a row needs to be part of a text line (~1% of its width)
+CROP_MARGIN = 0.02        # margin kept around the ink, as a fraction of the page size
+MIN_LINE_PIXELS = 3       # shorter runs in the probe are specks / rules, not text lines
+
+
+def pixmap_to_image(pix):
+    """PIL view of a grayscale (no alpha) fitz Pixmap, without an encode/decode round trip."""
+    return Image.frombytes("L", (pix.width, pix.height), pix.samples, "raw", "L", pix.stride)
+
+
+def render_page_gray(page, zoom=OCR_ZOOM, clip=None):
+    return pixmap_to_image(page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip,
+                                           colorspace=fitz.csGRAY, alpha=False))
+
+
+def ocr_resolution_settings(mode: str = None) -> str:
+    """The rendering settings as one string, part of the OCR cache key."""
+    mode = mode or OCR_RESOLUTION
+    if mode != "adaptive":
+        return f"fixed:{OCR_ZOOM}"
+    return f"adaptive:{OCR_PROBE_ZOOM}:{OCR_TARGET_LINE_HEIGHT}:{OCR_MIN_ZOOM}-{OCR_MAX_ZOOM}"
+
+
+def ink_mask(image):
+    """Binary 'L' image: 255 where the grayscale image has ink, 0 elsewhere."""
+    return image.point(lambda v: 255 if v < INK_THRESHOLD else 0)
+
+
+def measure_line_height(mask) -> Optional[float]:
+    """
+    Median height (pixels) of the text lines in an ink mask, from its row
+    projection: consecutive rows carrying ink form one line. None if no
+    line-like runs were found (blank page, a lone picture...).
+    """
+    rows = list(mask.resize((1, mask.height), Image.BOX).getdata())  # mean ink per row
+    runs, run = [], 0
+    for value in rows + [0]:
+        if value >= INK_ROW_MIN:
+            run += 1
+        elif run:
+            if run >= MIN_LINE_PIXELS:
+                runs.append(run)
+            run = 0
+    if not runs:
+        return None
+    return float(statistics.median(runs))
+
+
+def ink_box(mask) -> Optional[Tuple[int, int, int, int]]:
+    """Bounding box of the ink plus CROP_MARGIN, in mask pixels; None for a blank page."""
+    box = mask.getbbox()
+    if box is None:
+        return None
+    pad_x, pad_y = int(mask.width * CROP_MARGIN) + 1, int(mask.height * CROP_MARGIN) + 1
+    return (max(0, box[0] - pad_x), max(0, box[1] - pad_y),
+            min(mask.width, box[2] + pad_x), min(mask.height, box[3] + pad_y))
+
+
+def adaptive_scale(line_height: Optional[float], current_zoom: float) -> float:
+    """Zoom that brings line_height (measured at current_zoom) to the target height."""
+    if not line_height:
+        return OCR_ZOOM
+    zoom = current_zoom * OCR_TARGET_LINE_HEIGHT / line_height
+    return min(OCR_MAX_ZOOM, max(OCR_MIN_ZOOM, zoom))
+
+
+def render_page_for_ocr(page, mode: str = None):
+    """
+    Grayscale image of a PDF page to OCR, per OCR_RESOLUTION (or `mode`).
+    Returns None when the adaptive probe finds nothing on the page.
+    """
+    if (mode or OCR_RESOLUTION) != "adaptive":
+        return render_page_gray(page, zoom=OCR_ZOOM)
+
+    mask = ink_mask(render_page_gray(page, zoom=OCR_PROBE_ZOOM))
+    box = ink_box(mask)
+    if box is None:
+        return None
+    zoom = adaptive_scale(measure_line_height(mask), OCR_PROBE_ZOOM)
+    # Probe pixels -> page coordinates. The probe and the clip are both in
+    # page.rect space (rotation already applied), so no derotation here
+    clip = fitz.Rect(*(v / OCR_PROBE_ZOOM for v in box))
+    return render_page_gray(page, zoom=zoom, clip=clip & page.rect)
+
+
+def prepare_ocr_image(image, dpi: float, mode: str = None):
+    """
+    The same adaptation for an image that is already rendered (pdfplumber
+    pages, embedded images) at `dpi`: crop to the ink and rescale to the
+    target line height. Returns the image unchanged in fixed mode and None
+    when it holds no ink.
+    """
+    if (mode or OCR_RESOLUTION) != "adaptive":
+        return image
+    image = image.convert("L")
+    mask = ink_mask(image)
+    box = ink_box(mask)
+    if box is None:
+        return None
+    image = image.crop(box)
+    zoom = dpi / 72.0
+    scale = adaptive_scale(measure_line_height(mask.crop(box)), zoom) / zoom
+    if abs(scale - 1) > 0.05:
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                             Image.LANCZOS)
+    return image
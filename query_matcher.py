@@ -0,0 +1,308 @@
+import re
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Pattern, FrozenSet
+
+from text_normalize import normalize_text, normalize_with_origins
+
+# How the text side is normalized, one per historical matcher:
+#   "lower"      - text.lower() against lowercased words (document_parsers.match_line)
+#   "ignorecase" - re.IGNORECASE on the raw text (Azure / Amazon match_line)
+#   "words"      - only the words are lowercased (GUI paragraph_matches)
+#   "normalized" - the text is already text_normalize.normalize_text() output
+#                  (the norm_lines shadow copy); the words are normalized here
+CASE_MODES = ("lower", "ignorecase", "words", "normalized")
+
+# matching_lines() checks index candidates one by one when they are fewer
+# than 1/N of the page's lines, and scans the whole page otherwise.
+SPARSE_CANDIDATES_RATIO = 8
+
+
+class CompiledQuery:
+    """
+    A search query compiled once per request and reused for every line.
+
+    hit_set() reports which words a line contains, with the combined
+    alternation rejecting lines without any hit in one pass. A paragraph's
+    context (the line and its neighbours) is then decided from the lines'
+    hit sets (accepts_lines) instead of rescanning the joined text, so every
+    line is scanned once however many contexts it belongs to.
+    Instances are immutable and safe to share.
+    """
+
+    __slots__ = ("words", "mode", "match_type", "case", "needles",
+                 "_lower_text", "_any_pattern", "_word_patterns", "_highlight_pattern", "_highlight_each_patterns",
+                 "_empty_result",
+                 "_required", "_first_hit", "line_local")
+
+    def __init__(self, words: Iterable[str], mode: str = "any", match_type: str = "partial",
+                 case: str = "lower"):
+        if case not in CASE_MODES:
+            raise ValueError(f"Unknown case mode '{case}'")
+        self.words: Tuple[str, ...] = tuple(words)
+        self.mode = "all" if mode == "all" else "any"
+        self.match_type = "full" if match_type == "full" else "partial"
+        self.case = case
+        self._lower_text = case == "lower"
+
+        flags = re.IGNORECASE if case == "ignorecase" else 0
+        if case == "normalized":
+            self.needles: Tuple[str, ...] = tuple(normalize_text(w) for w in self.words)
+        else:
+            self.needles = tuple(w if case == "ignorecase" else w.lower() for w in self.words)
+        escaped = [re.escape(n) for n in self.needles]
+        if self.match_type == "full":
+            self._word_patterns: Tuple[Pattern, ...] = tuple(re.compile(rf"\b{e}\b", flags) for e in escaped)
+            any_source = r"\b(?:" + "|".join(escaped) + r")\b"
+        else:
+            self._word_patterns = tuple(re.compile(e, flags) for e in escaped)
+            any_source = "|".join(escaped)
+        self._any_pattern = re.compile(any_source, flags) if escaped else None
+
+        # Highlighting keeps the words as typed (case-insensitive), longest first:
+        # the spans must not depend on the word order, since reordered queries
+        # share one result cache entry ("ab abc" and "abc ab" both mark "abc").
+        # Normalized queries highlight what they matched: the needles, found in
+        # the normalized text and mapped back to the original characters.
+        highlight_words = "|".join(re.escape(w) for w in sorted(self.needles if case == "normalized" else self.words,
+                                                                key=len, reverse=True))
+        if self.match_type == "full":
+            highlight_source = r"\b(" + highlight_words + r")\b"
+        else:
+            highlight_source = r"(" + highlight_words + r")"
+        self._highlight_pattern = re.compile(highlight_source, re.IGNORECASE) if self.words else None
+        if case == "ignorecase":
+            self._highlight_each_patterns = self._word_patterns
+        else:
+            typed = [re.escape(w) for w in self.words]
+            if self.match_type == "full":
+                typed = [rf"\b{e}\b" for e in typed]
+            self._highlight_each_patterns = tuple(re.compile(e, re.IGNORECASE) for e in typed)
+
+        # An empty query: all([]) / any([]) like the original loops; the cloud copies reject it
+        self._empty_result = self.mode == "all" and case not in ("ignorecase", "normalized")
+
+        self._required = frozenset(range(len(self.needles)))
+        self._first_hit = frozenset((0,))
+        # No needle spans whitespace, so hits in " ".join(lines) are exactly the lines' hits
+        self.line_local = not any(re.search(r"\s", n) for n in self.needles)
+
+    def _haystack(self, text: str) -> str:
+        return text.lower() if self._lower_text else text
+
+    def hit_set(self, text: str) -> FrozenSet[int]:
+        """
+        Indexes of the query words found in text. The combined pattern rejects
+        lines without any hit in one pass; for mode="any" that single hit is
+        all a decision needs, so only its word is reported.
+        """
+        if self._any_pattern is None:
+            return frozenset()
+        haystack = self._haystack(text)
+        if self.mode == "all" and self.match_type == "partial" and self.case != "ignorecase":
+            return frozenset(i for i, needle in enumerate(self.needles) if needle in haystack)
+        if not self._any_pattern.search(haystack):
+            return frozenset()
+        if self.mode == "any":
+            return self._first_hit
+        return frozenset(i for i, pattern in enumerate(self._word_patterns) if pattern.search(haystack))
+
+    def page_hits(self, lines: Sequence[str]) -> Dict[int, FrozenSet[int]]:
+        """
+        {line index: hit_set(line)} for every line of a page that has a hit.
+
+        The page is joined with newlines into one buffer and each pattern runs
+        over it once; a hit is mapped back to its line with bisect on the line
+        offsets, and the search resumes at the next line. Interpreter work is
+        per matching line instead of per line.
+        """
+        if self._any_pattern is None or not lines:
+            return {}
+        buffer = self._haystack("\n".join(lines))
+        if not self.line_local or buffer.count("\n") != len(lines) - 1:
+            # A word or a line holds whitespace/newlines itself: lines must be kept apart
+            hits = {}
+            for i, line in enumerate(lines):
+                found = self.hit_set(line)
+                if found:
+                    hits[i] = found
+            return hits
+        starts = _line_starts(buffer, lines)
+
+        if self.mode == "any":
+            return {i: self._first_hit for i in _hit_lines(self._any_pattern, buffer, starts)}
+
+        found: Dict[int, set] = {}
+        for word_idx, pattern in enumerate(self._word_patterns):
+            for i in _hit_lines(pattern, buffer, starts):
+                found.setdefault(i, set()).add(word_idx)
+        return {i: frozenset(found[i]) for i in sorted(found)}
+
+    def matching_lines(self, lines: Sequence[str], candidates: Optional[Sequence[int]] = None) -> List[int]:
+        """
+        Ascending indexes of the lines that match. candidates (from the search
+        index) restricts the result; sparse candidates are checked one by one.
+        """
+        if not self.needles:
+            return list(range(len(lines)) if candidates is None else candidates) if self._empty_result else []
+        if candidates is not None and len(candidates) * SPARSE_CANDIDATES_RATIO < len(lines):
+            return [i for i in candidates if self.matches(lines[i])]
+
+        hits = self.page_hits(lines)
+        if candidates is not None:
+            allowed = set(candidates)
+            return [i for i, found in hits.items() if i in allowed and self.accepts(found)]
+        return [i for i, found in hits.items() if self.accepts(found)]
+
+    def page_hit_lookup(self, lines: Sequence[str], candidates: Optional[Sequence[int]] = None
+                        ) -> Tuple[List[int], Callable[[int], FrozenSet[int]]]:
+        """
+        For paragraph building: the lines with at least one hit (ascending,
+        within candidates) and a hit_set lookup for any line of the page.
+        Dense pages are scanned once as a whole, sparse candidates line by line.
+        """
+        if candidates is not None and len(candidates) * SPARSE_CANDIDATES_RATIO < len(lines):
+            line_hits = {}
+
+            def hits_of(j):
+                if j not in line_hits:
+                    line_hits[j] = self.hit_set(lines[j])
+                return line_hits[j]
+
+            return [i for i in candidates if hits_of(i)], hits_of
+
+        hits = self.page_hits(lines)
+        if candidates is None:
+            hit_lines = list(hits)
+        else:
+            allowed = set(candidates)
+            hit_lines = [i for i in hits if i in allowed]
+        no_hits = frozenset()
+        return hit_lines, lambda j: hits.get(j, no_hits)
+
+    def accepts(self, found) -> bool:
+        """any/all decision over a set of found word indexes (e.g. merged from several lines)."""
+        if not self.needles:
+            return self._empty_result
+        if self.mode == "all":
+            return self._required.issubset(found)
+        return bool(found)
+
+    def accepts_lines(self, hit_sets: Iterable[FrozenSet[int]], lines: List[str]) -> bool:
+        """
+        matches(" ".join(lines)) decided from the lines' own hit sets (may be
+        a lazy iterable), stopping as soon as the answer is known.
+        """
+        if not self.line_local:
+            return self.matches(" ".join(lines))
+        if not self.needles:
+            return self._empty_result
+        found = set()
+        for hits in hit_sets:
+            found.update(hits)
+            if self.accepts(found):
+                return True
+        return False
+
+    def matches(self, text: str) -> bool:
+        """True if text satisfies the query (any/all words, partial/full)."""
+        if self._any_pattern is None:
+            return self._empty_result
+        haystack = self._haystack(text)
+
+        if self.mode == "all":
+            if self.match_type == "partial" and self.case != "ignorecase":
+                return all(needle in haystack for needle in self.needles)
+            return all(pattern.search(haystack) for pattern in self._word_patterns)
+        return self._any_pattern.search(haystack) is not None
+
+    def highlight(self, text: str, template: str) -> str:
+        """One pass wrapping every match in template ("...{}...")."""
+        if self._highlight_pattern is None:
+            return text
+        if self.case == "normalized":
+            return wrap_spans(text, self.highlight_spans(text), template)
+        return self._highlight_pattern.sub(lambda m: template.format(m.group(0)), text)
+
+    def highlight_spans(self, text: str) -> List[Tuple[int, int]]:
+        """(start, end) of every span highlight() would wrap, for rendering on the client."""
+        if self._highlight_pattern is None:
+            return []
+        if self.case != "normalized":
+            return [match.span() for match in self._highlight_pattern.finditer(text)]
+
+        normalized, origins = normalize_with_origins(text)
+        if origins is None:
+            return []
+        spans: List[Tuple[int, int]] = []
+        for match in self._highlight_pattern.finditer(normalized):
+            if match.start() == match.end():
+                continue
+            start, end = origins[match.start()][0], origins[match.end() - 1][1]
+            if spans and start < spans[-1][1]:  # two hits inside one original character (e.g. a ligature)
+                spans[-1] = (spans[-1][0], max(end, spans[-1][1]))
+            else:
+                spans.append((start, end))
+        return spans
+
+    def highlight_each(self, text: str, template: str) -> str:
+        """Word by word, like the Azure/Amazon highlighter (later words may match inside earlier marks)."""
+        for pattern in self._highlight_each_patterns:
+            text = pattern.sub(lambda m: template.format(m.group()), text)
+        return text
+
+
+def wrap_spans(text: str, spans: Iterable[Sequence[int]], template: str) -> str:
+    """Wraps every (start, end) span of text in template ("...{}...")."""
+    parts = []
+    last = 0
+    for start, end in spans:
+        parts.append(text[last:start])
+        parts.append(template.format(text[start:end]))
+        last = end
+    parts.append(text[last:])
+    return "".join(parts)
+
+
+def _line_starts(buffer: str, lines: Sequence[str]) -> List[int]:
+    """Offset of every line inside "\n".join(lines) (as transformed into buffer)."""
+    starts = [0]
+    position = 0
+    lengths = [len(line) for line in lines]
+    if sum(lengths) + len(lines) - 1 == len(buffer):
+        for length in lengths[:-1]:
+            position += length + 1
+            starts.append(position)
+        return starts
+    # lower() changed some line's length: walk the separators instead
+    position = buffer.find("\n")
+    while position != -1:
+        starts.append(position + 1)
+        position = buffer.find("\n", position + 1)
+    return starts
+
+
+def _hit_lines(pattern: Pattern, buffer: str, starts: List[int]) -> Iterable[int]:
+    """Indexes of the lines containing a pattern match, in order, one search per hit line."""
+    last_line = len(starts) - 1
+    position = 0
+    while True:
+        match = pattern.search(buffer, position)
+        if match is None:
+            return
+        line_idx = bisect_right(starts, match.start()) - 1
+        yield line_idx
+        if line_idx >= last_line:
+            return
+        position = starts[line_idx + 1]
+
+
+@lru_cache(maxsize=256)
+def _compile_cached(words: Tuple[str, ...], mode: str, match_type: str, case: str) -> CompiledQuery:
+    return CompiledQuery(words, mode=mode, match_type=match_type, case=case)
+
+
+def compile_query(words: Iterable[str], mode: str = "any", match_type: str = "partial",
+                  case: str = "lower") -> CompiledQuery:
+    """Cached CompiledQuery, so legacy match_line(line, words, ...) calls compile only once."""
+    return _compile_cached(tuple(words), mode, match_type, case)
@@ -0,0 +1,119 @@
+import os
+import time
+import threading
+import traceback
+from typing import Dict, List, Optional, Any, Callable, Iterable, Tuple
+
+# Seconds between background revalidation passes (0 disables the scheduler;
+# /refresh still works on demand).
+REFRESH_INTERVAL_SECONDS = int(os.environ.get("REFRESH_INTERVAL_SECONDS", "300"))
+
+
+class DocumentVersionCache:
+    """
+    Parsed documents keyed by blob name, together with the storage version
+    (ETag / generation, plus the .index/ sidecar version) they were built from.
+
+    Loaders list blobs with metadata only and call get() first: an unchanged
+    version returns the previous document object, so nothing is downloaded
+    or parsed again (and SearchIndex sees the same object -> no re-indexing).
+    sweep() drops blobs that disappeared from a listing.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[Any, Dict[str, Any]]] = {}
+        self._prefixes: Dict[str, float] = {}  # listed prefix -> last listing time
+        self.reused = 0
+        self.rebuilt = 0
+        self.deleted = 0
+
+    def get(self, name: str, version: Any) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry[0] == version:
+                self.reused += 1
+                return entry[1]
+            return None
+
+    def put(self, name: str, version: Any, document: Dict[str, Any]):
+        with self._lock:
+            self._entries[name] = (version, document)
+            self.rebuilt += 1
+
+    def sweep(self, prefix: str, seen: Iterable[str]) -> List[str]:
+        """Forgets every cached blob under prefix that the latest listing did not return."""
+        seen = set(seen)
+        with self._lock:
+            self._prefixes[prefix] = time.time()
+            stale = [name for name in self._entries if name.startswith(prefix) and name not in seen]
+            for name in stale:
+                del self._entries[name]
+            self.deleted += len(stale)
+        return stale
+
+    def loaded_prefixes(self) -> List[str]:
+        with self._lock:
+            return list(self._prefixes)
+
+    def has_listed(self, prefix: str) -> bool:
+        """True once a listing of prefix completed (its documents are cached from then on)."""
+        with self._lock:
+            return prefix in self._prefixes
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"documents": len(self._entries), "prefixes": len(self._prefixes),
+                    "reused": self.reused, "rebuilt": self.rebuilt, "deleted": self.deleted}
+
+
+class PeriodicRefresher:
+    """
+    Runs refresh_fn(path) for every path returned by paths_fn(), either on a
+    background schedule (started lazily, daemon thread) or on demand from a
+    /refresh endpoint. Passes never overlap.
+    """
+
+    def __init__(self, refresh_fn: Callable[[str], Dict[str, Any]], paths_fn: Callable[[], List[str]],
+                 interval_seconds: int = REFRESH_INTERVAL_SECONDS):
+        self.refresh_fn = refresh_fn
+        self.paths_fn = paths_fn
+        self.interval_seconds = interval_seconds
+        self._run_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.last_run: Optional[float] = None
+        self.last_duration: Optional[float] = None
+
+    def start(self):
+        if self.interval_seconds <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="cache-refresher", daemon=True)
+        self._thread.start()
+        print(f"🔄 Background revalidation every {self.interval_seconds}s.")
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval_seconds)
+            self.refresh(None)
+
+    def refresh(self, paths: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Revalidates the given paths (default: everything currently loaded)."""
+        with self._run_lock:
+            start = time.time()
+            results = {}
+            for path in (paths if paths is not None else self.paths_fn()):
+                try:
+                    results[path] = self.refresh_fn(path)
+                except Exception as e:
+                    print(f"🔥 Revalidation failed for '{path}': {e}")
+                    traceback.print_exc()
+                    results[path] = {"error": str(e)}
+            self.last_run = start
+            self.last_duration = time.time() - start
+            if results:
+                print(f"🔄 Revalidated {len(results)} path(s) in {self.last_duration:.2f}s: {results}")
+            return results
+
+    def status(self) -> Dict[str, Any]:
+        return {"interval_seconds": self.interval_seconds, "last_run": self.last_run,
+                "last_duration": self.last_duration}
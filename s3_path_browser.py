@@ -5,7 +5,7 @@ import binascii, base64
 from typing import List, Dict, Any, Optional
 from PyQt5 import QtWidgets, QtCore
 from PyQt5.QtWidgets import QMessageBox
-import pytesseract
+from ocr_engine import ocr_image
 from pdf2image import convert_from_path
 
 # Assuming these are imported from your project
@@ -48,7 +48,7 @@ def get_ocr_text_from_pdf(pdf_path):
 
     for page in pages:
         # Perform OCR on each page
-        text = pytesseract.image_to_string(page, lang='heb+eng')  # Supports Hebrew & English
+        text = ocr_image(page, lang='heb+eng')  # Supports Hebrew & English
         full_text += text
 
     return full_text
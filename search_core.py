@@ -6,7 +6,9 @@ from flask import Flask, request, jsonify
 
 
 
-from search_utilities import (get_documents_for_path, get_gemini_client_instance)
+from search_utilities import (get_documents_for_path, get_gemini_client_instance, SEARCH_INDEX,
+                              load_search_snapshots, DIRECTORY_CACHE_MAP, CACHE_REFRESHER,
+                              SEARCH_RESULTS, corpus_version)
 
 
 # ==============================================================================
@@ -14,7 +16,15 @@ from search_utilities import (get_documents_for_path, get_gemini_client_instance
 # ==============================================================================
 
 
-from document_parsers import split_into_paragraphs, match_line, highlight_matches_html, find_paragraph_position_in_pages
+from search_stream import requested_stream_format, stream_search_response
+from search_encoding import (install_response_compression, hit_encoding_from_config, encode_match_entries,
+                             search_response)
+from search_paging import window_from_config
+from search_result_cache import result_cache_key, cached_search
+from search_kernel import compile_search, iter_line_hits, iter_paragraph_hits, hit_entry, render_from_config
+from search_index import group_refs_by_page
+from document_parsers import (document_paragraphs, highlight_matches_html,
+                              find_paragraph_position_in_pages, normalize_pages)
 # ... existing configurations ...
 
 
@@ -27,12 +37,16 @@ def simple_keyword_search(query: str,
                           directory_path: str = "",
                           mode="any",
                           match_type="partial",
-                          show_mode="line"):
+                          show_mode="line",
+                          window=None,
+                          render="html"):
     """
     Simple non-AI keyword search:
     - mode: 'any' or 'all'
     - match_type: 'partial' or 'full'
     - show_mode: 'line' or 'paragraph'
+    - window: optional search_paging.ResultWindow (limit/offset/count-only)
+    - render: 'html' (pre-rendered strings) or 'hits' (structured hits)
     """
     documents = get_documents_for_path(directory_path)
 
@@ -48,90 +62,137 @@ def simple_keyword_search(query: str,
     if not words:
         return {"status": "ok", "details": "Empty query", "matches": []}
 
-    results = []
+    results = list(iter_cached_keyword_matches(documents, words, directory_path, mode=mode, match_type=match_type,
+                                               show_mode=show_mode, window=window, render=render))
+
+    response = {
+        "debug": debug_str,
+        "status": "ok",
+        "query": query,
+        "directory_path": directory_path,
+        "mode": mode,
+        "match_type": match_type,
+        "show_mode": show_mode,
+        "render": render,
+        "matches": results
+    }
+    if window is not None:
+        response["page"] = window.summary()
+    return response
+
+
+def stream_keyword_matches(query: str,
+                           directory_path: str = "",
+                           mode="any",
+                           match_type="partial",
+                           show_mode="line",
+                           window=None,
+                           render="html"):
+    """
+    Lazy simple_keyword_search for the streaming endpoint: yields each
+    file's match entry as soon as that document has been scanned.
+    """
+    words = [w.strip() for w in query.split() if w.strip()]
+    if not words:
+        return
+    documents = get_documents_for_path(directory_path) or []
+    yield from iter_cached_keyword_matches(documents, words, directory_path, mode=mode, match_type=match_type,
+                                           show_mode=show_mode, window=window, render=render)
+
+
+def iter_cached_keyword_matches(documents, words, directory_path, mode="any", match_type="partial",
+                                show_mode="line", window=None, render="html"):
+    """
+    iter_keyword_matches() behind the result cache: a repeated search (same
+    normalized words, config and path) on an unchanged cache is replayed.
+    """
+    key = result_cache_key(words, mode, match_type, show_mode, directory_path.strip("/").lower(),
+                           render=render, window=window)
+    return cached_search(SEARCH_RESULTS, key, corpus_version,
+                         lambda: iter_keyword_matches(documents, words, mode=mode, match_type=match_type,
+                                                      show_mode=show_mode, window=window, render=render),
+                         window=window)
+
+
+def iter_keyword_matches(documents, words, mode="any", match_type="partial", show_mode="line", window=None,
+                         render="html"):
+    """
+    Scans documents one by one, yielding a match entry per file with hits.
+    window (search_paging.ResultWindow) limits which hits are rendered and
+    stops the scan once the requested page is complete.
+    render: "html" (matches / matches_html / match_positions) or "hits"
+    (search_kernel.hit_entry dicts, the markup is left to the client).
+    """
+    # Ask the inverted index (or the mmap'd snapshot owning a document) which
+    # lines can possibly match. None means the query cannot be narrowed
+    # (e.g. a 2-letter substring) and we scan as before.
+    index_plan = SEARCH_INDEX.plan(words, mode=mode, match_type=match_type,
+                                   per_line=(show_mode == "line"))
+    # Compiled once for the whole request instead of per line; lines are
+    # compared through their pre-normalized shadow copy (text_normalize)
+    query = compile_search(words, mode, match_type)
 
     for doc in documents:
+        if window is not None and window.exhausted:
+            return
+
         matched_items = []          # text (line or paragraph)
         matched_items_html = []     # highlighted HTML
         match_positions = []        # {"page": p, "line": line_idx}
+        hit_entries = []            # render="hits"
 
         # --- Normalize pages defensively (so we don't crash) ---
-        raw_pages = doc.get("pages")
-
-        pages = []
+        pages = normalize_pages(doc)
 
-        if isinstance(raw_pages, list):
-            if raw_pages and isinstance(raw_pages[0], dict) and "lines" in raw_pages[0]:
-                pages = raw_pages
-            elif raw_pages and isinstance(raw_pages[0], str):
-                pages = [{"page": 1, "lines": raw_pages}]
-        elif isinstance(raw_pages, str):
-            pages = [{"page": 1, "lines": raw_pages.split("\n")}]
+        line_refs = index_plan.line_refs(doc)
+        if line_refs is not None and not line_refs:
+            continue  # The index proves nothing in this document can match
 
-        if not pages:
-            content = doc.get("content", "")
-            pages = [{"page": 1, "lines": content.split("\n")}]
-
-        # =========================
-        #   LINE MODE (unchanged)
-        # =========================
         if show_mode == "line":
-
-            for page_entry in pages:
-                page_num = page_entry.get("page", 1)
-                lines = page_entry.get("lines", []) or []
-
-                for line_idx, line in enumerate(lines, start=1):
-                    if match_line(line, words, mode=mode, match_type=match_type):
-                        matched_items.append(line)
-                        matched_items_html.append(
-                            highlight_matches_html(line, words, match_type=match_type)
-                        )
-                        match_positions.append({
-                            "page": page_num,
-                            "line": line_idx
-                        })
-        # =========================
-        #   PARAGRAPH MODE
-        # =========================
+            # LINE MODE (unchanged)
+            candidate_lines = group_refs_by_page(line_refs) if line_refs is not None else None
+            hits = iter_line_hits(pages, query, candidate_lines)
         else:
+            # PARAGRAPH MODE
             # Restore ORIGINAL behavior: use your split_into_paragraphs on doc["content"]
-            content = doc.get("content", "")
-            paragraphs = split_into_paragraphs(content)
-
-            for paragraph in paragraphs:
-                if match_line(paragraph, words, mode=mode, match_type=match_type):
-                    matched_items.append(paragraph)
-                    matched_items_html.append(
-                        highlight_matches_html(paragraph, words, match_type=match_type)
-                    )
-
-                    # NEW: find (page, line) for this paragraph using pages
-                    page_num, line_idx = find_paragraph_position_in_pages(paragraph, pages)
-                    match_positions.append({
-                        "page": page_num,
-                        "line": line_idx
-                    })
-
-        if matched_items:
-            results.append({
+            # (segmented once per document version, with the page/line each
+            # paragraph starts at and its normalized text)
+            hits = iter_paragraph_hits(document_paragraphs(doc, pages), query)
+
+        for hit in hits:
+            if window is not None and not window.admit(doc["full_path"]):
+                if window.exhausted:
+                    break
+                continue
+            if hit["page"] is None:  # Content does not line up with the pages: search for it
+                hit["page"], hit["line"] = find_paragraph_position_in_pages(hit["text"], pages)
+
+            if render == "hits":
+                hit_entries.append(hit_entry(hit, query))
+                continue
+            matched_items.append(hit["text"])
+            matched_items_html.append(
+                highlight_matches_html(hit["text"], words, match_type=match_type, query=query)
+            )
+            match_positions.append({
+                "page": hit["page"],
+                "line": hit["line"]
+            })
+
+        if hit_entries:
+            yield {
+                "file": doc["name"],
+                "full_path": doc["full_path"],
+                "hits": hit_entries
+            }
+        elif matched_items:
+            yield {
                 "file": doc["name"],
                 "full_path": doc["full_path"],
                 "matches": matched_items,
                 "matches_html": matched_items_html,
                 "match_positions": match_positions
-            })
-
-    return {
-        "debug": debug_str,
-        "status": "ok",
-        "query": query,
-        "directory_path": directory_path,
-        "mode": mode,
-        "match_type": match_type,
-        "show_mode": show_mode,
-        "matches": results
-    }
+            }
 
 
 def perform_search(query: str, directory_path: str = ""):
@@ -234,9 +295,16 @@ def perform_search(query: str, directory_path: str = ""):
 
 
 app = Flask(__name__)
+# Compact JSON, gzip/brotli by Accept-Encoding (search_encoding)
+install_response_compression(app)
 
 timer0 = time.time()
 
+# Map persisted index snapshots (if any survived on this disk) before the first request,
+# then keep every loaded path fresh with cheap metadata-only revalidation passes.
+load_search_snapshots()
+CACHE_REFRESHER.start()
+
 @app.route('/version', methods=['GET'])
 def get_version():
     """Returns the current status of the document cache."""
@@ -256,12 +324,36 @@ def get_cache_status():
     revision = os.environ.get("K_REVISION", "LOCAL_TEST_ENV")
     status_data = {
 
-        "REVISION": revision
+        "REVISION": revision,
+        "cache": DIRECTORY_CACHE_MAP.stats(),
+        "index": SEARCH_INDEX.stats(),
+        "results": SEARCH_RESULTS.stats(),
+        "revalidation": CACHE_REFRESHER.status()
 
     }
     return jsonify(status_data)
 
 
+@app.route('/refresh', methods=['POST', 'GET'])
+def refresh_endpoint():
+    """
+    Revalidates cached paths against the bucket (metadata only): new/changed
+    blobs are re-parsed, deleted ones are evicted. Optional 'directory_path'
+    limits the pass to one cached key; default is every cached key.
+    """
+    data = request.get_json(silent=True) or {}
+    directory_path = (data.get('directory_path') or request.args.get('directory_path') or "").strip()
+    paths = [directory_path.strip("/").lower()] if directory_path else None
+
+    try:
+        results = CACHE_REFRESHER.refresh(paths)
+        return jsonify({"status": "ok", "refreshed": results}), 200
+    except Exception as e:
+        print(f"ERROR in refresh: {e}")
+        traceback.print_exc()
+        return jsonify({"error": f"Refresh failed: {str(e)}"}), 500
+
+
 @app.route('/simple_search', methods=['POST'])
 def simple_search_endpoint():
     # 1. Start the timer immediately
@@ -281,12 +373,33 @@ def simple_search_endpoint():
     if not query or not directory_path:
         return jsonify({"error": "Missing 'query' or 'directory_path' in request."}), 400
 
+    # Paging: only the requested slice of hits is rendered and serialized.
+    # Hits are structured by default; render="html" returns the old markup.
+    try:
+        window = window_from_config(config, query, directory_path, mode, match_type, show_mode)
+        render = render_from_config(config)
+        hit_encoding = hit_encoding_from_config(config)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     # --- CRITICAL SIMPLIFICATION ---
     # We remove global CACHE_STATUS, cache_lock, and the conditional logic.
     # The simple_keyword_search function now handles all caching internally.
 
     print(f"LOG: Executing keyword search for '{query}' in '{directory_path}'.")
 
+    # Streaming variant (Accept: application/x-ndjson / text/event-stream):
+    # every file's matches are flushed as soon as that document is scanned.
+    stream_format = requested_stream_format(request, data)
+    if stream_format:
+        matches = stream_keyword_matches(query, directory_path, mode=mode,
+                                         match_type=match_type, show_mode=show_mode, window=window,
+                                         render=render)
+        matches = encode_match_entries(matches, hit_encoding)
+        header = {"query": query, "directory_path": directory_path, "mode": mode,
+                  "match_type": match_type, "show_mode": show_mode, "render": render, "encoding": hit_encoding}
+        return stream_search_response(matches, header, stream_format, window=window)
+
     try:
         # 2. Call the search function, which handles cache hit/miss transparently
         result = simple_keyword_search(
@@ -294,7 +407,9 @@ def simple_search_endpoint():
             directory_path,
             mode=mode,
             match_type=match_type,
-            show_mode=show_mode
+            show_mode=show_mode,
+            window=window,
+            render=render
         )
 
         # 3. Handle debugging/timing stamps
@@ -310,7 +425,8 @@ def simple_search_endpoint():
         else:
             result["debug"] = time_stamp
 
-        return jsonify(result), 200
+        result["matches"] = list(encode_match_entries(result["matches"], hit_encoding))
+        return search_response(result, request)
 
     except Exception as e:
         print(f"ERROR in simple_keyword_search: {e}")
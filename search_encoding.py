@@ -0,0 +1,150 @@
+import os
+import gzip
+import zlib
+from typing import Dict, List, Any, Iterable, Iterator
+
+from flask import Response, jsonify, request
+
+try:
+    import brotli
+except ImportError:  # gzip (stdlib) is always available
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Wire encodings for search responses, shared by the three Flask apps:
+#   - Accept-Encoding negotiation (br, then gzip) for every JSON/NDJSON/SSE
+#     response above SEARCH_COMPRESS_MIN_BYTES; streamed responses are
+#     compressed chunk by chunk and flushed, so events still arrive live
+#   - search_config {"encoding": "columnar"}: a file's structured hits are
+#     sent as one list per field instead of one object per hit
+#   - Accept: application/msgpack: the (non-streamed) body as MessagePack
+COMPRESS_MIN_BYTES = int(os.environ.get("SEARCH_COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.environ.get("SEARCH_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.environ.get("SEARCH_BROTLI_QUALITY", "5"))
+MSGPACK_MIMETYPE = "application/msgpack"
+COMPRESSIBLE_MIMETYPES = ("application/json", "application/x-ndjson", "text/event-stream", MSGPACK_MIMETYPE)
+
+HIT_ENCODINGS = ("objects", "columnar")
+HIT_FIELDS = ("page", "line", "end_line", "text", "spans")
+
+
+def accepted_encoding(accept_encoding: str) -> str:
+    """'br', 'gzip' or '' for an Accept-Encoding header (q=0 means refused)."""
+    offered = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        offered[name.strip().lower()] = quality
+    if brotli is not None and offered.get("br", 0) > 0:
+        return "br"
+    if offered.get("gzip", 0) > 0:
+        return "gzip"
+    return ""
+
+
+def _compress_stream(chunks: Iterable[Any], encoding: str) -> Iterator[bytes]:
+    """Compresses a streamed body, flushing after every chunk (one event per chunk)."""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        for chunk in chunks:
+            data = compressor.process(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+            yield data + compressor.flush()
+        yield compressor.finish()
+        return
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+        yield data + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def compress_response(response: Response, accept_encoding: str) -> Response:
+    """Applies the negotiated Content-Encoding to a search response, in place."""
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES or "Content-Encoding" in response.headers:
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = accepted_encoding(accept_encoding)
+    if not encoding or response.status_code < 200 or response.status_code >= 300:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_BYTES:
+            return response
+        if encoding == "br":
+            body = brotli.compress(body, quality=BROTLI_QUALITY)
+        else:
+            body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+        response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def install_response_compression(app):
+    """Registers compact JSON and Accept-Encoding compression on a Flask app."""
+    app.json.compact = True
+
+    @app.after_request
+    def _compress(response):
+        return compress_response(response, request.headers.get("Accept-Encoding", ""))
+
+    return app
+
+
+def hit_encoding_from_config(config: Dict[str, Any]) -> str:
+    """search_config["encoding"]; ValueError for an unknown value (endpoints answer 400)."""
+    encoding = str(config.get("encoding") or "objects").strip().lower()
+    if encoding not in HIT_ENCODINGS:
+        raise ValueError(f"'encoding' must be one of {', '.join(HIT_ENCODINGS)}")
+    return encoding
+
+
+def columnar_hits(hits: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    """[{page, line, ...}, ...] -> {"page": [...], "line": [...], ...} (fields no hit has are left out)."""
+    present = [field for field in HIT_FIELDS if any(field in hit for hit in hits)]
+    return {field: [hit.get(field) for hit in hits] for field in present}
+
+
+def expand_columnar_hits(columns: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """Inverse of columnar_hits() (the client side); None cells are dropped."""
+    count = max((len(values) for values in columns.values()), default=0)
+    return [{field: values[i] for field, values in columns.items() if values[i] is not None}
+            for i in range(count)]
+
+
+def encode_match_entries(entries: Iterable[Dict[str, Any]], encoding: str) -> Iterator[Dict[str, Any]]:
+    """Per-file match entries with their "hits" in the requested encoding."""
+    for entry in entries:
+        if encoding == "columnar" and "hits" in entry:
+            entry = {**entry, "hits": columnar_hits(entry["hits"])}
+        yield entry
+
+
+def decode_match_entry(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Client side: a match entry with columnar hits turned back into a list of hits."""
+    if isinstance(entry.get("hits"), dict):
+        entry = {**entry, "hits": expand_columnar_hits(entry["hits"])}
+    return entry
+
+
+def wants_msgpack(req) -> bool:
+    return msgpack is not None and MSGPACK_MIMETYPE in req.headers.get("Accept", "")
+
+
+def search_response(result: Dict[str, Any], req, status: int = 200):
+    """The endpoint's (non-streamed) answer: MessagePack when asked for and available, JSON otherwise."""
+    if wants_msgpack(req):
+        return Response(msgpack.packb(result, use_bin_type=True), status=status, mimetype=MSGPACK_MIMETYPE)
+    return jsonify(result), status
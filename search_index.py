@@ -0,0 +1,370 @@
+import re
+import threading
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_right
+from typing import Dict, List, Optional, Any, Iterable, Tuple, Mapping
+
+from document_parsers import normalize_pages
+from text_normalize import normalize_text, page_normalized_lines
+
+# A "term" is a maximal run of word characters, exactly the units that the
+# regex \b boundaries in match_line() see on a normalized line. Lines are
+# indexed by their text_normalize shadow copy and query words are
+# normalized the same way, so the postings agree with the matcher.
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# Substring (partial) queries are served by character trigrams. Shorter
+# words cannot be narrowed this way and fall back to a full scan.
+GRAM_SIZE = 3
+
+TERMS = "terms"
+GRAMS = "grams"
+
+
+def tokenize(text: str) -> List[str]:
+    """Splits lowercased text into the word tokens used as index terms."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def trigrams(text: str) -> set:
+    """
+    Character trigrams of lowercased text. Query words never contain
+    whitespace, so grams are only taken inside whitespace-separated chunks
+    (this also catches Hebrew prefixes like ה/ו/ב/ל glued to a word).
+    """
+    grams = set()
+    for chunk in text.lower().split():
+        if len(chunk) >= GRAM_SIZE:
+            grams.update(chunk[i:i + GRAM_SIZE] for i in range(len(chunk) - GRAM_SIZE + 1))
+    return grams
+
+
+def _fingerprint(pages) -> int:
+    """Cheap content identity used to skip re-indexing an unchanged document."""
+    return hash(tuple(tuple(p.get("lines", []) or []) for p in pages))
+
+
+def build_postings(pages) -> Tuple[Dict[str, List[int]], Dict[str, List[int]], List[int]]:
+    """
+    Tokenizes normalized pages into per-document postings.
+
+    Returns (terms, grams, page_starts) where terms/grams map a key to the
+    ascending line ordinals that contain it.
+    """
+    doc_terms: Dict[str, List[int]] = {}
+    doc_grams: Dict[str, List[int]] = {}
+    page_starts = []
+    ordinal = 0
+
+    for page_entry in pages:
+        page_starts.append(ordinal)
+        for line in page_normalized_lines(page_entry):
+            if line:
+                for term in set(tokenize(line)):
+                    doc_terms.setdefault(term, []).append(ordinal)
+                for gram in trigrams(line):
+                    doc_grams.setdefault(gram, []).append(ordinal)
+            ordinal += 1
+
+    return doc_terms, doc_grams, page_starts
+
+
+def group_refs_by_page(refs: Iterable[Tuple[int, int]]) -> Dict[int, List[int]]:
+    """[(page_idx, line_idx), ...] -> {page_idx: [line_idx, ...]} (order preserved)."""
+    grouped: Dict[int, List[int]] = {}
+    for page_idx, line_idx in refs:
+        grouped.setdefault(page_idx, []).append(line_idx)
+    return grouped
+
+
+class PostingsIndex(ABC):
+    """
+    Query logic shared by the in-memory SearchIndex and the memory-mapped
+    snapshots in search_snapshot.py. Subclasses provide postings lookup,
+    document ownership and page_starts.
+
+    Postings are shaped {full_path: iterable(line ordinals)}, where each
+    document's lines are numbered 0..n-1 across all of its pages (the
+    "line ordinal"); page_starts maps an ordinal back to (page_idx, line_idx).
+    """
+
+    # Bumped whenever postings change; immutable indexes stay at 0.
+    generation = 0
+
+    def __init__(self):
+        self._lock = threading.RLock()
+
+    @abstractmethod
+    def _lookup(self, kind: str, key: str) -> Optional[Mapping[str, Iterable[int]]]:
+        """{full_path: line ordinals} for one term or trigram, None if absent."""
+
+    @abstractmethod
+    def _page_starts_for(self, full_path: str) -> List[int]:
+        """Ordinal of the first line of each page of the document."""
+
+    @abstractmethod
+    def covers(self, doc: Dict[str, Any], as_of: Optional[int] = None) -> bool:
+        """True if doc is indexed here (and, with as_of, was already indexed at that generation)."""
+
+    def _intersect(self, kind: str, keys: Iterable[str]) -> Dict[str, set]:
+        """Lines containing every key. Starts from the rarest key to keep sets small."""
+        lists = []
+        for key in keys:
+            by_doc = self._lookup(kind, key)
+            if not by_doc:
+                return {}
+            lists.append(by_doc)
+        lists.sort(key=len)
+
+        result = {path: set(ordinals) for path, ordinals in lists[0].items()}
+        for by_doc in lists[1:]:
+            merged = {}
+            for path, lines in result.items():
+                other = by_doc.get(path)
+                if other is not None:
+                    lines.intersection_update(other)
+                    if lines:
+                        merged[path] = lines
+            result = merged
+            if not result:
+                break
+        return result
+
+    def _word_candidates(self, word: str, match_type: str) -> Optional[Dict[str, set]]:
+        """
+        Candidate lines for one query word, or None if the index cannot
+        narrow it.
+
+        - full: every \\w run inside the word must appear as a whole term
+          on the line, so we intersect those term postings.
+        - partial: every trigram of the word must appear on the line.
+        """
+        word = normalize_text(word)
+        if match_type == "full":
+            keys = set(tokenize(word))
+            kind = TERMS
+        else:
+            needle = word.lower()
+            if len(needle) < GRAM_SIZE or any(ch.isspace() for ch in needle):
+                return None
+            keys = {needle[i:i + GRAM_SIZE] for i in range(len(needle) - GRAM_SIZE + 1)}
+            kind = GRAMS
+
+        if not keys:
+            return None
+        return self._intersect(kind, keys)
+
+    def candidates(self, words: List[str], mode: str = "any", match_type: str = "partial",
+                   per_line: bool = True) -> Optional[Dict[str, set]]:
+        """
+        Returns {full_path: set(line ordinals)} that may satisfy the query,
+        or None when a full scan is required.
+
+        per_line=False only requires every word to appear somewhere in the
+        document (paragraph mode can combine words from different lines).
+        """
+        with self._lock:
+            per_word = [self._word_candidates(w, match_type) for w in words]
+
+        if mode == "all":
+            usable = [c for c in per_word if c is not None]
+            if not usable:
+                return None
+            usable.sort(key=len)
+            result = dict(usable[0])
+            for cand in usable[1:]:
+                merged = {}
+                for path, lines in result.items():
+                    other = cand.get(path)
+                    if other is None:
+                        continue
+                    lines = (lines & other) if per_line else (lines | other)
+                    if lines:
+                        merged[path] = lines
+                result = merged
+            return result
+
+        # mode == "any": a single unservable word forces a full scan
+        if any(c is None for c in per_word):
+            return None
+        result: Dict[str, set] = {}
+        for cand in per_word:
+            for path, lines in cand.items():
+                result.setdefault(path, set()).update(lines)
+        return result
+
+    def line_refs(self, full_path: str, ordinals: Iterable[int]) -> List[Tuple[int, int]]:
+        """Maps line ordinals to sorted (page_idx, line_idx) pairs."""
+        page_starts = self._page_starts_for(full_path) or [0]
+
+        refs = []
+        for ordinal in sorted(ordinals):
+            page_idx = bisect_right(page_starts, ordinal) - 1
+            refs.append((page_idx, ordinal - page_starts[page_idx]))
+        return refs
+
+    def plan(self, words: List[str], mode: str = "any", match_type: str = "partial",
+             per_line: bool = True) -> "QueryPlan":
+        return QueryPlan(self, words, mode, match_type, per_line)
+
+
+class QueryPlan:
+    """
+    One query evaluated lazily against every index that owns a document.
+
+    Documents served from a snapshot carry their owning index in
+    `index_owner`; everything else is looked up in the primary index.
+    Candidates are computed at most once per index, so documents indexed
+    after that (a streamed search indexing as it goes) are scanned in full.
+    """
+
+    def __init__(self, primary: PostingsIndex, words, mode, match_type, per_line):
+        self._primary = primary
+        self._query = (words, mode, match_type, per_line)
+        self._hits: Dict[int, Optional[Dict[str, set]]] = {}
+
+    def line_refs(self, doc: Dict[str, Any]) -> Optional[List[Tuple[int, int]]]:
+        """
+        None  -> no index can narrow this document, scan every line.
+        []    -> the index proves nothing in this document can match.
+        [...] -> (page_idx, line_idx) pairs worth checking.
+        """
+        index = getattr(doc, "index_owner", None)
+        if index is None:
+            index = self._primary if self._primary.covers(doc) else None
+        if index is None:
+            return None
+
+        if id(index) not in self._hits:
+            words, mode, match_type, per_line = self._query
+            with index._lock:
+                self._hits[id(index)] = (index.generation, index.candidates(
+                    words, mode=mode, match_type=match_type, per_line=per_line))
+        as_of, hits = self._hits[id(index)]
+        if hits is None or not index.covers(doc, as_of=as_of):
+            return None
+
+        full_path = doc["full_path"]
+        return index.line_refs(full_path, hits.get(full_path, ()))
+
+
+class SearchIndex(PostingsIndex):
+    """
+    In-memory inverted index over document lines.
+
+    Two posting maps are kept, both shaped key -> {full_path: array(line ordinals)}:
+      - terms: whole words (serves match_type="full")
+      - grams: character trigrams (serves match_type="partial")
+
+    The index only narrows the set of lines to check: callers still run
+    their own match_line() on every candidate, so results are identical to
+    a full scan.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._postings: Dict[str, Dict[str, Dict[str, array]]] = {TERMS: {}, GRAMS: {}}
+        self._doc_keys: Dict[str, Tuple[List[str], List[str]]] = {}
+        self._page_starts: Dict[str, List[int]] = {}
+        self._docs: Dict[str, Tuple[Dict[str, Any], int, int]] = {}  # doc, fingerprint, generation
+        self.generation = 0
+
+    # ------------------------------------------------------------------
+    # Maintenance
+    # ------------------------------------------------------------------
+    def add_document(self, doc: Dict[str, Any]):
+        """
+        (Re)indexes a single document under its full_path.
+
+        Loaders that rebuild document dicts on every request (Azure, S3)
+        can call this each time: unchanged content is detected by a
+        fingerprint and only re-bound, not re-tokenized.
+        """
+        full_path = doc.get("full_path")
+        if not full_path:
+            return
+
+        with self._lock:
+            entry = self._docs.get(full_path)
+            if entry is not None and entry[0] is doc:
+                return  # Already indexed (e.g. parent and child keys share the object)
+
+        pages = normalize_pages(doc)
+        fingerprint = _fingerprint(pages)
+
+        with self._lock:
+            entry = self._docs.get(full_path)
+            if entry is not None and entry[1] == fingerprint:
+                self._docs[full_path] = (doc, fingerprint, entry[2])  # Same postings
+                return
+
+        doc_terms, doc_grams, page_starts = build_postings(pages)
+
+        with self._lock:
+            self._remove_locked(full_path)
+            for term, ordinals in doc_terms.items():
+                self._postings[TERMS].setdefault(term, {})[full_path] = array("I", ordinals)
+            for gram, ordinals in doc_grams.items():
+                self._postings[GRAMS].setdefault(gram, {})[full_path] = array("I", ordinals)
+            self._doc_keys[full_path] = (list(doc_terms), list(doc_grams))
+            self._page_starts[full_path] = page_starts
+            self.generation += 1
+            self._docs[full_path] = (doc, fingerprint, self.generation)
+
+    def add_documents(self, documents: Iterable[Dict[str, Any]]):
+        for doc in documents:
+            self.add_document(doc)
+
+    def remove_document(self, full_path: str):
+        with self._lock:
+            self._remove_locked(full_path)
+
+    def _remove_locked(self, full_path: str):
+        terms, grams = self._doc_keys.pop(full_path, ((), ()))
+        for kind, keys in ((TERMS, terms), (GRAMS, grams)):
+            postings = self._postings[kind]
+            for key in keys:
+                by_doc = postings.get(key)
+                if by_doc is not None:
+                    by_doc.pop(full_path, None)
+                    if not by_doc:
+                        del postings[key]
+        self._page_starts.pop(full_path, None)
+        if self._docs.pop(full_path, None) is not None:
+            self.generation += 1
+
+    def document_postings(self, doc: Dict[str, Any]):
+        """
+        (terms, grams, page_starts) for one document, reusing the indexed
+        postings when this exact object is indexed (used by snapshot writers).
+        """
+        full_path = doc.get("full_path")
+        with self._lock:
+            if self.covers(doc):
+                terms, grams = self._doc_keys[full_path]
+                return ({t: self._postings[TERMS][t][full_path] for t in terms},
+                        {g: self._postings[GRAMS][g][full_path] for g in grams},
+                        list(self._page_starts[full_path]))
+        return build_postings(normalize_pages(doc))
+
+    # ------------------------------------------------------------------
+    # PostingsIndex hooks
+    # ------------------------------------------------------------------
+    def _lookup(self, kind: str, key: str):
+        return self._postings[kind].get(key)
+
+    def _page_starts_for(self, full_path: str) -> List[int]:
+        with self._lock:
+            return self._page_starts.get(full_path, [0])
+
+    def covers(self, doc: Dict[str, Any], as_of: Optional[int] = None) -> bool:
+        """True if this exact document object is the one that was indexed."""
+        with self._lock:
+            entry = self._docs.get(doc.get("full_path"))
+            return entry is not None and entry[0] is doc and (as_of is None or entry[2] <= as_of)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"documents": len(self._docs), "terms": len(self._postings[TERMS]),
+                    "grams": len(self._postings[GRAMS])}
@@ -0,0 +1,175 @@
+import os
+from typing import Dict, List, Any, Iterable, Iterator, Optional, Sequence
+
+from query_matcher import CompiledQuery, compile_query, wrap_spans
+from text_normalize import normalize_text, page_normalized_lines
+
+# The one matching path shared by the GCS, Azure and Amazon services and the
+# desktop client. Callers hand over pages ({"page"/"page_number", "lines"})
+# and a query from compile_search(); every scanner yields structured hits
+# (plain dicts) and leaves the HTML to the caller. Matching always runs on
+# the text_normalize shadow lines, so all front ends agree on what matches.
+#
+#   line hit     : {"page", "page_idx", "line", "text"}
+#   context hit  : {"page", "page_idx", "line", "end_line", "lines"}
+#                  a matching line with one line of context on each side
+#   paragraph hit: {"text", "page", "line"} from document_parsers paragraphs
+#
+# "line" is 1-based everywhere; "end_line" is inclusive.
+#
+# Responses carry hits in one of two forms (search_config "render"):
+#   "hits" - hit_entry(): page, line range, text and the (start, end) offsets
+#            of the highlighted words; the client builds the markup for the
+#            rows it actually shows (render_hit_html)
+#   "html" - the pre-rendered HTML strings older clients expect
+RENDER_MODES = ("hits", "html")
+DEFAULT_RENDER = os.environ.get("SEARCH_DEFAULT_RENDER", "hits")
+
+# Lines around a center line that form its context, and how far the scan
+# jumps after a context is reported (so the same lines are not shown twice).
+CONTEXT_BEFORE = 1
+CONTEXT_AFTER = 1
+CONTEXT_STRIDE = 3
+
+CONTEXT_HEADER_TEMPLATE = "<span style='color:blue;'>— עמוד {page} — שורות {start}-{end}</span>"
+OPEN_LINK_TEMPLATE = "<a href='filepage:///{path}?page={page}' style='color:green; text-decoration: none;'>[פתח קובץ]</a>"
+
+
+def render_from_config(config: Dict[str, Any]) -> str:
+    """search_config["render"]; ValueError for an unknown value (endpoints answer 400)."""
+    render = str(config.get("render") or DEFAULT_RENDER).strip().lower()
+    if render not in RENDER_MODES:
+        raise ValueError(f"'render' must be one of {', '.join(RENDER_MODES)}")
+    return render
+
+
+def compile_search(words: Iterable[str], mode: str = "any", match_type: str = "partial") -> CompiledQuery:
+    """The query every scanner expects: compared against normalized text."""
+    return compile_query(words, mode, match_type, case="normalized")
+
+
+def text_matches(query: CompiledQuery, text: str) -> bool:
+    """Free text (a docx paragraph, an OCR block...) against the query."""
+    return query.matches(normalize_text(text or ""))
+
+
+def page_number(page_entry: Dict[str, Any], page_idx: int) -> int:
+    """OCR indexes store "page_number", digital ones "page"; the position is the last resort."""
+    return page_entry.get("page_number") or page_entry.get("page") or page_idx + 1
+
+
+def _page_candidates(candidate_lines: Optional[Dict[int, List[int]]], page_idx: int) -> Optional[List[int]]:
+    return candidate_lines.get(page_idx, []) if candidate_lines is not None else None
+
+
+def iter_line_hits(pages: Sequence[Dict[str, Any]], query: CompiledQuery,
+                   candidate_lines: Optional[Dict[int, List[int]]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Every line that satisfies the query, in page order.
+    candidate_lines: optional {page_idx: [line_idx, ...]} from the search
+    index; pages missing from it are skipped.
+    """
+    for page_idx, page_entry in enumerate(pages):
+        candidates = _page_candidates(candidate_lines, page_idx)
+        if candidates is not None and not candidates:
+            continue
+        lines = page_entry.get("lines", []) or []
+        pnum = page_number(page_entry, page_idx)
+        # One scan over the joined shadow lines of the page
+        for line_idx in query.matching_lines(page_normalized_lines(page_entry), candidates):
+            yield {"page": pnum, "page_idx": page_idx, "line": line_idx + 1, "text": lines[line_idx]}
+
+
+def iter_context_hits(pages: Sequence[Dict[str, Any]], query: CompiledQuery,
+                      candidate_lines: Optional[Dict[int, List[int]]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Contexts (a line and its neighbours) that satisfy the query. A center
+    line needs one query word; the whole context must satisfy mode/match_type.
+    candidate_lines restricts the centers (any other line cannot hold a word).
+    """
+    for page_idx, page_entry in enumerate(pages):
+        candidates = _page_candidates(candidate_lines, page_idx)
+        if candidates is not None and not candidates:
+            continue
+        lines = page_entry.get("lines", []) or []
+        normalized = page_normalized_lines(page_entry)
+        pnum = page_number(page_entry, page_idx)
+        count = len(lines)
+
+        # The page is scanned once: it yields the center lines and the hit
+        # sets the neighbouring contexts are decided from
+        center_lines, hits_of = query.page_hit_lookup(normalized, candidates)
+        next_allowed = 0
+        for i in center_lines:
+            if i < next_allowed:
+                continue  # דילוג כדי למנוע כפילויות של אותה פסקה
+            start = max(0, i - CONTEXT_BEFORE)
+            end = min(i + CONTEXT_AFTER + 1, count)
+            if query.accepts_lines((hits_of(j) for j in range(start, end)), normalized[start:end]):
+                next_allowed = i + CONTEXT_STRIDE
+                yield {"page": pnum, "page_idx": page_idx, "line": start + 1, "end_line": end,
+                       "lines": list(lines[start:end])}
+
+
+def iter_paragraph_hits(paragraphs: Iterable[Sequence[Any]], query: CompiledQuery) -> Iterator[Dict[str, Any]]:
+    """
+    Paragraphs (document_parsers.document_paragraphs entries) that satisfy the
+    query. page/line are None when the content did not line up with the pages.
+    """
+    for paragraph, normalized, pnum, line in paragraphs:
+        if query.matches(normalized):
+            yield {"text": paragraph, "page": pnum, "line": line}
+
+
+def hit_entry(hit: Dict[str, Any], query: CompiledQuery) -> Dict[str, Any]:
+    """The compact JSON form of a hit (render=hits); a context's lines are joined with newlines."""
+    text = hit["text"] if "text" in hit else "\n".join(hit["lines"])
+    entry = {"page": hit["page"], "line": hit["line"]}
+    if "end_line" in hit:
+        entry["end_line"] = hit["end_line"]
+    entry["text"] = text
+    entry["spans"] = query.highlight_spans(text)
+    return entry
+
+
+def highlight_spans_html(text: str, spans: Iterable[Sequence[int]], template: str) -> str:
+    """Wraps every (start, end) span of text in template ("...{}...")."""
+    return wrap_spans(text, spans, template)
+
+
+def render_hit_html(path: str, entry: Dict[str, Any], template: str) -> str:
+    """
+    Client-side HTML for one hit_entry(): contexts as the usual block with
+    header and open link, lines and paragraphs as highlighted text.
+    """
+    highlighted = highlight_spans_html(entry["text"], entry.get("spans", []), template)
+    if "end_line" in entry:
+        return context_html(path, {**entry, "lines": highlighted.split("\n")})
+    prefix = f"עמוד {entry['page']}: " if entry.get("page") is not None else ""
+    return prefix + highlighted.replace("\n", "<br>")
+
+
+def context_html(path: str, hit: Dict[str, Any]) -> str:
+    """The HTML block the desktop client shows for a context hit (header, open link, lines)."""
+    pre = CONTEXT_HEADER_TEMPLATE.format(page=hit["page"], start=hit["line"], end=hit["end_line"])
+    open_link = OPEN_LINK_TEMPLATE.format(path=path.replace('\\', '/'), page=hit["page"])
+    body = "<br>".join(hit["lines"]).replace(".₪", "₪.").replace(",₪", "₪,")
+    return f"{path}  {pre} {open_link}<br><br>{body}<br>"
+
+
+def search_in_json_content(path, pages_list, words, mode, search_mode, candidate_lines=None, window=None):
+    """
+    Context search over an index JSON's pages, rendered as the client's HTML blocks.
+    candidate_lines: optional {page_idx: [line_idx, ...]} from the search index.
+    window: optional search_paging.ResultWindow; contexts outside the
+    requested page are counted but not rendered.
+    """
+    results = []
+    query = compile_search(words, mode, search_mode)
+    for hit in iter_context_hits(pages_list, query, candidate_lines):
+        if window is not None and not window.admit(path):
+            if window.exhausted:
+                break
+            continue
+        results.append(context_html(path, hit))
+    return results
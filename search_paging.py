@@ -0,0 +1,120 @@
+import os
+import json
+import base64
+import hashlib
+from typing import Dict, Any, Optional, Tuple
+
+# Page size applied by the Flask endpoints when search_config has no "limit"
+# (default 0 = unlimited, so clients that never page get every hit), and the
+# largest page a client may ask for with an explicit "limit" (0 = no cap);
+# an explicit limit of 0 ("everything") is capped too.
+DEFAULT_PAGE_SIZE = int(os.environ.get("SEARCH_PAGE_SIZE", "0"))
+MAX_PAGE_SIZE = int(os.environ.get("SEARCH_MAX_PAGE_SIZE", "5000"))
+
+
+class ResultWindow:
+    """
+    The slice of hits (lines or paragraphs, in scan order) a request returns.
+
+    Scanners call admit(full_path) for every hit before building its HTML:
+    True means the hit is inside the page and should be rendered. Hits before
+    `offset` are only counted; once `limit` hits are kept, one more hit proves
+    there is a next page and `exhausted` tells the scanner to stop.
+    count_only keeps nothing and scans everything to report exact totals.
+    """
+
+    def __init__(self, offset: int = 0, limit: Optional[int] = None, count_only: bool = False,
+                 fingerprint: str = ""):
+        self.offset = max(0, offset)
+        self.limit = limit if limit and limit > 0 else None
+        self.count_only = count_only
+        self.fingerprint = fingerprint
+        self.seen = 0
+        self.files = 0
+        self.kept = 0
+        self.has_more = False
+        self._last_path = None
+
+    @property
+    def exhausted(self) -> bool:
+        return self.has_more and not self.count_only
+
+    def admit(self, full_path: str) -> bool:
+        if self.exhausted:
+            return False
+        self.seen += 1
+        if full_path != self._last_path:
+            self._last_path = full_path
+            self.files += 1
+        if self.count_only or self.seen <= self.offset:
+            return False
+        if self.limit is not None and self.kept >= self.limit:
+            self.has_more = True
+            return False
+        self.kept += 1
+        return True
+
+    def state(self) -> Tuple[int, int, int, bool]:
+        """Counters after a scan (search_result_cache replays them with a stored result)."""
+        return self.seen, self.files, self.kept, self.has_more
+
+    def restore(self, state: Tuple[int, int, int, bool]):
+        self.seen, self.files, self.kept, self.has_more = state
+
+    def summary(self) -> Dict[str, Any]:
+        """Paging block for the response; totals only when the whole corpus was scanned."""
+        page = {"offset": self.offset, "limit": self.limit, "returned": self.kept,
+                "has_more": self.has_more,
+                "next_cursor": encode_cursor(self.offset + self.kept, self.fingerprint) if self.has_more else None}
+        if not self.exhausted:
+            page["total_matches"] = self.seen
+            page["total_files"] = self.files
+        return page
+
+
+def query_fingerprint(*parts) -> str:
+    """Ties a cursor to the query it was issued for."""
+    return hashlib.sha1(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()[:12]
+
+
+def encode_cursor(offset: int, fingerprint: str) -> str:
+    raw = json.dumps({"o": offset, "q": fingerprint}).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, fingerprint: str) -> int:
+    """Offset stored in a cursor; ValueError if it is malformed or belongs to another query."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw.decode("utf-8"))
+        offset = int(data["o"])
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if data.get("q") != fingerprint:
+        raise ValueError("Cursor does not belong to this query")
+    return offset
+
+
+def window_from_config(config: Dict[str, Any], *query_parts) -> ResultWindow:
+    """
+    Reads paging from search_config: limit, offset or cursor, count_only.
+    Raises ValueError for bad values (endpoints answer 400).
+    """
+    fingerprint = query_fingerprint(*query_parts)
+    requested = config.get("limit")
+    try:
+        limit = int(requested or 0) if requested is not None else DEFAULT_PAGE_SIZE
+        offset = int(config.get("offset", 0) or 0)
+    except (TypeError, ValueError):
+        raise ValueError("'limit' and 'offset' must be integers")
+    if limit < 0 or offset < 0:
+        raise ValueError("'limit' and 'offset' must be non-negative")
+    if requested is not None and MAX_PAGE_SIZE > 0 and (limit == 0 or limit > MAX_PAGE_SIZE):
+        limit = MAX_PAGE_SIZE
+
+    cursor = config.get("cursor")
+    if cursor:
+        offset = decode_cursor(str(cursor), fingerprint)
+
+    return ResultWindow(offset=offset, limit=limit, count_only=bool(config.get("count_only")),
+                        fingerprint=fingerprint)
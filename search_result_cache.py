@@ -0,0 +1,152 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Any, Callable, Hashable, Iterable, Iterator, Optional, Tuple
+
+from text_normalize import normalize_text
+
+# Finished keyword searches, replayed when the same search is repeated on an
+# unchanged corpus. Bounded by RESULT_CACHE_MAX_MB (0 disables the cache).
+#
+# Key: the normalized word set (so "Foo bar" and "bar foo" share an entry),
+# mode, match_type, show_mode, path, render, the paging window and a corpus
+# version stamp. The stamp comes from the app's own caches (generation
+# counters of the document cache / search index), so any refresh, reload or
+# eviction moves it and the old entries stop matching; they are dropped on
+# the next store.
+RESULT_CACHE_MAX_BYTES = int(float(os.environ.get("RESULT_CACHE_MAX_MB", "64")) * 1024 * 1024)
+
+
+def estimate_result_bytes(value: Any) -> int:
+    """Approximate heap size of cached match entries (dicts, lists, strings, numbers)."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += sys.getsizeof(key) + estimate_result_bytes(item)
+    elif isinstance(value, (list, tuple)):
+        size += sum(estimate_result_bytes(item) for item in value)
+    return size
+
+
+def result_cache_key(words: Iterable[str], mode: str, match_type: str, show_mode: str, path: str,
+                     render: str = "html", window=None) -> Tuple:
+    """Everything a search result depends on, except the corpus version (see cached_search)."""
+    paging = (window.offset, window.limit, window.count_only) if window is not None else None
+    return (tuple(sorted({normalize_text(w) for w in words})),
+            "all" if mode == "all" else "any",
+            "full" if match_type == "full" else "partial",
+            show_mode, path.strip("/"), render, paging)
+
+
+class SearchResultCache:
+    """
+    Byte-bounded LRU of search results: the per-file match entries a scan
+    produced and the ResultWindow counters it ended with.
+
+    All keys end with the corpus version they were computed on. Versions
+    only move forward, so a store under a new version clears everything
+    older at once.
+    """
+
+    def __init__(self, max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple, Tuple[List[Dict[str, Any]], Optional[Tuple], int]]" = OrderedDict()
+        self._version: Hashable = None
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, key: Tuple) -> Optional[Tuple[List[Dict[str, Any]], Optional[Tuple]]]:
+        """(entries, window state) of a stored result, or None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            stored = self._entries.get(key)
+            if stored is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return stored[0], stored[1]
+
+    def put(self, key: Tuple, entries: List[Dict[str, Any]], window_state: Optional[Tuple] = None):
+        if not self.enabled:
+            return
+        size = estimate_result_bytes(entries)
+        if size > self.max_bytes:
+            return  # A single result larger than the whole budget is not worth keeping
+
+        with self._lock:
+            version = key[-1]
+            if version != self._version:
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self._total_bytes = 0
+                self._version = version
+
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._total_bytes -= previous[2]
+            self._entries[key] = (entries, window_state, size)
+            self._total_bytes += size
+
+            while self._total_bytes > self.max_bytes:
+                _, (_, _, victim_size) = self._entries.popitem(last=False)
+                self._total_bytes -= victim_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+def cached_search(cache: SearchResultCache, key: Tuple, corpus_version: Callable[[], Hashable],
+                  scan: Callable[[], Iterable[Dict[str, Any]]], window=None) -> Iterator[Dict[str, Any]]:
+    """
+    Yields the match entries of scan(), or replays them from the cache when
+    the same search already ran on the same corpus version (the window gets
+    the counters of the original scan, so paging blocks are identical).
+
+    A scan is stored only if it ran to the end and the corpus version did
+    not move while it ran (a refresh in between could have mixed versions).
+    """
+    version = corpus_version()
+    key = key + (version,)
+    stored = cache.get(key)
+    if stored is not None:
+        entries, window_state = stored
+        if window is not None and window_state is not None:
+            window.restore(window_state)
+        yield from entries
+        return
+
+    collected = []
+    for entry in scan():
+        collected.append(entry)
+        yield entry
+    if cache.enabled and corpus_version() == version:
+        cache.put(key, collected, window.state() if window is not None else None)
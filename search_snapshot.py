@@ -0,0 +1,472 @@
+import os
+import sys
+import json
+import mmap
+import struct
+import threading
+from array import array
+from bisect import bisect_right
+from collections.abc import Mapping, Sequence
+from typing import Dict, List, Optional, Any, Iterable
+
+from document_parsers import normalize_pages, document_paragraphs
+from search_index import PostingsIndex, SearchIndex, TERMS, GRAMS
+from text_normalize import NORMALIZED_LINES_KEY, PARAGRAPHS_KEY, page_normalized_lines
+
+# ---------------------------------------------------------------------------
+# On-disk layout (all integers little-endian):
+#
+#   MAGIC (8 bytes) | header length (u32) | header JSON | sections...
+#
+# The header holds the cache key, a per-document table (name, full_path,
+# page numbers, page_starts, first global line ordinal...) and the
+# [offset, length] of every section, relative to header["data_start"]:
+#
+#   line_offsets / lines          : u64 offsets + UTF-8 blob, one entry per line
+#   norm_line_offsets / norm_lines: the same for the text_normalize shadow lines
+#   paragraph_offsets / paragraphs: the document_parsers segmentation of every
+#                                   document's content, one entry per paragraph
+#   norm_paragraph_offsets / norm_paragraphs: their normalized text (empty when
+#                                   it equals the paragraph)
+#   paragraph_anchors             : u64 (page, line) pair per paragraph, the
+#                                   line it starts at ((0, 0): not aligned)
+#   {terms,grams}_key_offsets/keys: sorted dictionary (binary searched in place)
+#   {terms,grams}_post_offsets    : u64 offsets into the postings blob
+#   {terms,grams}_postings        : varint delta-encoded global line ordinals
+#   contents                      : only for documents whose content is not
+#                                   simply "\n".join(lines)
+#
+# Nothing but the header is read eagerly: lines and postings are decoded
+# straight from the mmap when a query touches them.
+# ---------------------------------------------------------------------------
+MAGIC = b"SDXSNAP1"
+# Version 2 added the shadow lines and indexes normalized text, version 3 the
+# paragraphs; older files are ignored (and rebuilt from the source) instead
+# of being misread.
+SNAPSHOT_VERSION = 3
+SNAPSHOT_SUFFIX = ".sdx"
+_U32 = struct.Struct("<I")
+_U64 = struct.Struct("<Q")
+
+
+def _u64_bytes(values: List[int]) -> bytes:
+    arr = array("Q", values)
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _encode_deltas(values: Iterable[int], out: bytearray):
+    """Appends ascending integers as LEB128 varints of their gaps."""
+    prev = 0
+    for value in values:
+        delta = value - prev
+        prev = value
+        while delta >= 0x80:
+            out.append((delta & 0x7F) | 0x80)
+            delta >>= 7
+        out.append(delta)
+
+
+def _decode_deltas(data: bytes) -> List[int]:
+    values = []
+    total = current = shift = 0
+    for byte in data:
+        current |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            total += current
+            values.append(total)
+            current = shift = 0
+    return values
+
+
+def write_snapshot(file_path: str, key: str, documents: List[Dict[str, Any]],
+                   index: Optional[SearchIndex] = None):
+    """
+    Serializes documents (and their postings) into a single snapshot file.
+
+    Postings already built by `index` are reused; documents it does not
+    cover are tokenized here. The file is written to a temp name and
+    atomically renamed, so readers never see a half written snapshot.
+    """
+    index = index or SearchIndex()
+
+    line_offsets = [0]
+    lines_blob = bytearray()
+    norm_offsets = [0]
+    norm_blob = bytearray()
+    paragraph_offsets = [0]
+    paragraphs_blob = bytearray()
+    norm_paragraph_offsets = [0]
+    norm_paragraphs_blob = bytearray()
+    paragraph_anchors = []
+    contents_blob = bytearray()
+    postings = {TERMS: {}, GRAMS: {}}
+    doc_table = []
+    ordinal_base = 0
+    seen = set()
+
+    for doc in documents:
+        full_path = doc.get("full_path")
+        if not full_path or full_path in seen:
+            continue
+        seen.add(full_path)
+
+        pages = normalize_pages(doc)
+        doc_terms, doc_grams, page_starts = index.document_postings(doc)
+        paragraphs = document_paragraphs(doc, pages)
+
+        all_lines = []
+        for page_entry in pages:
+            for line in page_entry.get("lines", []) or []:
+                line = line if isinstance(line, str) else str(line)
+                all_lines.append(line)
+                lines_blob += line.encode("utf-8")
+                line_offsets.append(len(lines_blob))
+            for norm_line in page_normalized_lines(page_entry):
+                norm_blob += norm_line.encode("utf-8")
+                norm_offsets.append(len(norm_blob))
+
+        for kind, doc_postings in ((TERMS, doc_terms), (GRAMS, doc_grams)):
+            target = postings[kind]
+            for term, ordinals in doc_postings.items():
+                target.setdefault(term, []).extend(ordinal_base + o for o in ordinals)
+
+        entry = {
+            "name": doc.get("name", ""),
+            "full_path": full_path,
+            "first_line": ordinal_base,
+            "line_count": len(all_lines),
+            "page_numbers": [p.get("page", i + 1) for i, p in enumerate(pages)],
+            "page_starts": page_starts,
+            "first_paragraph": len(paragraph_offsets) - 1,
+            "paragraph_count": len(paragraphs),
+            "extra": {k: v for k, v in doc.items()
+                      if k not in ("name", "full_path", "content", "pages", NORMALIZED_LINES_KEY, PARAGRAPHS_KEY)
+                      and isinstance(v, (str, int, float, bool))},
+        }
+
+        content = doc.get("content", "") or ""
+        joined = "\n".join(all_lines)
+        if content == joined[:len(content)]:
+            entry["content"] = {"prefix": len(content)}
+        else:
+            encoded = content.encode("utf-8")
+            entry["content"] = {"offset": len(contents_blob), "length": len(encoded)}
+            contents_blob += encoded
+
+        for paragraph, normalized, page_num, line_idx in paragraphs:
+            paragraphs_blob += paragraph.encode("utf-8")
+            paragraph_offsets.append(len(paragraphs_blob))
+            if normalized != paragraph:
+                norm_paragraphs_blob += normalized.encode("utf-8")
+            norm_paragraph_offsets.append(len(norm_paragraphs_blob))
+            if isinstance(page_num, int) and page_num >= 0:
+                paragraph_anchors += [page_num, line_idx]
+            else:  # Unaligned content (or a page "number" that is not one): searched for at query time
+                paragraph_anchors += [0, 0]
+
+        doc_table.append(entry)
+        ordinal_base += len(all_lines)
+
+    sections = [("line_offsets", _u64_bytes(line_offsets)), ("lines", bytes(lines_blob)),
+                ("norm_line_offsets", _u64_bytes(norm_offsets)), ("norm_lines", bytes(norm_blob)),
+                ("paragraph_offsets", _u64_bytes(paragraph_offsets)), ("paragraphs", bytes(paragraphs_blob)),
+                ("norm_paragraph_offsets", _u64_bytes(norm_paragraph_offsets)),
+                ("norm_paragraphs", bytes(norm_paragraphs_blob)),
+                ("paragraph_anchors", _u64_bytes(paragraph_anchors))]
+    for kind in (TERMS, GRAMS):
+        keys = sorted(postings[kind], key=lambda k: k.encode("utf-8"))
+        key_offsets = [0]
+        keys_blob = bytearray()
+        post_offsets = [0]
+        post_blob = bytearray()
+        for term in keys:
+            keys_blob += term.encode("utf-8")
+            key_offsets.append(len(keys_blob))
+            _encode_deltas(postings[kind][term], post_blob)
+            post_offsets.append(len(post_blob))
+        sections += [
+            (f"{kind}_key_offsets", _u64_bytes(key_offsets)),
+            (f"{kind}_keys", bytes(keys_blob)),
+            (f"{kind}_post_offsets", _u64_bytes(post_offsets)),
+            (f"{kind}_postings", bytes(post_blob)),
+        ]
+    sections.append(("contents", bytes(contents_blob)))
+
+    # Section offsets depend on the header length, which depends on the
+    # offsets: lay them out relative to the data start and fix up below.
+    relative = {}
+    cursor = 0
+    for name, data in sections:
+        relative[name] = [cursor, len(data)]
+        cursor += len(data)
+
+    header = {"version": SNAPSHOT_VERSION, "key": key, "documents": doc_table,
+              "counts": {TERMS: len(postings[TERMS]), GRAMS: len(postings[GRAMS])}}
+    header["data_start"] = 0
+    header["sections"] = relative
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    data_start = len(MAGIC) + _U32.size + len(header_bytes) + 32  # slack for the data_start digits
+    header["data_start"] = data_start
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    header_bytes = header_bytes.ljust(data_start - len(MAGIC) - _U32.size, b" ")
+
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(_U32.pack(len(header_bytes)))
+        f.write(header_bytes)
+        for _, data in sections:
+            f.write(data)
+    os.replace(tmp_path, file_path)
+
+
+def _file_identity(stat_result):
+    """Tells two versions of a snapshot file apart (write_snapshot replaces the file)."""
+    return stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns
+
+
+class _LineView(Sequence):
+    """Read-only list of one page's lines (or shadow lines), decoded from the mmap on access."""
+    __slots__ = ("_snapshot", "_start", "_stop", "_section")
+
+    def __init__(self, snapshot: "MappedSnapshot", start: int, stop: int, section: str = "lines"):
+        self._snapshot = snapshot
+        self._start = start
+        self._stop = stop
+        self._section = section
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("line index out of range")
+        return self._snapshot.line(self._start + i, self._section)
+
+
+class _ParagraphView(Sequence):
+    """Read-only document_paragraphs() list of one document, decoded from the mmap on access."""
+    __slots__ = ("_snapshot", "_start", "_stop")
+
+    def __init__(self, snapshot: "MappedSnapshot", start: int, stop: int):
+        self._snapshot = snapshot
+        self._start = start
+        self._stop = stop
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("paragraph index out of range")
+        return self._snapshot.paragraph(self._start + i)
+
+
+class MappedDocument(Mapping):
+    """
+    Document dict backed by a snapshot. Behaves like the dicts produced by
+    the loaders (name/full_path/content/pages) without decoding anything
+    until a key is read.
+    """
+    __slots__ = ("index_owner", "_doc_id", "_entry", "_pages", "_paragraphs")
+
+    def __init__(self, snapshot: "MappedSnapshot", doc_id: int):
+        self.index_owner = snapshot
+        self._doc_id = doc_id
+        self._entry = snapshot._doc_table[doc_id]
+        self._pages = None
+        self._paragraphs = None
+
+    def _keys(self):
+        return ["name", "full_path", "content", "pages", PARAGRAPHS_KEY, *self._entry["extra"]]
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return len(self._keys())
+
+    def __getitem__(self, key):
+        entry = self._entry
+        if key == "name":
+            return entry["name"]
+        if key == "full_path":
+            return entry["full_path"]
+        if key == "pages":
+            if self._pages is None:
+                self._pages = self.index_owner._build_pages(entry)
+            return self._pages
+        if key == "content":
+            return self.index_owner._content(entry)
+        if key == PARAGRAPHS_KEY:
+            if self._paragraphs is None:
+                first = entry["first_paragraph"]
+                self._paragraphs = _ParagraphView(self.index_owner, first, first + entry["paragraph_count"])
+            return self._paragraphs
+        return entry["extra"][key]
+
+
+class MappedSnapshot(PostingsIndex):
+    """
+    A snapshot file opened with mmap. Serves both the documents (lazily)
+    and the same candidates()/line_refs() API as SearchIndex, without
+    loading the corpus into memory.
+    """
+
+    def __init__(self, file_path: str):
+        super().__init__()
+        self.file_path = file_path
+        self._file = open(file_path, "rb")
+        self.file_id = _file_identity(os.fstat(self._file.fileno()))
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty file cannot be mapped
+            self._file.close()
+            raise ValueError(f"Empty snapshot file: {file_path}")
+
+        if self._mm[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"Not a search snapshot: {file_path}")
+
+        (header_len,) = _U32.unpack_from(self._mm, len(MAGIC))
+        header_start = len(MAGIC) + _U32.size
+        header = json.loads(self._mm[header_start:header_start + header_len].decode("utf-8"))
+
+        if header.get("version") != SNAPSHOT_VERSION:
+            self.close()
+            raise ValueError(f"Snapshot version {header.get('version')} is not {SNAPSHOT_VERSION}: {file_path}")
+
+        self.key: str = header["key"]
+        self._counts = header.get("counts", {})
+        data_start = header["data_start"]
+        self._sections = {name: (data_start + off, length) for name, (off, length) in header["sections"].items()}
+        self._doc_table: List[Dict[str, Any]] = header["documents"]
+        self._doc_by_path = {entry["full_path"]: i for i, entry in enumerate(self._doc_table)}
+        self._first_lines = [entry["first_line"] for entry in self._doc_table]
+        self._documents = [MappedDocument(self, i) for i in range(len(self._doc_table))]
+
+    def is_current(self) -> bool:
+        """False once file_path was replaced (e.g. rewritten by a revalidation) or removed."""
+        try:
+            return _file_identity(os.stat(self.file_path)) == self.file_id
+        except OSError:
+            return False
+
+    def close(self):
+        try:
+            self._mm.close()
+        finally:
+            self._file.close()
+
+    # ------------------------------------------------------------------
+    # Raw section access
+    # ------------------------------------------------------------------
+    def _u64_at(self, section: str, i: int) -> int:
+        return _U64.unpack_from(self._mm, self._sections[section][0] + 8 * i)[0]
+
+    def _blob(self, section: str, start: int, stop: int) -> bytes:
+        base = self._sections[section][0]
+        return self._mm[base + start:base + stop]
+
+    def line(self, ordinal: int, section: str = "lines") -> str:
+        offsets = section[:-1] + "_offsets"  # lines -> line_offsets, norm_lines -> norm_line_offsets
+        start = self._u64_at(offsets, ordinal)
+        stop = self._u64_at(offsets, ordinal + 1)
+        return self._blob(section, start, stop).decode("utf-8")
+
+    def paragraph(self, ordinal: int):
+        """(paragraph, normalized paragraph, page, line) like document_parsers.build_paragraphs."""
+        paragraph = self.line(ordinal, "paragraphs")
+        normalized = self.line(ordinal, "norm_paragraphs") or paragraph
+        page_num, line_idx = self._u64_at("paragraph_anchors", 2 * ordinal), self._u64_at("paragraph_anchors", 2 * ordinal + 1)
+        if not line_idx:
+            return paragraph, normalized, None, None
+        return paragraph, normalized, page_num, line_idx
+
+    def _build_pages(self, entry) -> List[Dict[str, Any]]:
+        first = entry["first_line"]
+        starts = entry["page_starts"] + [entry["line_count"]]
+        return [{"page": num,
+                 "lines": _LineView(self, first + starts[i], first + starts[i + 1]),
+                 NORMALIZED_LINES_KEY: _LineView(self, first + starts[i], first + starts[i + 1], "norm_lines")}
+                for i, num in enumerate(entry["page_numbers"])]
+
+    def _content(self, entry) -> str:
+        content = entry["content"]
+        if "prefix" in content:
+            first = entry["first_line"]
+            lines = (self.line(first + i) for i in range(entry["line_count"]))
+            return "\n".join(lines)[:content["prefix"]]
+        return self._blob("contents", content["offset"], content["offset"] + content["length"]).decode("utf-8")
+
+    # ------------------------------------------------------------------
+    # Documents
+    # ------------------------------------------------------------------
+    def documents(self, path_prefix: str = "") -> List[MappedDocument]:
+        if not path_prefix:
+            return list(self._documents)
+        prefix = path_prefix.lower()
+        return [doc for doc in self._documents if doc["full_path"].lower().startswith(prefix)]
+
+    # ------------------------------------------------------------------
+    # PostingsIndex hooks
+    # ------------------------------------------------------------------
+    def _find_key(self, kind: str, key: str) -> int:
+        """Binary search in the sorted on-disk dictionary. Returns -1 if absent."""
+        needle = key.encode("utf-8")
+        offsets = f"{kind}_key_offsets"
+        lo, hi = 0, self._counts.get(kind, 0)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            probe = self._blob(f"{kind}_keys", self._u64_at(offsets, mid), self._u64_at(offsets, mid + 1))
+            if probe < needle:
+                lo = mid + 1
+            elif probe > needle:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    def _lookup(self, kind: str, key: str):
+        pos = self._find_key(kind, key)
+        if pos < 0:
+            return None
+        offsets = f"{kind}_post_offsets"
+        data = self._blob(f"{kind}_postings", self._u64_at(offsets, pos), self._u64_at(offsets, pos + 1))
+
+        by_doc: Dict[str, List[int]] = {}
+        doc_id = -1
+        doc_end = -1
+        current = None
+        for ordinal in _decode_deltas(data):
+            if ordinal >= doc_end:
+                doc_id = bisect_right(self._first_lines, ordinal) - 1
+                entry = self._doc_table[doc_id]
+                doc_end = entry["first_line"] + entry["line_count"]
+                current = by_doc.setdefault(entry["full_path"], [])
+            current.append(ordinal - self._first_lines[doc_id])
+        return by_doc
+
+    def _page_starts_for(self, full_path: str) -> List[int]:
+        doc_id = self._doc_by_path.get(full_path)
+        return self._doc_table[doc_id]["page_starts"] if doc_id is not None else [0]
+
+    def covers(self, doc: Dict[str, Any], as_of: Optional[int] = None) -> bool:
+        return getattr(doc, "index_owner", None) is self
+
+    def stats(self) -> Dict[str, int]:
+        return {"documents": len(self._doc_table), "terms": self._counts.get(TERMS, 0),
+                "grams": self._counts.get(GRAMS, 0), "bytes": len(self._mm)}
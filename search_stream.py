@@ -0,0 +1,81 @@
+import json
+import time
+import traceback
+from typing import Dict, Any, Iterable, Iterator, Optional
+
+from flask import Response, stream_with_context
+
+# Streaming variant of /simple_search: one JSON object per scanned file that
+# has matches, sent as soon as it is ready instead of one body at the end.
+#   Accept: application/x-ndjson  (or {"stream": true})  -> one JSON per line
+#   Accept: text/event-stream     (or {"stream": "sse"}) -> Server-Sent Events
+# Events: {"type": "start", ...}, {"type": "match", <file entry>}..., then
+# {"type": "done", "count": n, "debug": ...} or {"type": "error", "error": ...}.
+NDJSON_MIMETYPE = "application/x-ndjson"
+SSE_MIMETYPE = "text/event-stream"
+
+
+def requested_stream_format(request, data: Dict[str, Any]) -> Optional[str]:
+    """'ndjson' / 'sse' when the client asked for a streamed response, None for plain JSON."""
+    accept = request.headers.get("Accept", "")
+    if SSE_MIMETYPE in accept:
+        return "sse"
+    if NDJSON_MIMETYPE in accept:
+        return "ndjson"
+
+    stream = data.get("stream", request.args.get("stream"))
+    if isinstance(stream, str):
+        stream = stream.strip().lower()
+        if stream == "sse":
+            return "sse"
+        return "ndjson" if stream in ("1", "true", "ndjson") else None
+    return "ndjson" if stream else None
+
+
+def encode_event(event: Dict[str, Any], stream_format: str) -> str:
+    payload = json.dumps(event, ensure_ascii=False)
+    if stream_format == "sse":
+        return f"event: {event.get('type', 'message')}\ndata: {payload}\n\n"
+    return payload + "\n"
+
+
+def search_events(matches: Iterable[Dict[str, Any]], header: Dict[str, Any],
+                  window=None) -> Iterator[Dict[str, Any]]:
+    """
+    Wraps per-file match entries in start/match/done events (errors become an
+    'error' event). With a ResultWindow, 'done' carries its paging block.
+    """
+    timer_start = time.time()
+    yield {"type": "start", "status": "ok", **header}
+
+    count = 0
+    try:
+        for entry in matches:
+            count += 1
+            yield {"type": "match", **entry}
+    except Exception as e:
+        print(f"🔥 ERROR in streamed search: {e}")
+        traceback.print_exc()
+        yield {"type": "error", "status": "error", "error": f"Search failed: {str(e)}", "count": count}
+        return
+
+    total_time = round(time.time() - timer_start, 2)
+    print(f"✅ Streamed search completed: {count} files in {total_time}s")
+    done = {"type": "done", "status": "ok", "count": count, "debug": f"{total_time} sec "}
+    if window is not None:
+        done["page"] = window.summary()
+    yield done
+
+
+def stream_search_response(matches: Iterable[Dict[str, Any]], header: Dict[str, Any],
+                           stream_format: str, window=None) -> Response:
+    """Flask response that flushes every event as soon as it is produced."""
+    def generate():
+        for event in search_events(matches, header, window=window):
+            yield encode_event(event, stream_format)
+
+    response = Response(stream_with_context(generate()),
+                        mimetype=SSE_MIMETYPE if stream_format == "sse" else NDJSON_MIMETYPE)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # Don't let a proxy buffer the stream
+    return response
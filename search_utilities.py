@@ -1,19 +1,25 @@
 from google import genai
 import os
-import io
 import time
 from google.cloud import storage
 from google.cloud import vision_v1 as vision
 import traceback
 from pathlib import Path
 import threading
-from concurrent.futures import ThreadPoolExecutor
-from typing import List, Dict, Any, Optional
+import queue
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
 import json
+import hashlib
+import tempfile
 from docx import Document
-from document_parsers import extract_text_and_images_from_pdf
-import pytesseract
-from PIL import Image
+from document_parsers import extract_text_and_images_from_pdf, extract_docx_text, attach_paragraphs
+from search_index import SearchIndex
+from cache_manager import DocumentCache
+from search_result_cache import SearchResultCache
+from revalidation import PeriodicRefresher
+from search_snapshot import MappedSnapshot, MappedDocument, write_snapshot, SNAPSHOT_SUFFIX
+from text_normalize import attach_normalized_lines
 import config_reader
 
 cloud_provider="Google"
@@ -28,6 +34,8 @@ storage_client: Optional[storage.Client] = None
 vision_client: Optional[storage.Client] = None
 gemini_client: Optional[storage.Client] = None
 gcs_bucket: Optional[storage.Client] = None  # <-- NEW: Store the GCS Bucket object once
+parse_pool: Optional[ProcessPoolExecutor] = None
+parse_pool_lock = threading.Lock()
 
 # --- Global Shared State for Caching ---
 
@@ -38,13 +46,63 @@ MAX_WAIT_SECONDS = 600
 POLL_INTERVAL_SECONDS = 10
 MAX_CONCURRENT_DOWNLOADS = 10
 
+# Parse stage of get_gcs_files_context: one worker process per available core
+AVAILABLE_CORES = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", AVAILABLE_CORES))
+PARSE_QUEUE_SIZE = MAX_CONCURRENT_DOWNLOADS * 2  # downloaded-but-unparsed blobs held in memory
+PARSE_IN_FLIGHT = PARSE_WORKERS * 2              # DOCX jobs queued on the process pool
+
 
 # In search_utilities.py (UPDATED GLOBALS)
+cache_lock = threading.Lock() # Guards SNAPSHOTS (the cache manager has its own lock)
+
+# Inverted index over every cached document (term -> doc/page/line postings).
+# Filled by put_documents_in_cache so keyword queries skip the full line scan.
+SEARCH_INDEX = SearchIndex()
+
+
+def _drop_evicted_from_index(path_key: str, documents: List[Dict[str, Any]]):
+    """Cache eviction hook: documents that left the cache are un-indexed as well."""
+    for doc in documents:
+        if SEARCH_INDEX.covers(doc):
+            SEARCH_INDEX.remove_document(doc.get("full_path", ""))
+
+
 # --- Global Shared State for Caching ---
-# Key: directory_path (e.g., "my_folder/docs")
-# Value: List[Dict] (The document data for that path)
-DIRECTORY_CACHE_MAP: Dict[str, List[Dict]] = {}
-cache_lock = threading.Lock() # Use this lock for thread-safe access to the map
+# One sorted store of documents (by full_path); a directory_path key (e.g. "my_folder/docs")
+# marks a loaded subtree, and any path under it is served as a range scan.
+# Bounded by CACHE_MAX_MB (content + pages of every entry); CACHE_POLICY is "lru" or "lfu".
+CACHE_MAX_BYTES = int(float(os.environ.get("CACHE_MAX_MB", "1024")) * 1024 * 1024)
+CACHE_POLICY = os.environ.get("CACHE_POLICY", "lru").lower()
+DIRECTORY_CACHE_MAP = DocumentCache(CACHE_MAX_BYTES, CACHE_POLICY, on_evict=_drop_evicted_from_index)
+
+# Finished keyword searches (RESULT_CACHE_MAX_MB), valid while corpus_version() stays the same
+SEARCH_RESULTS = SearchResultCache()
+
+
+def corpus_version():
+    """Moves whenever a cache key is loaded, refreshed or evicted (or the index changes)."""
+    return DIRECTORY_CACHE_MAP.generation, SEARCH_INDEX.generation
+
+# --- Persistent Index Snapshots ---
+# Every cache key is also written to disk as one binary snapshot (lines + postings)
+# and opened with mmap, so a restarted instance maps it instead of re-downloading
+# and re-parsing the whole corpus. On GCS the file is mirrored into the bucket,
+# next to the .index/ sidecars, so a fresh Cloud Run instance can pull it once.
+SEARCH_SNAPSHOTS_ENABLED = os.environ.get("SEARCH_SNAPSHOTS", "1") != "0"
+SEARCH_SNAPSHOT_DIR = os.environ.get("SEARCH_SNAPSHOT_DIR",
+                                     os.path.join(tempfile.gettempdir(), "smart_doc_search_index"))
+SNAPSHOT_BLOB_PREFIX = ".index/_snapshots/"
+SNAPSHOTS: Dict[str, MappedSnapshot] = {}  # Key: normalized cache key
+
+# Cache keys loaded from the local hard drive instead of the bucket
+LOCAL_HD_CACHE_KEYS = set()
+
+# Blobs that were read but gave no usable content (Vision OCR found no text,
+# "ERROR:" results...): blob name -> (generation, md5_hash). Revalidation skips
+# them until the object changes instead of re-running the OCR every pass.
+FAILED_BLOB_VERSIONS: Dict[str, Tuple[Any, Any]] = {}
+failed_blobs_lock = threading.Lock()
 
 
 
@@ -130,66 +188,170 @@ def get_hd_files_context(directory_path: str, local_root: str) -> List[Dict[str,
     return documents_list
 
 
-# In search_utilities.py
-# In search_utilities.py
+def snapshot_file_name(path_key: str) -> str:
+    """Stable file name for a cache key (keys may contain Hebrew and slashes)."""
+    return hashlib.sha1(path_key.encode("utf-8")).hexdigest()[:20] + SNAPSHOT_SUFFIX
 
-def put_documents_in_cache(path_key: str, documents: List[Dict[str, Any]]):
-    """Safely adds a list of documents to the global cache under the given key."""
-    global DIRECTORY_CACHE_MAP, cache_lock
 
-    # Ensure the key is fully normalized (lowercase, no slashes)
-    normalized_key = path_key.strip("/").lower()
+def save_search_snapshot(path_key: str, documents: List[Dict[str, Any]], mirror_to_bucket: bool = False):
+    """Writes the snapshot for a cache key and (optionally) uploads it to the bucket."""
+    file_name = snapshot_file_name(path_key)
+    local_path = os.path.join(SEARCH_SNAPSHOT_DIR, file_name)
+    try:
+        start = time.time()
+        write_snapshot(local_path, path_key, documents, SEARCH_INDEX)
+        print(f"SNAPSHOT-PUT: Wrote '{path_key}' -> {local_path} in {time.time() - start:.2f}s.")
+        # The previous mapping shows the old file: the next lookup maps the new one.
+        # It is not closed, documents served from it may still be in use.
+        with cache_lock:
+            SNAPSHOTS.pop(path_key, None)
+
+        if mirror_to_bucket:
+            get_gcs_bucket().blob(SNAPSHOT_BLOB_PREFIX + file_name).upload_from_filename(local_path)
+            print(f"SNAPSHOT-PUT: Mirrored '{path_key}' to gs://{BUCKET_NAME}/{SNAPSHOT_BLOB_PREFIX}{file_name}")
+    except Exception as e:
+        print(f"⚠️ Warning: Could not save search snapshot for '{path_key}': {e}")
 
+
+def open_search_snapshot(path_key: str, allow_download: bool = False) -> Optional[MappedSnapshot]:
+    """Maps the snapshot of a cache key from local disk, pulling it from the bucket if allowed."""
     with cache_lock:
-        if documents:
-            DIRECTORY_CACHE_MAP[normalized_key] = documents
-            print(f"CACHE-PUT: Stored {len(documents)} documents for '{normalized_key}'.")
+        snapshot = SNAPSHOTS.get(path_key)
+        if snapshot is not None:
+            if snapshot.is_current():
+                return snapshot
+            del SNAPSHOTS[path_key]  # Rewritten or replaced since it was mapped
 
+    file_name = snapshot_file_name(path_key)
+    local_path = os.path.join(SEARCH_SNAPSHOT_DIR, file_name)
 
-def get_documents_from_cache(directory_path: str) -> Optional[List[Dict[str, Any]]]:
-    """
-    Attempts a hierarchy-aware lookup for documents, checking the exact path
-    and then searching parent paths. Returns None on cache miss.
-    """
-    global DIRECTORY_CACHE_MAP, cache_lock
+    if not os.path.exists(local_path) and allow_download:
+        try:
+            blob = get_gcs_bucket().blob(SNAPSHOT_BLOB_PREFIX + file_name)
+            if not blob.exists():
+                return None
+            os.makedirs(SEARCH_SNAPSHOT_DIR, exist_ok=True)
+            tmp_path = f"{local_path}.{os.getpid()}.download"
+            blob.download_to_filename(tmp_path)
+            os.replace(tmp_path, local_path)
+            print(f"SNAPSHOT-GET: Downloaded '{path_key}' from the bucket.")
+        except Exception as e:
+            print(f"⚠️ Warning: Could not download search snapshot for '{path_key}': {e}")
+            return None
 
-    cleaned_path = directory_path.strip("/").lower()
+    if not os.path.exists(local_path):
+        return None
+
+    try:
+        snapshot = MappedSnapshot(local_path)
+    except Exception as e:
+        print(f"⚠️ Warning: Ignoring unreadable snapshot {local_path}: {e}")
+        return None
+    if snapshot.key != path_key:  # Hash collision / foreign file
+        snapshot.close()
+        return None
 
     with cache_lock:
+        SNAPSHOTS[path_key] = snapshot
+    return snapshot
 
-        # 1a. EXACT MATCH
-        if cleaned_path in DIRECTORY_CACHE_MAP:
-            print(f"CACHE-GET: Exact hit for '{cleaned_path}'.")
-            return list(DIRECTORY_CACHE_MAP[cleaned_path])
 
-        # 1b. PARENT/HIERARCHY MATCH
-        path_segments = cleaned_path.split('/')
-        potential_parent_keys = []
+def load_search_snapshots():
+    """Startup hook: maps every local snapshot straight into the directory cache."""
+    if not SEARCH_SNAPSHOTS_ENABLED or not os.path.isdir(SEARCH_SNAPSHOT_DIR):
+        return
 
-        # Generate parent keys (e.g., 'main_dir/dir1' -> 'main_dir')
-        for i in range(len(path_segments) - 1, 0, -1):
-            key = '/'.join(path_segments[:i])
-            if key:
-                potential_parent_keys.append(key)
-        potential_parent_keys.append("")  # Check the root key
+    for file_name in os.listdir(SEARCH_SNAPSHOT_DIR):
+        if not file_name.endswith(SNAPSHOT_SUFFIX):
+            continue
+        try:
+            snapshot = MappedSnapshot(os.path.join(SEARCH_SNAPSHOT_DIR, file_name))
+        except Exception as e:
+            print(f"⚠️ Warning: Ignoring unreadable snapshot {file_name}: {e}")
+            continue
+        with cache_lock:
+            SNAPSHOTS[snapshot.key] = snapshot
+        DIRECTORY_CACHE_MAP.put(snapshot.key, snapshot.documents())
+        print(f"SNAPSHOT-GET: Mapped '{snapshot.key}' {snapshot.stats()}.")
 
-        for parent_key in potential_parent_keys:
-            if parent_key in DIRECTORY_CACHE_MAP:
-                print(f"CACHE-GET: Parent hit on '{parent_key}' for '{cleaned_path}'.")
 
-                # --- Filtering ---
-                prefix_with_slash = cleaned_path + '/'
+def get_documents_from_snapshot(cleaned_path: str, allow_download: bool = False) -> Optional[List[Dict[str, Any]]]:
+    """Same hierarchy as the cache lookup: exact key first, then parent keys filtered by prefix."""
+    if not SEARCH_SNAPSHOTS_ENABLED:
+        return None
 
-                filtered_documents = [
-                    doc for doc in DIRECTORY_CACHE_MAP[parent_key]
-                    if doc.get('full_path', '').lower().startswith(prefix_with_slash)
-                ]
+    path_segments = cleaned_path.split('/')
+    candidate_keys = [cleaned_path] + ['/'.join(path_segments[:i]) for i in range(len(path_segments) - 1, 0, -1)]
+    if cleaned_path:
+        candidate_keys.append("")
+
+    for key in candidate_keys:
+        snapshot = open_search_snapshot(key, allow_download=allow_download)
+        if snapshot is None:
+            continue
+        if key == cleaned_path:
+            print(f"SNAPSHOT-GET: Exact hit for '{cleaned_path}'.")
+            return snapshot.documents()
+        documents = snapshot.documents(cleaned_path + '/')
+        if documents:
+            print(f"SNAPSHOT-GET: Parent hit on '{key}' for '{cleaned_path}'.")
+            return documents
+    return None
 
-                if filtered_documents:
-                    return list(filtered_documents)
 
-    # Cache Miss
-    return None
+def put_documents_in_cache(path_key: str, documents: List[Dict[str, Any]], persist: bool = False,
+                           mirror_to_bucket: bool = False):
+    """
+    Safely adds a list of documents to the global cache under the given key.
+    persist=True also writes a search snapshot in the background.
+    """
+    # Ensure the key is fully normalized (lowercase, no slashes)
+    normalized_key = path_key.strip("/").lower()
+
+    # Shadow copy of every line (NFKC + casefold + Hebrew folding) and the
+    # paragraph segmentation, computed once here so searches never
+    # re-normalize or re-split cached text
+    for doc in documents:
+        attach_normalized_lines(doc)
+        attach_paragraphs(doc)
+
+    if documents:
+        DIRECTORY_CACHE_MAP.put(normalized_key, documents)
+        print(f"CACHE-PUT: Stored {len(documents)} documents for '{normalized_key}'.")
+
+    # Indexing happens outside the cache lock so concurrent cache reads are not blocked.
+    # Snapshot documents carry their own on-disk index and are never re-tokenized.
+    in_memory_docs = [doc for doc in documents if not isinstance(doc, MappedDocument)]
+    if in_memory_docs:
+        index_start = time.time()
+        SEARCH_INDEX.add_documents(in_memory_docs)
+        print(f"INDEX-PUT: Indexed '{normalized_key}' in {time.time() - index_start:.2f}s {SEARCH_INDEX.stats()}.")
+
+    # The snapshot holds the whole key, including documents that are still
+    # served from the previous snapshot (e.g. unchanged after a revalidation).
+    if persist and documents and SEARCH_SNAPSHOTS_ENABLED:
+        threading.Thread(target=save_search_snapshot, args=(normalized_key, list(documents), mirror_to_bucket),
+                         daemon=True).start()
+
+
+def get_documents_from_cache(directory_path: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    Attempts a hierarchy-aware lookup for documents, checking the exact path
+    and then searching parent paths. Returns None on cache miss.
+    """
+    cleaned_path = directory_path.strip("/").lower()
+
+    # A hit on the exact key or on any loaded parent directory is the same
+    # range scan over the sorted store.
+    dir_key, documents = DIRECTORY_CACHE_MAP.lookup(cleaned_path)
+    if documents is None:
+        return None  # Cache Miss
+
+    if dir_key == cleaned_path:
+        print(f"CACHE-GET: Exact hit for '{cleaned_path}'.")
+    else:
+        print(f"CACHE-GET: Parent hit on '{dir_key}' for '{cleaned_path}'.")
+    return documents
 
 
 def get_documents_for_path(directory_path: str, local_mode = False) -> List[Dict[str, Any]]:
@@ -202,23 +364,32 @@ def get_documents_for_path(directory_path: str, local_mode = False) -> List[Dict
         print(f"CACHE-GET: Exact hit for '{cleaned_path}'.")
         return cached_docs
 
-    # 3. SLOW PATH (v15 + Debugging)
+    use_local_hd = local_mode == "True" and not IS_CLOUD_RUN
+
+    # 3. SNAPSHOT PATH: map a persisted index instead of re-downloading and re-parsing
+    snapshot_docs = get_documents_from_snapshot(cleaned_path, allow_download=not use_local_hd)
+    if snapshot_docs is not None:
+        put_documents_in_cache(cleaned_path, snapshot_docs)
+        return snapshot_docs
+
+    # 4. SLOW PATH (v15 + Debugging)
     print(f"CACHE-MISS: Fetching from source for '{cleaned_path}'.")
 
     # Ensure your get_gcs_files_context is the v15 version!
-    if local_mode == "True" and not IS_CLOUD_RUN:
+    if use_local_hd:
         fetched_documents = get_hd_files_context(cleaned_path, LOCAL_ROOT_PATH)
+        LOCAL_HD_CACHE_KEYS.add(cleaned_path)
     else:
         # This is where the actual GCS logic from v15 lives
         fetched_documents = get_gcs_files_context(cleaned_path, BUCKET_NAME)
 
-    # 4. Critical Search Debug: Check if 'content' actually exists
+    # 5. Critical Search Debug: Check if 'content' actually exists
     if fetched_documents:
         for doc in fetched_documents:
             if not doc.get("content"):
                 print(f"⚠️ Warning: Document {doc['name']} has NO content! Search will fail.")
 
-        put_documents_in_cache(cleaned_path, fetched_documents)
+        put_documents_in_cache(cleaned_path, fetched_documents, persist=True, mirror_to_bucket=not use_local_hd)
 
     return fetched_documents
 
@@ -325,6 +496,25 @@ def get_gemini_client_instance():
     return gemini_client
 
 
+def get_parse_pool() -> ProcessPoolExecutor:
+    """Returns the process pool of the parse stage, created on first use."""
+    global parse_pool
+    with parse_pool_lock:
+        if parse_pool is None:
+            parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS)
+            print(f"⚙️ Parse pool started with {PARSE_WORKERS} worker processes.")
+        return parse_pool
+
+
+def reset_parse_pool():
+    """Drops a broken pool; the next call to get_parse_pool() starts a fresh one."""
+    global parse_pool
+    with parse_pool_lock:
+        if parse_pool is not None:
+            parse_pool.shutdown(wait=False, cancel_futures=True)
+            parse_pool = None
+
+
 
 def detect_text_gcs_async(gcs_uri, gcs_destination_uri):
     """
@@ -447,47 +637,7 @@ def extract_content(blob_bytes, blob_name, full_gcs_path):
 
     # Check for DOCX
     elif blob_name_lower.endswith('.docx'):
-        text = ""
-        try:
-            document = Document(io.BytesIO(blob_bytes))
-            combined_text = []
-
-            # 1. Extract Regular Editable Text
-            for paragraph in document.paragraphs:
-                combined_text.append(paragraph.text)
-
-            # 2. Extract and OCR Embedded Images
-
-            for rel in document.part.rels.items():
-                target_ref_safe = getattr(rel, 'target_ref', '')
-                if target_ref_safe:
-                    try:
-                        if "image" in target_ref_safe or "/media/" in target_ref_safe:
-                            image_part = rel.target_part
-                            image_bytes = image_part.blob
-                            image = Image.open(io.BytesIO(image_bytes))
-
-                            # Run OCR
-                            ocr_text = pytesseract.image_to_string(image, 'heb')
-                            # a = b[4]
-                            # Append OCR results with a separator/label
-                            combined_text.append(ocr_text)
-                    except pytesseract.TesseractNotFoundError:
-                        # IMPORTANT: This error means Tesseract executable is missing in the cloud!
-                        combined_text.append("\n[OCR ERROR: Tesseract not found on system path. Image skipped.]")
-                    except Exception as e:
-                        # Handle other potential errors (like missing image dependencies)
-                        combined_text.append(f"\n[OCR ERROR: Failed to process image: {e}]")
-
-            # 3. Combine and Optionally Search
-            text = "\n".join(combined_text)
-
-            #for paragraph in document.paragraphs:
-            #    text += paragraph.text + "\n"
-            return text.strip()
-
-        except Exception as e:
-            return f"ERROR: Could not read DOCX content: {e}"
+        return extract_docx_text(blob_bytes)
 
     # Handle other files as plain text (TXT, CSV, etc.)
     try:
@@ -498,6 +648,148 @@ def extract_content(blob_bytes, blob_name, full_gcs_path):
 
 
 
+def list_gcs_document_blobs(directory_path: str, bucket_name: str) -> List[Any]:
+    """Lists the searchable blobs under a directory (metadata only - this is fast)."""
+    directory_path = (directory_path or "").strip("/")
+    prefix = f"{directory_path}/" if directory_path else ""
+    storage_client = get_storage_client_instance()
+    print(f"prefix: debug to list GCS blobs: {prefix}")
+    bucket = storage_client.bucket(bucket_name)
+    blobs = bucket.list_blobs(prefix=prefix)
+    # Filter for relevant file types immediately
+    return [
+        blob for blob in blobs
+        if blob.name.endswith(('.docx', '.pdf', '.txt'))
+    ]
+
+
+def build_document_from_blob(blob, prefix: str, content_string: str) -> Optional[Dict[str, Any]]:
+    """Wraps extracted content into the cached document format (None for failed/empty files)."""
+    if not content_string or content_string.startswith("ERROR:"):
+        return None
+
+    # Determine relative name
+    relative_name = blob.name[len(prefix):] if prefix and blob.name.startswith(prefix) else blob.name
+    normalized_gcs_path = Path(blob.name).as_posix()
+    print(f"full path={normalized_gcs_path}")
+    return {
+        "name": relative_name,
+        "full_path": normalized_gcs_path,
+        "content": content_string[:MAX_CHARS_PER_DOC],  # Assuming MAX_CHARS_PER_DOC is global
+        # Pages structure is often too complex to compute concurrently,
+        # but adding a placeholder for consistency:
+        "pages": [{"page": 3, "lines": content_string.split("\n")}],
+        # Object version, used by revalidate_cached_directory to skip unchanged blobs
+        "generation": blob.generation,
+        "md5_hash": blob.md5_hash,
+    }
+
+
+def remember_blob_result(blob, document: Optional[Dict[str, Any]]):
+    """Records (or clears) the version of a blob whose extracted content was unusable."""
+    with failed_blobs_lock:
+        if document is None:
+            FAILED_BLOB_VERSIONS[blob.name] = (blob.generation, blob.md5_hash)
+        else:
+            FAILED_BLOB_VERSIONS.pop(blob.name, None)
+
+
+def blob_failed_before(blob) -> bool:
+    """True if this exact version of the blob already gave no usable content."""
+    with failed_blobs_lock:
+        version = FAILED_BLOB_VERSIONS.get(blob.name)
+    if version is None:
+        return False
+    generation, md5_hash = version
+    return ((blob.generation is not None and generation == blob.generation)
+            or bool(blob.md5_hash and md5_hash == blob.md5_hash))
+
+
+def forget_failed_blobs(prefix: str, listed_names):
+    """Drops failure records of blobs under prefix that are no longer listed."""
+    listed_names = set(listed_names)
+    with failed_blobs_lock:
+        for name in [n for n in FAILED_BLOB_VERSIONS if n.startswith(prefix) and n not in listed_names]:
+            del FAILED_BLOB_VERSIONS[name]
+
+
+def fetch_gcs_documents(blobs: List[Any], prefix: str) -> List[Dict[str, Any]]:
+    """
+    Two-stage pipeline:
+      1. I/O threads (MAX_CONCURRENT_DOWNLOADS) download blob bytes into a
+         bounded queue; PDFs run the (network bound) Vision OCR here too.
+      2. CPU-heavy DOCX parsing (python-docx + Tesseract) runs in the process
+         pool, with at most PARSE_IN_FLIGHT jobs outstanding.
+    A full queue blocks the downloaders, so a slow parse stage applies
+    backpressure instead of buffering the whole directory in memory.
+    Results keep the listing order; failed/skipped files are dropped.
+    Files that were read but gave no usable content are remembered by version
+    (blob_failed_before); a failed download is retried on the next pass.
+    """
+    if not blobs:
+        return []
+
+    downloaded = queue.Queue(maxsize=PARSE_QUEUE_SIZE)
+
+    def download(position, blob):
+        """I/O stage. Queues (position, blob, extracted text | raw bytes | None)."""
+        payload = None
+        try:
+            if blob.name.lower().endswith('.pdf'):
+                # NETWORK I/O: Vision OCR reads the PDF straight from the bucket
+                payload = extract_content(b"", blob.name, blob.name)
+            else:
+                payload = blob.download_as_bytes()
+        except Exception as e:
+            print(f"ERROR processing {blob.name}: {e}")
+        downloaded.put((position, blob, payload))
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(blobs)
+    parsing = []
+
+    def finish(position, blob, content_string):
+        results[position] = build_document_from_blob(blob, prefix, content_string)
+        if content_string is not None:
+            remember_blob_result(blob, results[position])
+    in_flight = threading.BoundedSemaphore(PARSE_IN_FLIGHT)
+
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_DOWNLOADS) as executor:
+        for position, blob in enumerate(blobs):
+            executor.submit(download, position, blob)
+
+        # 2. Parse stage: drain the queue as downloads complete
+        for _ in range(len(blobs)):
+            position, blob, payload = downloaded.get()
+            try:
+                if isinstance(payload, bytes) and blob.name.lower().endswith('.docx'):
+                    in_flight.acquire()
+                    try:
+                        future = get_parse_pool().submit(extract_docx_text, payload)
+                    except Exception:
+                        in_flight.release()
+                        raise
+                    future.add_done_callback(lambda _: in_flight.release())
+                    parsing.append((position, blob, payload, future))
+                elif isinstance(payload, bytes):
+                    finish(position, blob, extract_content(payload, blob.name, blob.name))
+                else:
+                    finish(position, blob, payload)
+            except Exception as e:
+                print(f"ERROR processing {blob.name}: {e}")
+
+    for position, blob, payload, future in parsing:
+        try:
+            content_string = future.result()
+        except Exception as e:
+            # Broken/unavailable worker process: parse in-process instead
+            print(f"⚠️ Warning: Parse worker failed for {blob.name} ({e}), parsing in-process.")
+            reset_parse_pool()
+            content_string = extract_content(payload, blob.name, blob.name)
+        finish(position, blob, content_string)
+
+    return [res for res in results if res is not None]
+
+
 def get_gcs_files_context(directory_path: str, bucket_name: str, query: str = "") -> List[Dict[str, Any]]:
     """
     Fetches, downloads, and processes content from GCS concurrently using a ThreadPoolExecutor.
@@ -505,58 +797,62 @@ def get_gcs_files_context(directory_path: str, bucket_name: str, query: str = ""
     """
     directory_path = (directory_path or "").strip("/")
     prefix = f"{directory_path}/" if directory_path else ""
-    file_data: List[Dict[str, Any]] = []
-    storage_client = get_storage_client_instance()
+
     # 1. Get the list of blobs (metadata only - this is fast)
-    print(f"prefix: debug to list GCS blobs: {prefix}")
     try:
-        bucket = storage_client.bucket(bucket_name)
-        blobs = bucket.list_blobs(prefix=prefix)
-        # Filter for relevant file types immediately
-        blobs_to_process = [
-            blob for blob in blobs
-            if blob.name.endswith(('.docx', '.pdf', '.txt'))
-        ]
-
+        blobs_to_process = list_gcs_document_blobs(directory_path, bucket_name)
     except Exception as e:
         print(f"ERROR: Failed to list GCS blobs: {e}")
         return []
 
-    def process_single_blob(blob):
-        """Worker function executed by each thread."""
-        try:
-            # NETWORK I/O: This is the slow part now happening in parallel
-            file_content_bytes = blob.download_as_bytes()
-            content_string = extract_content(file_content_bytes, blob.name, blob.name)
+    # 2. Execute file processing concurrently
+    return fetch_gcs_documents(blobs_to_process, prefix)
 
-            if content_string.startswith("ERROR:") or not content_string:
-                return None
 
-            # Determine relative name
-            relative_name = blob.name[len(prefix):] if prefix and blob.name.startswith(prefix) else blob.name
-            normalized_gcs_path = Path(blob.name).as_posix()
-            print(f"full path={normalized_gcs_path}")
-            return {
-                "name": relative_name,
-                "full_path": normalized_gcs_path,
-                "content": content_string[:MAX_CHARS_PER_DOC],  # Assuming MAX_CHARS_PER_DOC is global
-                # Pages structure is often too complex to compute concurrently,
-                # but adding a placeholder for consistency:
-                "pages": [{"page": 3, "lines": content_string.split("\n")}],
-            }
-        except Exception as e:
-            print(f"ERROR processing {blob.name}: {e}")
-            return None
+def revalidate_cached_directory(path_key: str) -> Dict[str, int]:
+    """
+    Cheap refresh of one loaded cache key: lists the blobs with metadata only
+    and re-downloads/re-parses only new or changed objects (by generation,
+    or md5 for a re-upload of identical bytes). Deleted blobs fall out of the
+    subtree, which evicts them from the cache and the search index. Blobs
+    whose current version already gave no usable content are not retried.
+    """
+    cached_documents = DIRECTORY_CACHE_MAP.peek(path_key)
+    if cached_documents is None:
+        return {"status": "not_cached"}
+
+    prefix = f"{path_key}/" if path_key else ""
+    blobs = list_gcs_document_blobs(path_key, BUCKET_NAME)
+    remaining = {doc.get("full_path"): doc for doc in cached_documents}
+
+    forget_failed_blobs(prefix, [blob.name for blob in blobs])
+
+    unchanged, changed, failed = [], [], 0
+    for blob in blobs:
+        doc = remaining.pop(Path(blob.name).as_posix(), None)
+        if doc is not None and (
+                (blob.generation is not None and doc.get("generation") == blob.generation)
+                or (blob.md5_hash and doc.get("md5_hash") == blob.md5_hash)):
+            unchanged.append(doc)
+        elif doc is None and blob_failed_before(blob):
+            failed += 1
+        else:
+            changed.append(blob)
 
-    # 2. Execute file processing concurrently
-    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_DOWNLOADS) as executor:
-        # Map the worker function over the list of blobs
-        results = executor.map(process_single_blob, blobs_to_process)
+    summary = {"unchanged": len(unchanged), "changed": len(changed), "deleted": len(remaining),
+               "failed": failed}
+    if changed or remaining:
+        fetched = fetch_gcs_documents(changed, prefix)
+        put_documents_in_cache(path_key, unchanged + fetched, persist=True, mirror_to_bucket=True)
+    return summary
+
+
+def refreshable_cache_keys() -> List[str]:
+    """Loaded cache keys that came from the bucket (local HD keys are not revalidated)."""
+    return [key for key in DIRECTORY_CACHE_MAP.keys() if key not in LOCAL_HD_CACHE_KEYS]
 
-        # Collect results, filtering out None (failed/skipped files)
-        file_data = [res for res in results if res is not None]
 
-    return file_data
+CACHE_REFRESHER = PeriodicRefresher(revalidate_cached_directory, refreshable_cache_keys)
 
 # ==============================================================================
 # --- MOCK & PLACEHOLDER FUNCTIONS ---
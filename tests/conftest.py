@@ -0,0 +1,46 @@
+import os
+import sys
+import atexit
+import random
+import shutil
+import tempfile
+
+import pytest
+
+# The modules live flat at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# No background revalidation, snapshots and OCR cache in a scratch directory
+# that is removed when the run ends
+SCRATCH_DIR = tempfile.mkdtemp(prefix="smart_doc_tests_")
+atexit.register(shutil.rmtree, SCRATCH_DIR, ignore_errors=True)
+os.environ.setdefault("REFRESH_INTERVAL_SECONDS", "0")
+os.environ.setdefault("SEARCH_SNAPSHOT_DIR", os.path.join(SCRATCH_DIR, "snapshots"))
+os.environ.setdefault("OCR_CACHE_DIR", os.path.join(SCRATCH_DIR, "ocr_cache"))
+
+VOCABULARY = ["שלום", "שָׁלוֹם", "בית", "הבית", "לבית", "משפט", "גירושין", "Court", "court", "a-b", "foo.bar",
+              "x", "ab", "abc", "דירה", "דמי", "מזונות", "ﬁle"]
+
+QUERIES = ["בית", "הבית court", "a-b", "foo.bar x", "ab abc", "מזונות דמי", "Court", "ית", "zzz", "בית zzz",
+           "x ab", "שלום", "file"]
+
+
+def make_documents(count=30, pages=3, lines=15, seed=1, prefix="dir"):
+    """Random documents in the cached format, spread over three sub-folders."""
+    rnd = random.Random(seed)
+    documents = []
+    for d in range(count):
+        doc_pages = []
+        for p in range(pages):
+            doc_pages.append({"page": p + 1, "lines": [
+                " ".join(rnd.choice(VOCABULARY) + rnd.choice(["", ".", ",", ":"]) for _ in range(rnd.randint(0, 6)))
+                for _ in range(lines)]})
+        content = "\n".join(line for page in doc_pages for line in page["lines"])
+        documents.append({"name": f"d{d}.txt", "full_path": f"{prefix}/sub{d % 3}/d{d}.txt",
+                          "content": content, "pages": doc_pages})
+    return documents
+
+
+@pytest.fixture
+def documents():
+    return make_documents()
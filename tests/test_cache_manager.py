@@ -0,0 +1,79 @@
+from cache_manager import DocumentCache, estimate_document_bytes
+
+from conftest import make_documents
+
+
+def directory(name, count=4):
+    return make_documents(count=count, pages=2, lines=5, prefix=name)
+
+
+def budget_for(*directories):
+    return sum(estimate_document_bytes(doc) for docs in directories for doc in docs)
+
+
+def test_lru_evicts_least_recently_used():
+    a, b, c = directory("a"), directory("b"), directory("c")
+    evicted = []
+    cache = DocumentCache(budget_for(a, b), "lru", on_evict=lambda key, docs: evicted.append((key, docs)))
+    cache.put("a", a)
+    cache.put("b", b)
+    assert cache.lookup("a")[0] == "a"  # "b" is now the least recently used
+    cache.put("c", c)
+
+    assert cache.keys() == ["a", "c"]
+    assert cache.lookup("b") == (None, None)
+    assert [(key, sorted(d["full_path"] for d in docs)) for key, docs in evicted] == \
+        [("b", sorted(d["full_path"] for d in b))]
+    stats = cache.stats()
+    assert stats["evictions"] == 1 and stats["bytes"] <= stats["max_bytes"]
+
+
+def test_lfu_evicts_least_frequently_used():
+    a, b, c = directory("a"), directory("b"), directory("c")
+    cache = DocumentCache(budget_for(a, b), "lfu")
+    cache.put("a", a)
+    cache.put("b", b)
+    for _ in range(3):
+        cache.lookup("a")
+    cache.lookup("b")
+    cache.lookup("a")  # "a" is the most recent and most frequent
+    cache.lookup("b")  # "b" is now the most recent, but used less often
+    cache.put("c", c)
+    assert cache.keys() == ["a", "c"]  # LRU would have dropped "a"
+
+
+def test_newest_directory_is_never_evicted_for_itself():
+    a, big = directory("a"), directory("big", count=20)
+    cache = DocumentCache(budget_for(a), "lru")
+    cache.put("a", a)
+    cache.put("big", big)
+    assert cache.keys() == ["big"]
+    assert [doc["full_path"] for doc in cache.lookup("big")[1]] == sorted(doc["full_path"] for doc in big)
+
+
+def test_documents_covered_by_a_parent_survive_eviction():
+    parent = directory("p")
+    child = [doc for doc in parent if doc["full_path"].startswith("p/sub1/")]
+    other = directory("o")
+    evicted = []
+    cache = DocumentCache(budget_for(parent, other) - 1, "lru", on_evict=lambda key, docs: evicted.extend(docs))
+    cache.put("p", parent)
+    cache.put("p/sub1", child)  # also loaded on its own, more recently than "p"
+    cache.put("o", other)       # over budget: "p" is evicted
+    assert cache.keys() == ["p/sub1", "o"]
+    assert cache.lookup("p/sub1")[1] == sorted(child, key=lambda d: d["full_path"])
+    assert sorted(d["full_path"] for d in evicted) == \
+        sorted(d["full_path"] for d in parent if d not in child)
+
+
+def test_generation_moves_on_every_change():
+    a = directory("a")
+    cache = DocumentCache(budget_for(a), "lru")
+    generations = [cache.generation]
+    cache.put("a", a)
+    generations.append(cache.generation)
+    cache.pop("a")
+    generations.append(cache.generation)
+    cache.clear()
+    generations.append(cache.generation)
+    assert generations == sorted(set(generations))
@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+
+import fitz
+import pytest
+
+import document_parsers
+import ocr_pool
+
+HUNG_PAGE = 99
+
+
+def fake_worker(pdf_path, p_num, lang):
+    """Stands in for ocr_worker: page HUNG_PAGE never returns (records its pid), page 0 fails."""
+    if p_num == HUNG_PAGE:
+        with open(os.path.join(pdf_path, "hung.pid"), "w") as f:
+            f.write(str(os.getpid()))
+        time.sleep(600)
+    if p_num == 0:
+        return None
+    time.sleep(0.05)
+    return {"page": p_num, "lines": [f"{lang} {p_num}"]}
+
+
+def failing_worker(pdf_path, p_num, lang):
+    return None
+
+
+def locking_worker(pdf_path, p_num, lang):
+    """Takes FITZ_LOCK around its work, as ocr_worker does."""
+    with document_parsers.FITZ_LOCK:
+        return {"page": p_num, "lines": []}
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """A fresh two-worker pool running fake_worker, with a one second stuck limit."""
+    ocr_pool.reset_ocr_pool(kill=True)
+    monkeypatch.setattr(ocr_pool, "OCR_WORKERS", 2)
+    monkeypatch.setattr(document_parsers, "OCR_TASK_TIMEOUT", 0.2)
+    monkeypatch.setattr(document_parsers, "OCR_STUCK_AFTER", 1)
+    monkeypatch.setattr(document_parsers, "ocr_worker", fake_worker)
+    yield
+    ocr_pool.reset_ocr_pool(kill=True)
+
+
+def alive(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().split(")")[-1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+def test_every_page_is_reported(pool, tmp_path):
+    results, failed = document_parsers.ocr_pdf_pages(str(tmp_path), [1, 0, 2, 3], "heb")
+    assert sorted(r["page"] for r in results) == [1, 2, 3]
+    assert failed == [0]
+
+
+def test_stuck_worker_is_killed_and_other_pages_finish(pool, tmp_path):
+    results, failed = document_parsers.ocr_pdf_pages(str(tmp_path), [1, 2, HUNG_PAGE, 3, 4, 5], "heb")
+    assert failed == [HUNG_PAGE]
+    assert sorted(r["page"] for r in results) == [1, 2, 3, 4, 5]
+
+    pid = int((tmp_path / "hung.pid").read_text())
+    deadline = time.time() + 5
+    while alive(pid) and time.time() < deadline:
+        time.sleep(0.05)
+    assert not alive(pid)
+
+
+def test_reset_by_one_document_does_not_lose_another(pool, tmp_path):
+    stuck = {}
+    thread = threading.Thread(target=lambda: stuck.update(
+        zip(("results", "failed"), document_parsers.ocr_pdf_pages(str(tmp_path), [HUNG_PAGE], "heb"))))
+    thread.start()
+    results, failed = document_parsers.ocr_pdf_pages(str(tmp_path), list(range(1, 31)), "eng")
+    thread.join()
+
+    assert stuck["failed"] == [HUNG_PAGE]
+    assert failed == []
+    assert sorted(r["page"] for r in results) == list(range(1, 31))
+
+
+def test_workers_do_not_inherit_a_held_fitz_lock(pool, monkeypatch, tmp_path):
+    monkeypatch.setattr(document_parsers, "ocr_worker", locking_worker)
+    holding, release = threading.Event(), threading.Event()
+
+    def fetch_thread():  # an Azure/S3 text pass holding the lock while the pool starts
+        with document_parsers.FITZ_LOCK:
+            holding.set()
+            release.wait(10)
+
+    thread = threading.Thread(target=fetch_thread)
+    thread.start()
+    holding.wait(10)
+    try:
+        future = ocr_pool.get_ocr_pool().submit(locking_worker, str(tmp_path), 1, "heb")
+    finally:
+        release.set()
+        thread.join()
+    assert future.result(timeout=30) == {"page": 1, "lines": []}
+    results, failed = document_parsers.ocr_pdf_pages(str(tmp_path), [1, 2], "heb")
+    assert failed == [] and len(results) == 2
+
+
+def test_reset_of_a_replaced_pool_keeps_the_current_one(pool):
+    stale = ocr_pool.get_ocr_pool()
+    ocr_pool.reset_ocr_pool(stale)
+    current = ocr_pool.get_ocr_pool()
+    assert current is not stale
+
+    ocr_pool.reset_ocr_pool(stale)  # a late reset from a caller that saw the old pool fail
+    assert ocr_pool.get_ocr_pool() is current
+    assert current.submit(abs, -1).result(timeout=10) == 1
+
+
+def scanned_pdf(pages):
+    doc = fitz.open()
+    for _ in range(pages):
+        doc.new_page()  # no text layer: every page is sent to OCR
+    return doc.tobytes()
+
+
+def test_failed_ocr_marks_the_extraction_incomplete(pool, monkeypatch):
+    pdf = scanned_pdf(2)
+    monkeypatch.setattr(document_parsers, "ocr_worker", failing_worker)
+    pages, used_ocr, complete = document_parsers.extract_text_for_indexing(pdf, ".pdf", isLTR=True)
+    assert (pages, used_ocr, complete) == ([], True, False)
+
+    # Nothing was cached for the failed pages: they are OCR'd on the next try
+    monkeypatch.setattr(document_parsers, "ocr_worker", fake_worker)
+    pages, used_ocr, complete = document_parsers.extract_text_for_indexing(pdf, ".pdf", isLTR=True)
+    assert complete is True
+    assert pages == [{"page": 1, "lines": ["eng 1"]}, {"page": 2, "lines": ["eng 2"]}]
+
+
+def test_extraction_error_is_incomplete():
+    assert document_parsers.extract_text_for_indexing(b"not a pdf", ".pdf", isLTR=True) == ([], False, False)
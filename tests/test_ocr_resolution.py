@@ -0,0 +1,44 @@
+import fitz
+import pytest
+
+from ocr_resolution import (OCR_PROBE_ZOOM, adaptive_scale, ink_box, ink_mask, measure_line_height,
+                            render_page_for_ocr, render_page_gray)
+
+
+def text_page(rotation, cropbox=None):
+    doc = fitz.open()
+    page = doc.new_page(width=595, height=842)
+    for i in range(6):
+        page.insert_text((100, 150 + 20 * i), f"Line {i} of a rotated scan", fontsize=12)
+    if cropbox:
+        page.set_cropbox(fitz.Rect(cropbox))
+    page.set_rotation(rotation)
+    return doc, page
+
+
+@pytest.mark.parametrize("cropbox", [None, (60, 40, 500, 800)])
+@pytest.mark.parametrize("rotation", [0, 90, 180, 270])
+def test_adaptive_render_of_a_rotated_page_keeps_the_text(rotation, cropbox):
+    doc, page = text_page(rotation, cropbox)
+    probe = ink_mask(render_page_gray(page, zoom=OCR_PROBE_ZOOM))
+    box = ink_box(probe)
+    zoom = adaptive_scale(measure_line_height(probe), OCR_PROBE_ZOOM)
+
+    image = render_page_for_ocr(page, mode="adaptive")
+    # The crop of the probe's inked area, at the adaptive zoom, in the same orientation
+    assert abs(image.width - (box[2] - box[0]) * zoom / OCR_PROBE_ZOOM) <= 2
+    assert abs(image.height - (box[3] - box[1]) * zoom / OCR_PROBE_ZOOM) <= 2
+    assert (image.width > image.height) == (rotation in (0, 180))
+    ink = ink_mask(image).getbbox()
+    assert ink is not None
+    # Cropped to the text: only the margin is left around the ink
+    assert ink[2] - ink[0] > image.width / 2 and ink[3] - ink[1] > image.height / 2
+    doc.close()
+
+
+def test_blank_page_is_not_rendered():
+    doc = fitz.open()
+    page = doc.new_page()
+    page.set_rotation(90)
+    assert render_page_for_ocr(page, mode="adaptive") is None
+    assert render_page_for_ocr(page, mode="fixed").size == (round(page.rect.width * 3), round(page.rect.height * 3))
@@ -0,0 +1,66 @@
+import pytest
+
+from query_matcher import compile_query
+from search_kernel import compile_search, hit_entry, render_hit_html
+from text_normalize import normalize_text, normalize_with_origins
+
+
+def highlighted(query, text):
+    return [text[start:end] for start, end in query.highlight_spans(text)]
+
+
+@pytest.mark.parametrize("word,text,expected", [
+    ("שלום", "שָׁלוֹם עולם", ["שָׁלוֹם"]),                   # niqqud
+    ("שלומ", "אמר שלום.", ["שלום"]),                       # final letter
+    ("file", "The ﬁle and the FILE", ["ﬁle", "FILE"]),      # NFKC ligature, case
+    ("strasse", "Die Straße", ["Straße"]),                   # casefold ß -> ss
+    ("בית", "הבַּיִת והבית", ["בַּיִת", "בית"]),              # dagesh + vowels, partial inside a word
+])
+def test_normalized_match_is_highlighted(word, text, expected):
+    query = compile_search([word], "any", "partial")
+    assert query.matches(normalize_text(text))
+    assert highlighted(query, text) == expected
+
+
+def test_full_word_highlighting_uses_normalized_boundaries():
+    query = compile_search(["שלום"], "any", "full")
+    assert highlighted(query, "שָׁלוֹם, שלומות") == ["שָׁלוֹם"]
+
+
+def test_spans_render_on_the_original_text():
+    query = compile_search(["שלום", "court"], "any", "partial")
+    text = "שָׁלוֹם to the Court"
+    assert query.highlight(text, "[{}]") == "[שָׁלוֹם] to the [Court]"
+    entry = hit_entry({"page": 1, "line": 1, "text": text}, query)
+    assert render_hit_html("a.pdf", entry, "[{}]") == "עמוד 1: [שָׁלוֹם] to the [Court]"
+
+
+def test_every_matching_line_gets_a_highlight():
+    words = ["שלום", "file", "בית"]
+    lines = ["שָׁלוֹם", "ﬁles", "בַּיִת", "ﬀ", "שלוםבית"]
+    for match_type in ("partial", "full"):
+        query = compile_search(words, "any", match_type)
+        for line in lines:
+            if query.matches(normalize_text(line)):
+                assert query.highlight_spans(line), (match_type, line)
+
+
+def test_origins_cover_the_original_text():
+    for text in ["שָׁלוֹם עולם", "ﬁle", "Straße", "abc", "éte"]:
+        normalized, origins = normalize_with_origins(text)
+        assert normalized == normalize_text(text)
+        assert len(origins) == len(normalized)
+        assert all(0 <= start < end <= len(text) for start, end in origins)
+
+
+def test_raw_case_modes_are_unchanged():
+    query = compile_query(["Court"], match_type="partial", case="ignorecase")
+    assert highlighted(query, "the court and COURT") == ["court", "COURT"]
+
+
+@pytest.mark.parametrize("case", ["normalized", "ignorecase"])
+def test_highlights_do_not_depend_on_word_order(case):
+    text = "xabcx ab abcd"
+    spans = compile_query(["ab", "abc"], case=case).highlight_spans(text)
+    assert spans == compile_query(["abc", "ab"], case=case).highlight_spans(text)
+    assert [text[start:end] for start, end in spans] == ["abc", "ab", "abc"]
@@ -0,0 +1,85 @@
+import pytest
+
+import search_utilities
+from search_snapshot import write_snapshot
+
+from conftest import make_documents
+
+KEY = "revalidation_test"
+
+
+class FakeBlob:
+    def __init__(self, name, generation, data=b""):
+        self.name = name
+        self.generation = generation
+        self.md5_hash = f"md5-{name}-{generation}"
+        self.data = data
+
+    def download_as_bytes(self):
+        return self.data
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    """A fake listing of KEY: one text file and one PDF that OCR cannot read."""
+    blobs = {"text": FakeBlob(f"{KEY}/a.txt", 1, "שלום עולם".encode("utf-8")),
+             "scan": FakeBlob(f"{KEY}/scan.pdf", 1)}
+    ocr_calls = []
+
+    def fake_extract_content(blob_bytes, blob_name, full_gcs_path):
+        if blob_name.endswith(".pdf"):
+            ocr_calls.append(blob_name)
+            return "ERROR: Vision OCR found no text"
+        return blob_bytes.decode("utf-8")
+
+    monkeypatch.setattr(search_utilities, "list_gcs_document_blobs", lambda path, bucket_name: list(blobs.values()))
+    monkeypatch.setattr(search_utilities, "extract_content", fake_extract_content)
+    monkeypatch.setattr(search_utilities, "SEARCH_SNAPSHOTS_ENABLED", False)
+    search_utilities.put_documents_in_cache(KEY, search_utilities.fetch_gcs_documents(list(blobs.values()),
+                                                                                       f"{KEY}/"))
+    yield blobs, ocr_calls
+    search_utilities.DIRECTORY_CACHE_MAP.pop(KEY)
+    search_utilities.FAILED_BLOB_VERSIONS.clear()
+
+
+def test_unusable_blob_is_not_refetched_until_it_changes(bucket):
+    blobs, ocr_calls = bucket
+    assert ocr_calls == [f"{KEY}/scan.pdf"]  # the initial load
+
+    summary = search_utilities.revalidate_cached_directory(KEY)
+    assert summary == {"unchanged": 1, "changed": 0, "deleted": 0, "failed": 1}
+    assert len(ocr_calls) == 1
+
+    blobs["scan"].generation, blobs["scan"].md5_hash = 2, "md5-new"  # re-uploaded
+    summary = search_utilities.revalidate_cached_directory(KEY)
+    assert summary["changed"] == 1 and summary["failed"] == 0
+    assert len(ocr_calls) == 2
+
+
+def test_deleted_blob_failure_is_forgotten(bucket):
+    blobs, _ = bucket
+    del blobs["scan"]
+    search_utilities.revalidate_cached_directory(KEY)
+    assert f"{KEY}/scan.pdf" not in search_utilities.FAILED_BLOB_VERSIONS
+
+
+def test_rewritten_snapshot_is_mapped_again(monkeypatch, tmp_path):
+    monkeypatch.setattr(search_utilities, "SEARCH_SNAPSHOT_DIR", str(tmp_path))
+    monkeypatch.setattr(search_utilities, "SNAPSHOTS", {})
+    first, second = make_documents(count=3, seed=4, prefix=KEY), make_documents(count=5, seed=5, prefix=KEY)
+
+    search_utilities.save_search_snapshot(KEY, first)
+    old = search_utilities.open_search_snapshot(KEY)
+    assert [d["content"] for d in old.documents()] == [d["content"] for d in first]
+
+    # Rewritten through the cache (revalidation): the mapping is dropped right away
+    search_utilities.save_search_snapshot(KEY, second)
+    new = search_utilities.open_search_snapshot(KEY)
+    assert new is not old
+    assert [d["content"] for d in new.documents()] == [d["content"] for d in second]
+
+    # Replaced behind the cache's back (e.g. another process): detected on the next lookup
+    write_snapshot(new.file_path, KEY, first, search_utilities.SEARCH_INDEX)
+    newest = search_utilities.open_search_snapshot(KEY)
+    assert newest is not new
+    assert [d["content"] for d in newest.documents()] == [d["content"] for d in first]
@@ -0,0 +1,61 @@
+import itertools
+
+import pytest
+
+import search_core
+from document_parsers import attach_paragraphs
+from search_index import SearchIndex
+from text_normalize import attach_normalized_lines
+
+from conftest import QUERIES
+
+MODES = ["any", "all"]
+MATCH_TYPES = ["full", "partial"]
+SHOW_MODES = ["line", "paragraph"]
+
+
+def keyword_matches(monkeypatch, index, documents, query, mode, match_type, show_mode):
+    monkeypatch.setattr(search_core, "SEARCH_INDEX", index)
+    words = query.split()
+    return list(search_core.iter_keyword_matches(documents, words, mode=mode, match_type=match_type,
+                                                 show_mode=show_mode))
+
+
+@pytest.fixture
+def indexed(documents):
+    for doc in documents:
+        attach_normalized_lines(doc)
+        attach_paragraphs(doc)
+    index = SearchIndex()
+    index.add_documents(documents)
+    return index
+
+
+@pytest.mark.parametrize("mode,match_type,show_mode", list(itertools.product(MODES, MATCH_TYPES, SHOW_MODES)))
+def test_index_matches_linear_scan(monkeypatch, documents, indexed, mode, match_type, show_mode):
+    """The index only narrows the lines to check: results equal a scan with no index."""
+    for query in QUERIES:
+        narrowed = keyword_matches(monkeypatch, indexed, documents, query, mode, match_type, show_mode)
+        scanned = keyword_matches(monkeypatch, SearchIndex(), documents, query, mode, match_type, show_mode)
+        assert narrowed == scanned, query
+
+
+def test_candidates_cover_every_match(documents, indexed):
+    """Every line the matcher accepts is among the index candidates (full and trigram)."""
+    for query, match_type in itertools.product(QUERIES, MATCH_TYPES):
+        words = query.split()
+        candidates = indexed.candidates(words, mode="any", match_type=match_type)
+        if candidates is None:  # e.g. a 2-letter substring: scanned in full
+            continue
+        compiled = search_core.compile_search(words, "any", match_type)
+        for doc in documents:
+            refs = set(indexed.line_refs(doc["full_path"], candidates.get(doc["full_path"], ())))
+            for hit in search_core.iter_line_hits(doc["pages"], compiled, None):
+                assert (hit["page_idx"], hit["line"] - 1) in refs, (query, doc["full_path"])
+
+
+def test_removed_document_leaves_the_index(documents, indexed):
+    indexed.remove_document(documents[0]["full_path"])
+    assert not indexed.covers(documents[0])
+    candidates = indexed.candidates(["בית"], match_type="full")
+    assert documents[0]["full_path"] not in candidates
@@ -0,0 +1,79 @@
+import pytest
+
+import search_core
+import search_paging
+from search_paging import window_from_config
+from search_result_cache import SearchResultCache
+
+QUERY = ("בית court", "dir", "any", "partial", "line")
+
+
+@pytest.fixture
+def search(monkeypatch, documents):
+    """simple_keyword_search over the test documents, with an empty result cache."""
+    monkeypatch.setattr(search_core, "get_documents_for_path", lambda path, local_mode=False: documents)
+    monkeypatch.setattr(search_core, "SEARCH_RESULTS", SearchResultCache())
+
+    def run(config):
+        window = window_from_config(config, *QUERY)
+        query, path, mode, match_type, show_mode = QUERY
+        return search_core.simple_keyword_search(query, path, mode, match_type, show_mode, window=window)
+    return run
+
+
+def flatten(response):
+    return [(m["full_path"], text, position) for m in response["matches"]
+            for text, position in zip(m["matches"], m["match_positions"])]
+
+
+def test_no_limit_returns_every_hit(search):
+    response = search({})
+    assert response["page"]["has_more"] is False
+    assert response["page"]["total_matches"] == len(flatten(response)) > 50
+
+
+def test_cursor_pages_cover_the_full_result(search):
+    everything = flatten(search({}))
+    paged, config = [], {"limit": 7}
+    while True:
+        response = search(config)
+        hits = flatten(response)
+        assert len(hits) <= 7
+        paged += hits
+        if not response["page"]["has_more"]:
+            break
+        config = {"limit": 7, "cursor": response["page"]["next_cursor"]}
+    assert paged == everything
+
+
+def test_offset_equals_cursor(search):
+    first = search({"limit": 5})
+    assert flatten(search({"limit": 5, "cursor": first["page"]["next_cursor"]})) == \
+        flatten(search({"limit": 5, "offset": 5}))
+
+
+def test_count_only_reports_totals(search):
+    response = search({"count_only": True})
+    assert response["matches"] == []
+    assert response["page"]["total_matches"] == len(flatten(search({})))
+
+
+def test_cursor_belongs_to_its_query():
+    cursor = search_paging.encode_cursor(10, search_paging.query_fingerprint(*QUERY))
+    assert window_from_config({"cursor": cursor}, *QUERY).offset == 10
+    with pytest.raises(ValueError):
+        window_from_config({"cursor": cursor}, "other query", *QUERY[1:])
+    with pytest.raises(ValueError):
+        window_from_config({"cursor": "not-a-cursor"}, *QUERY)
+
+
+def test_limits(monkeypatch):
+    monkeypatch.setattr(search_paging, "MAX_PAGE_SIZE", 100)
+    assert window_from_config({}, *QUERY).limit is None  # SEARCH_PAGE_SIZE defaults to unlimited
+    assert window_from_config({"limit": 20}, *QUERY).limit == 20
+    assert window_from_config({"limit": 500}, *QUERY).limit == 100
+    assert window_from_config({"limit": 0}, *QUERY).limit == 100
+    with pytest.raises(ValueError):
+        window_from_config({"limit": -1}, *QUERY)
+    with pytest.raises(ValueError):
+        window_from_config({"offset": "x"}, *QUERY)
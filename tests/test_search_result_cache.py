@@ -0,0 +1,99 @@
+import pytest
+
+import search_core
+import search_utilities
+from search_paging import ResultWindow
+from search_result_cache import SearchResultCache, cached_search, result_cache_key
+
+from conftest import make_documents
+
+KEY = "result_cache_test"
+
+
+@pytest.fixture
+def cached_corpus(monkeypatch):
+    """KEY loaded into the real document cache/index, searched through a fresh result cache."""
+    results = SearchResultCache()
+    monkeypatch.setattr(search_core, "SEARCH_RESULTS", results)
+    monkeypatch.setattr(search_core, "get_documents_for_path", search_utilities.get_documents_from_cache)
+    search_utilities.put_documents_in_cache(KEY, make_documents(seed=6, prefix=KEY))
+    yield results
+    search_utilities.DIRECTORY_CACHE_MAP.pop(KEY)
+
+
+def search(query, **kwargs):
+    response = search_core.simple_keyword_search(query, KEY, "any", "partial", "line", **kwargs)
+    response.pop("debug", None)
+    return response
+
+
+def test_repeated_search_is_replayed(cached_corpus):
+    first = search("בית court")
+    assert cached_corpus.stats()["hits"] == 0
+    assert search("court בית") == {**first, "query": "court בית"}  # same word set, other order
+    assert cached_corpus.stats()["hits"] == 1
+
+
+def test_reordered_words_replay_what_a_fresh_scan_returns(cached_corpus, monkeypatch):
+    search("ab abc")
+    replayed = search("abc ab")  # the same cache entry
+    assert cached_corpus.stats()["hits"] == 1
+    monkeypatch.setattr(search_core, "SEARCH_RESULTS", SearchResultCache())
+    assert replayed == search("abc ab")
+
+
+def test_reloaded_corpus_invalidates_results(cached_corpus):
+    before = search("בית")
+    changed = make_documents(count=5, seed=7, prefix=KEY)
+    for doc in changed:
+        doc["pages"][0]["lines"].append("בית חדש")
+    search_utilities.put_documents_in_cache(KEY, changed)
+
+    after = search("בית")
+    assert cached_corpus.stats()["hits"] == 0
+    assert after != before
+    assert {m["full_path"] for m in after["matches"]} == {doc["full_path"] for doc in changed}
+    assert cached_corpus.stats()["invalidations"] == 1
+
+
+def test_evicted_corpus_invalidates_results(cached_corpus):
+    search("בית")
+    search_utilities.DIRECTORY_CACHE_MAP.pop(KEY)
+    assert search("בית")["matches"] == []
+    assert cached_corpus.stats()["hits"] == 0
+
+
+def test_paged_results_replay_the_window(cached_corpus):
+    first_window, second_window = ResultWindow(limit=3), ResultWindow(limit=3)
+    first = search("בית", window=first_window)
+    assert search("בית", window=second_window) == first
+    assert second_window.summary() == first_window.summary()
+    assert cached_corpus.stats()["hits"] == 1
+
+
+def test_unfinished_or_outdated_scans_are_not_stored():
+    cache = SearchResultCache()
+    key = result_cache_key(["x"], "any", "partial", "line", "dir")
+
+    partial = cached_search(cache, key, lambda: 1, lambda: iter([{"file": "a"}, {"file": "b"}]))
+    next(partial)  # the client went away after the first entry
+    partial.close()
+    assert cache.stats()["entries"] == 0
+
+    versions = iter([1, 2])  # the corpus moved while scanning
+    list(cached_search(cache, key, lambda: next(versions), lambda: iter([{"file": "a"}])))
+    assert cache.stats()["entries"] == 0
+
+    list(cached_search(cache, key, lambda: 3, lambda: iter([{"file": "a"}])))
+    assert cache.stats()["entries"] == 1
+
+
+def test_byte_budget_evicts_least_recent():
+    entries = [{"file": "x" * 1000}]
+    cache = SearchResultCache(max_bytes=3000)
+    for name in "abc":
+        cache.put((name, 1), entries)
+        cache.get(("a", 1))  # keep "a" recent
+    assert cache.get(("a", 1)) is not None
+    assert cache.get(("b", 1)) is None
+    assert cache.stats()["evictions"] >= 1
@@ -0,0 +1,73 @@
+import itertools
+
+import pytest
+
+import search_core
+from document_parsers import attach_paragraphs, build_paragraphs
+from search_index import SearchIndex, TERMS, GRAMS
+from search_snapshot import MappedSnapshot, write_snapshot
+from text_normalize import attach_normalized_lines
+
+from conftest import QUERIES, make_documents
+
+
+@pytest.fixture
+def snapshot_pair(tmp_path):
+    """(documents, MappedSnapshot) written from them, including awkward content layouts."""
+    documents = make_documents(seed=2)
+    for d, doc in enumerate(documents):
+        doc["source"] = "bucket"
+        for page in doc["pages"]:
+            page["page"] += 2  # page numbers that are not 1..n
+        if d % 5 == 0:
+            doc["content"] = doc["content"][:40]  # truncated content (MAX_CHARS_PER_DOC)
+        if d % 7 == 0:
+            doc["content"] = doc["content"].replace("\n", "\n\n")  # content that differs from the lines
+        attach_normalized_lines(doc)
+        attach_paragraphs(doc)
+    index = SearchIndex()
+    index.add_documents(documents)
+    path = str(tmp_path / "dir.snapshot")
+    write_snapshot(path, "dir", documents, index)
+    snapshot = MappedSnapshot(path)
+    yield documents, snapshot
+    snapshot.close()
+
+
+def test_snapshot_round_trip(snapshot_pair):
+    documents, snapshot = snapshot_pair
+    assert snapshot.key == "dir"
+    mapped = snapshot.documents()
+    assert [doc["full_path"] for doc in mapped] == [doc["full_path"] for doc in documents]
+    for restored, original in zip(mapped, documents):
+        assert restored["name"] == original["name"]
+        assert restored["content"] == original["content"]
+        assert restored["source"] == "bucket"
+        assert [p["page"] for p in restored["pages"]] == [p["page"] for p in original["pages"]]
+        assert [list(p["lines"]) for p in restored["pages"]] == [p["lines"] for p in original["pages"]]
+        assert list(restored["paragraphs"]) == build_paragraphs(original)
+
+    stats = snapshot.stats()
+    assert stats["documents"] == len(documents)
+    assert stats[TERMS] > 0 and stats[GRAMS] > 0
+
+
+def test_snapshot_subtree(snapshot_pair):
+    documents, snapshot = snapshot_pair
+    subtree = snapshot.documents("dir/sub1/")
+    assert [doc["full_path"] for doc in subtree] == [doc["full_path"] for doc in documents
+                                                     if doc["full_path"].startswith("dir/sub1/")]
+
+
+@pytest.mark.parametrize("match_type,show_mode", list(itertools.product(["full", "partial"], ["line", "paragraph"])))
+def test_snapshot_search_matches_in_memory(monkeypatch, snapshot_pair, match_type, show_mode):
+    """Searching the mapped documents (through the snapshot's postings) equals searching the originals."""
+    documents, snapshot = snapshot_pair
+    monkeypatch.setattr(search_core, "SEARCH_INDEX", SearchIndex())
+    for query, mode in itertools.product(QUERIES, ["any", "all"]):
+        words = query.split()
+        mapped = list(search_core.iter_keyword_matches(snapshot.documents(), words, mode=mode,
+                                                       match_type=match_type, show_mode=show_mode))
+        plain = list(search_core.iter_keyword_matches(documents, words, mode=mode,
+                                                      match_type=match_type, show_mode=show_mode))
+        assert mapped == plain, (query, mode)
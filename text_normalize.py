@@ -0,0 +1,96 @@
+import os
+import re
+import unicodedata
+from typing import Dict, List, Any, Optional, Sequence, Tuple
+
+# Search-side text normalization. Every line gets a "shadow" copy at the
+# moment its document enters a cache (page_entry["norm_lines"]), so queries
+# compare pre-normalized text instead of lowercasing every line again:
+#   - Unicode NFKC (ligatures, full-width forms, presentation forms...)
+#   - casefold (like lower(), but also ß -> ss, final sigma -> sigma, ...)
+#   - Hebrew (SEARCH_FOLD_HEBREW, on by default): niqqud and cantillation
+#     marks are dropped and final letters (ך ם ן ף ץ) become regular ones,
+#     so "שָׁלוֹם" and "שלום" match each other.
+# Query words go through the same normalize_text(). Highlights are found on
+# the normalized text and mapped back to the original (normalize_with_origins).
+NORMALIZED_LINES_KEY = "norm_lines"
+# Document-level counterpart: the paragraph segmentation with each
+# paragraph's normalized text (document_parsers.attach_paragraphs).
+PARAGRAPHS_KEY = "paragraphs"
+FOLD_HEBREW = os.environ.get("SEARCH_FOLD_HEBREW", "1") != "0"
+
+# Points and accents inside the Hebrew block; maqaf, paseq, sof pasuq and
+# the punctuation marks stay (they separate words).
+_HEBREW_MARKS = re.compile("[\u0591-\u05bd\u05bf\u05c1\u05c2\u05c4\u05c5\u05c7]")
+_HEBREW_FINALS = str.maketrans("ךםןףץ", "כמנפצ")
+
+
+def normalize_text(text: str) -> str:
+    """The form lines and query words are compared in."""
+    if text.isascii():
+        return text.lower()  # NFKC and casefold add nothing for ASCII
+    text = unicodedata.normalize("NFKC", text).casefold()
+    if FOLD_HEBREW:
+        text = _HEBREW_MARKS.sub("", text).translate(_HEBREW_FINALS)
+    return text
+
+
+def normalize_with_origins(text: str) -> Tuple[str, Optional[List[Tuple[int, int]]]]:
+    """
+    normalize_text(text) and, for every character of it, the (start, end) of
+    the original characters it came from: a letter with its niqqud, a
+    ligature split into several letters... None when the text cannot be
+    normalized piecewise (the caller falls back to the original text).
+    """
+    if text.isascii():
+        return text.lower(), [(i, i + 1) for i in range(len(text))]
+    pieces, origins = [], []
+    start = 0
+    for end in range(1, len(text) + 1):
+        if end < len(text) and unicodedata.combining(text[end]):
+            continue  # marks are normalized together with their base letter
+        piece = normalize_text(text[start:end])
+        pieces.append(piece)
+        origins.extend([(start, end)] * len(piece))
+        start = end
+    normalized = "".join(pieces)
+    if normalized != normalize_text(text):  # e.g. composition across base letters
+        return normalize_text(text), None
+    return normalized, origins
+
+
+def normalize_lines(lines: Sequence[str]) -> List[str]:
+    """Shadow copy of lines; a line that is already normalized is shared, not duplicated."""
+    shadow = []
+    for line in lines:
+        line = line if isinstance(line, str) else str(line)
+        normalized = normalize_text(line)
+        shadow.append(line if normalized == line else normalized)
+    return shadow
+
+
+def attach_normalized_lines(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Stores the shadow copy next to every page's lines (once per document).
+    Only plain dict documents are touched; snapshot documents carry their own.
+    """
+    pages = doc.get("pages") if isinstance(doc, dict) else None
+    if isinstance(pages, list):
+        for page_entry in pages:
+            if not isinstance(page_entry, dict):
+                continue
+            lines = page_entry.get("lines") or []
+            shadow = page_entry.get(NORMALIZED_LINES_KEY)
+            if shadow is None or len(shadow) != len(lines):
+                page_entry[NORMALIZED_LINES_KEY] = normalize_lines(lines)
+    return doc
+
+
+def page_normalized_lines(page_entry: Dict[str, Any]) -> Sequence[str]:
+    """The page's shadow lines; computed on the spot for pages that were never attached."""
+    shadow = page_entry.get(NORMALIZED_LINES_KEY)
+    lines = page_entry.get("lines") or []
+    if shadow is not None and len(shadow) == len(lines):
+        return shadow
+    return normalize_lines(lines)
+